@@ -1,127 +1,324 @@
-# # backend/agents/email_watcher.py
-# import imaplib
-# import email
-# import os
-# import time
-# import logging
-# from backend.main import process_invoice 
-# from dotenv import load_dotenv 
-# load_dotenv()
+# agents/email_watcher.py
+"""
+Email agent: pulls invoice attachments from every user's IMAP inbox.
 
-# logging.basicConfig(level=logging.INFO)
+One asyncio loop holds a persistent connection per account (users with
+imap_user set; imap_host may be host, host:port, imaps://host:port or
+imap://host:port for plain text):
 
-# EMAIL_USER = os.getenv("INVOICE_EMAIL_USER")
-# EMAIL_PASS = os.getenv("INVOICE_EMAIL_PASS")
-# INBOX_FOLDER = "INBOX"
-# DOWNLOAD_DIR = "incoming_invoices"
+- servers that advertise IDLE push new mail; the connection re-IDLEs every
+  EMAIL_IDLE_SECONDS (RFC 2177 asks for < 29 min)
+- others are polled every EMAIL_POLL_INTERVAL, staggered per account so the
+  sweeps do not all start at once
+- at most EMAIL_MAX_CONCURRENCY IMAP commands (connect + login, search,
+  fetch) are in flight across all accounts; a sweep takes a slot per command
+  and not while its attachments wait for the pipeline, which runs them on
+  EMAIL_PIPELINE_WORKERS threads
+- a failing account reconnects with exponential backoff without holding up
+  the others; accounts are re-read from the DB every EMAIL_ACCOUNT_REFRESH
 
-# os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+New mail is tracked by UID, not by the \\Seen flag (which users toggle): the
+`email_sync_state` table keeps UIDVALIDITY and the last processed UID per
+mailbox, so users' read state is left alone. A sweep reads BODYSTRUCTURE
+first and fetches only the PDF/JPG/PNG attachment sections, decoded in memory
+and handed to the pipeline without touching the disk
+(EMAIL_FETCH_STRATEGY=full fetches whole messages instead).
+"""
+import asyncio
+import email
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
-# def fetch_invoices_from_email():
-#     try:
-#         mail = imaplib.IMAP4_SSL("imap.gmail.com")
-#         mail.login(EMAIL_USER, EMAIL_PASS)
-#         mail.select(INBOX_FOLDER)
+from dotenv import load_dotenv
 
-#         # Search for unread emails
-#         _, search_data = mail.search(None, '(UNSEEN)')
+from backend import heartbeat
+from backend.db import get_conn, init_db
+from backend.imap_client import AsyncIMAP, body_parts, decode_part
+from backend.document import Document
+from backend.pipeline import process_document
+from backend.uploads import MAX_UPLOAD_BYTES
 
-#         for num in search_data[0].split():
-#             _, data = mail.fetch(num, "(RFC822)")
-#             raw_email = data[0][1]
-#             msg = email.message_from_bytes(raw_email)
+load_dotenv()
 
-#             for part in msg.walk():
-#                 if part.get_content_maintype() == "multipart":
-#                     continue
-#                 if part.get("Content-Disposition") is None:
-#                     continue
+logging.basicConfig(level=logging.INFO)
 
-#                 filename = part.get_filename()
-#                 if filename and (filename.endswith(".pdf") or filename.endswith(".jpg") or filename.endswith(".png")):
-#                     filepath = os.path.join(DOWNLOAD_DIR, filename)
-#                     with open(filepath, "wb") as f:
-#                         f.write(part.get_payload(decode=True))
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "600"))       # seconds, servers without IDLE
+EMAIL_IDLE_SECONDS = float(os.getenv("EMAIL_IDLE_SECONDS", str(25 * 60)))  # re-issue IDLE this often
+EMAIL_MAX_CONCURRENCY = int(os.getenv("EMAIL_MAX_CONCURRENCY", "20"))      # IMAP commands in flight at once
+EMAIL_PIPELINE_WORKERS = int(os.getenv("EMAIL_PIPELINE_WORKERS", "4"))
+EMAIL_ACCOUNT_REFRESH = float(os.getenv("EMAIL_ACCOUNT_REFRESH", "300"))   # re-read accounts from the DB
+EMAIL_AGENT_TICK = float(os.getenv("EMAIL_AGENT_TICK", "5"))               # agent loop heartbeat, seconds
+EMAIL_CONNECT_TIMEOUT = float(os.getenv("EMAIL_CONNECT_TIMEOUT", "30"))
+EMAIL_RECONNECT_MAX = float(os.getenv("EMAIL_RECONNECT_MAX", "300"))       # backoff cap after failures
+EMAIL_FETCH_STRATEGY = os.getenv("EMAIL_FETCH_STRATEGY", "parts")          # parts | full
+EMAIL_FETCH_BATCH = int(os.getenv("EMAIL_FETCH_BATCH", "50"))              # BODYSTRUCTUREs per UID FETCH
 
-#                     logging.info(f" Downloaded new invoice: {filename}")
+MAILBOX = "INBOX"
 
-#                     try:
-#                         result = process_invoice(filepath)
-#                         logging.info(f"Processed invoice from email: {result}")
-#                     except Exception as e:
-#                         logging.error(f" Error processing {filename}: {e}")
+INVOICE_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
 
-#         mail.logout()
 
-#     except Exception as e:
-#         logging.error(f" Email watcher error: {e}")
+def get_users_with_imap():
+    cur = get_conn().cursor()  # pooled per-thread connection, not closed here
+    cur.execute("SELECT id, imap_host, imap_user, imap_pass FROM users WHERE imap_user IS NOT NULL AND imap_user != ''")
+    rows = cur.fetchall()
+    cur.close()
+    return rows
 
 
-# def start_email_watcher(interval=600):
-#     logging.info(" Starting email watcher (checks every 10 min)...")
-#     while True:
-#         fetch_invoices_from_email()
-#         time.sleep(interval)
+# ---------------- UID WATERMARK ----------------
+def load_sync_state(user_id: int, mailbox: str = MAILBOX):
+    """(uidvalidity, last_uid), or (None, 0) if this mailbox was never swept."""
+    row = get_conn().execute(
+        "SELECT uidvalidity, last_uid FROM email_sync_state WHERE user_id = ? AND mailbox = ?", (user_id, mailbox)
+    ).fetchone()
+    return (row[0], row[1]) if row else (None, 0)
 
 
-# agents/email_watcher.py
-import imaplib, email, os, time, logging, sqlite3
-from backend.db import get_conn
-from backend.main import process_invoice  # ensure relative path works when running from project root
+def save_sync_state(user_id: int, uidvalidity: int, last_uid: int, mailbox: str = MAILBOX):
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO email_sync_state (user_id, mailbox, uidvalidity, last_uid, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, mailbox) DO UPDATE SET
+                uidvalidity = excluded.uidvalidity, last_uid = excluded.last_uid, updated_at = excluded.updated_at
+            """,
+            (user_id, mailbox, uidvalidity, last_uid, time.time())
+        )
 
-logging.basicConfig(level=logging.INFO)
-DOWNLOAD_DIR = "incoming_invoices"
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
-def get_users_with_imap():
-    conn = get_conn(); cur = conn.cursor()
-    cur.execute("SELECT id, imap_host, imap_user, imap_pass FROM users WHERE imap_user IS NOT NULL AND imap_user != ''")
-    rows = cur.fetchall()
-    conn.close()
-    return rows
+# ---------------- ATTACHMENTS ----------------
+def is_invoice_name(filename: Optional[str]) -> bool:
+    return bool(filename) and filename.lower().endswith(INVOICE_EXTENSIONS)
+
+
+def invoice_parts(structure: list) -> list:
+    """BODYSTRUCTURE leaf parts worth fetching: invoice attachments within the upload limit."""
+    wanted = []
+    for part in body_parts(structure):
+        if not is_invoice_name(part["filename"]):
+            continue
+        decoded_size = part["size"] * 3 // 4 if part["encoding"] == "base64" else part["size"]
+        if decoded_size > MAX_UPLOAD_BYTES:
+            logging.warning(f"Skipping attachment {part['filename']}: about {decoded_size} bytes, limit {MAX_UPLOAD_BYTES}")
+            continue
+        wanted.append(part)
+    return wanted
+
+
+def invoice_attachments(raw: bytes):
+    """(filename, content) for every PDF/JPG/PNG attachment of a raw RFC822 message."""
+    msg = email.message_from_bytes(raw)
+    for part in msg.walk():
+        if part.get_content_maintype() == "multipart":
+            continue
+        if part.get("Content-Disposition") is None:
+            continue
+        filename = part.get_filename()
+        if is_invoice_name(filename):
+            yield filename, part.get_payload(decode=True)
+
+
+def process_attachment(user_id: int, filename: str, content: bytes):
+    """Runs on the pipeline pool; the attachment only ever exists in memory."""
+    with heartbeat.working("email-pipeline"):
+        result = process_document(Document.from_bytes(content, user_id, "email", filename))
+    logging.info(f"Processed {filename} for user {user_id}: {result.get('status')} {result.get('invoice_id', '')}")
+    return result
+
+
+# ---------------- PER-ACCOUNT WATCHER ----------------
+class MailboxWatcher:
+    def __init__(self, agent: "EmailAgent", user_id: int, host: str, imap_user: str, imap_pass: str):
+        self.agent = agent
+        self.user_id = user_id
+        self.host, self.imap_user, self.imap_pass = host, imap_user, imap_pass
+        self.imap: Optional[AsyncIMAP] = None
+        self.task: Optional[asyncio.Task] = None
+        self.mailbox = {}     # SELECT result: EXISTS, UIDVALIDITY, UIDNEXT
+
+    @property
+    def credentials(self):
+        return self.host, self.imap_user, self.imap_pass
+
+    def stagger(self) -> float:
+        """Fixed per-account offset into the poll interval (golden-ratio spread over user ids)."""
+        return EMAIL_POLL_INTERVAL * ((self.user_id * 0.6180339887) % 1.0)
 
-def fetch_for_user(user_row):
-    user_id, host, imap_user, imap_pass = user_row
-    try:
-        mail = imaplib.IMAP4_SSL(host, timeout=30)
-        mail.login(imap_user, imap_pass)
-        mail.select("INBOX")
-        typ, data = mail.search(None, '(UNSEEN)')
-        if typ != 'OK':
-            mail.logout()
-            return
-        for num in data[0].split():
-            typ, msg_data = mail.fetch(num, "(RFC822)")
-            if typ != 'OK':
-                continue
-            raw = msg_data[0][1]
-            msg = email.message_from_bytes(raw)
-            for part in msg.walk():
-                if part.get_content_maintype() == "multipart": continue
-                if part.get("Content-Disposition") is None: continue
-                filename = part.get_filename()
-                if filename and filename.lower().endswith((".pdf", ".jpg", ".jpeg", ".png")):
-                    local_path = os.path.join(DOWNLOAD_DIR, f"user{user_id}_{int(time.time())}_{filename}")
-                    with open(local_path, "wb") as f:
-                        f.write(part.get_payload(decode=True))
-                    logging.info(f"Downloaded invoice for user {user_id}: {local_path}")
+    async def connect(self):
+        self.imap = AsyncIMAP.from_url(self.host, timeout=EMAIL_CONNECT_TIMEOUT)
+        await self.imap.connect()
+        await self.imap.login(self.imap_user, self.imap_pass)
+        self.mailbox = await self.imap.select(MAILBOX)
+
+    async def run(self):
+        failures = 0
+        while True:
+            try:
+                async with self.agent.slots:
+                    await self.connect()
+                failures = 0
+                await self.sweep()
+                if "IDLE" in self.imap.capabilities:
+                    while True:
+                        await self.imap.idle(EMAIL_IDLE_SECONDS)
+                        await self.sweep()
+                else:
+                    await asyncio.sleep(self.stagger())
+                    while True:
+                        await self.sweep()
+                        await asyncio.sleep(EMAIL_POLL_INTERVAL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                delay = min(EMAIL_RECONNECT_MAX, 5 * 2 ** (failures - 1)) * random.uniform(0.8, 1.2)
+                logging.warning(f"Mailbox of user {self.user_id} failed ({e}); reconnecting in {delay:.0f}s")
+                await asyncio.sleep(delay)
+            finally:
+                if self.imap:
+                    await self.imap.close()
+                    self.imap = None
+
+    async def new_uids(self):
+        """
+        (uids to process, watermark before them, watermark once all are done).
+        The watermark only passes a UID after that message went through, so a
+        restart mid-sweep resumes at the first unprocessed one.
+        """
+        uidvalidity = self.mailbox.get("UIDVALIDITY")
+        stored_validity, last_uid = await asyncio.to_thread(load_sync_state, self.user_id)
+        if stored_validity is not None and stored_validity == uidvalidity:
+            uids = await self.imap.uid_search(f"UID {last_uid + 1}:*")
+            uids = [uid for uid in uids if uid > last_uid]   # "n:*" always matches the newest message
+            return uids, last_uid, last_uid
+
+        # First sweep, or the server renumbered the mailbox: old UIDs mean nothing,
+        # so take what is unread and count from the current end once it is done
+        if stored_validity is not None:
+            logging.warning(f"UIDVALIDITY of user {self.user_id}'s mailbox changed, rescanning unread mail")
+        uids = await self.imap.uid_search("UNSEEN")
+        end = max(self.mailbox.get("UIDNEXT", 1) - 1, 0)
+        return uids, (min(uids) - 1 if uids else end), end
+
+    async def fetch_attachments(self, uid: int, items: dict):
+        """Decoded invoice attachments of one message: only their sections, or the whole message as a fallback."""
+        if EMAIL_FETCH_STRATEGY != "full" and items.get("BODYSTRUCTURE"):
+            try:
+                parts = invoice_parts(items["BODYSTRUCTURE"])
+            except Exception:
+                logging.exception(f"Unreadable BODYSTRUCTURE for UID {uid} (user {self.user_id}), fetching it whole")
+            else:
+                if not parts:
+                    return []
+                sections = " ".join(f"BODY.PEEK[{p['section']}]" for p in parts)
+                async with self.agent.slots:
+                    data = (await self.imap.uid_fetch(str(uid), f"({sections})")).get(uid, {})
+                return [
+                    (p["filename"], decode_part(data.get(f"BODY[{p['section']}]") or b"", p["encoding"]))
+                    for p in parts
+                ]
+
+        async with self.agent.slots:
+            data = (await self.imap.uid_fetch(str(uid), "(BODY.PEEK[])")).get(uid, {})
+        return list(invoice_attachments(data.get("BODY[]") or b""))
+
+    async def sweep(self):
+        """Process messages past the stored UID; the watermark moves after each message went through."""
+        async with self.agent.slots:
+            self.imap.new_mail = False
+            uids, watermark, end = await self.new_uids()
+        uidvalidity = self.mailbox.get("UIDVALIDITY") or 0
+
+        for start in range(0, len(uids), EMAIL_FETCH_BATCH):
+            batch = sorted(uids)[start:start + EMAIL_FETCH_BATCH]
+            structures = {}
+            if EMAIL_FETCH_STRATEGY != "full":
+                async with self.agent.slots:
+                    structures = await self.imap.uid_fetch(",".join(map(str, batch)), "(BODYSTRUCTURE)")
+
+            for uid in batch:
+                for filename, content in await self.fetch_attachments(uid, structures.get(uid, {})):
                     try:
-                        validated = process_invoice(local_path, user_id=user_id)
-                        logging.info(f"Processed invoice for user {user_id}: {validated}")
-                    except Exception as e:
-                        logging.exception(f"Processing failed for {local_path}: {e}")
-            mail.store(num, '+FLAGS', '\\Seen')
-        mail.logout()
-    except Exception:
-        logging.exception(f"Failed to fetch emails for user {user_id}")
-
-def run_email_watcher(interval=600):
-    logging.info("Starting multi-user email watcher...")
-    while True:
-        users = get_users_with_imap()
-        for u in users:
-            fetch_for_user(u)
-        time.sleep(interval)
+                        await self.agent.run_pipeline(self.user_id, filename, content)
+                    except Exception:
+                        logging.exception(f"Processing failed for {filename} (user {self.user_id})")
+                watermark = max(watermark, uid)
+                await asyncio.to_thread(save_sync_state, self.user_id, uidvalidity, watermark)
+
+        if end > watermark or not uids:
+            await asyncio.to_thread(save_sync_state, self.user_id, uidvalidity, max(watermark, end))
+
+
+# ---------------- AGENT ----------------
+class EmailAgent:
+    """Keeps one MailboxWatcher task per configured account."""
+
+    def __init__(self, max_concurrency: int = EMAIL_MAX_CONCURRENCY, pipeline_workers: int = EMAIL_PIPELINE_WORKERS):
+        self.slots = asyncio.Semaphore(max_concurrency)    # held around each IMAP command, not a whole sweep
+        self.executor = ThreadPoolExecutor(max_workers=pipeline_workers, thread_name_prefix="email-pipeline")
+        self.watchers: Dict[int, MailboxWatcher] = {}
+
+    async def run_pipeline(self, user_id: int, filename: str, content: bytes):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, process_attachment, user_id, filename, content)
+
+    async def refresh_accounts(self):
+        """Start watchers for new accounts, restart changed ones, stop removed ones."""
+        rows = await asyncio.to_thread(get_users_with_imap)
+        current = {user_id: (host, imap_user, imap_pass) for user_id, host, imap_user, imap_pass in rows if host}
+
+        for user_id, watcher in list(self.watchers.items()):
+            if current.get(user_id) != watcher.credentials:
+                watcher.task.cancel()
+                del self.watchers[user_id]
+
+        for user_id, (host, imap_user, imap_pass) in current.items():
+            if user_id not in self.watchers:
+                watcher = MailboxWatcher(self, user_id, host, imap_user, imap_pass)
+                watcher.task = asyncio.create_task(watcher.run(), name=f"mailbox-{user_id}")
+                self.watchers[user_id] = watcher
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        stop = stop or asyncio.Event()
+        logging.info("Starting multi-user email agent...")
+        next_refresh = 0.0
+        try:
+            while not stop.is_set():
+                # Beats only while the event loop is responsive, i.e. nothing blocks it
+                heartbeat.beat("email-agent")
+                if time.monotonic() >= next_refresh:
+                    await self.refresh_accounts()
+                    next_refresh = time.monotonic() + EMAIL_ACCOUNT_REFRESH
+                try:
+                    await asyncio.wait_for(stop.wait(), EMAIL_AGENT_TICK)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            heartbeat.forget("email-agent")
+            for watcher in self.watchers.values():
+                watcher.task.cancel()
+            await asyncio.gather(*(w.task for w in self.watchers.values()), return_exceptions=True)
+            self.watchers.clear()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_email_watcher(interval: Optional[float] = None):
+    global EMAIL_POLL_INTERVAL
+    if interval is not None:
+        EMAIL_POLL_INTERVAL = float(interval)
+    init_db()
+    asyncio.run(EmailAgent().run())
+
+
+start_email_watcher = run_email_watcher  # name agents/workflow_agent.py imports
+
 
 if __name__ == "__main__":
-    run_email_watcher(600)
+    run_email_watcher()
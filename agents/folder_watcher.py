@@ -1,46 +1,332 @@
-# backend/agents/folder_watcher.py
+# agents/folder_watcher.py
+"""
+Watches WATCH_DIR and runs every new invoice through the pipeline.
+
+The watchdog observer thread only enqueues paths into a bounded queue; a pool
+of FOLDER_WATCHER_WORKERS threads drains it, so a slow document no longer
+stalls the events behind it. When the queue is full the observer blocks
+(inotify keeps buffering in the kernel) instead of growing memory.
+
+A file is processed once its writer is done: right away on IN_CLOSE_WRITE
+(watchdog's on_closed, Linux), otherwise once size and mtime have not changed
+for FOLDER_SETTLE_SECONDS. Processed files go to DONE_DIR, failures to
+FAILED_DIR next to a <name>.error.txt with the reason.
+
+Every file is recorded in the `folder_ledger` table (path, size, mtime,
+content hash, status). On startup reconcile() scans WATCH_DIR once with
+os.scandir and queues only files the ledger has not finished with the same
+size and mtime, so drops made while the agent was down are picked up and a
+crash between "processed" and "moved" does not process a file twice.
+"""
 import os
+import queue
+import shutil
+import threading
 import time
 import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from backend.main import process_invoice
+
+from backend import heartbeat
+from backend.db import init_db, get_conn
+from backend.document import Document
+from backend.pipeline import process_document
+from backend.uploads import MAX_UPLOAD_BYTES
+
+load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 
-WATCH_DIR = "backend/agents/incoming_invoices"
+WATCH_DIR = os.getenv("FOLDER_WATCH_DIR", "agents/incoming_invoices")
+DONE_DIR = os.getenv("FOLDER_DONE_DIR", os.path.join(WATCH_DIR, "done"))
+FAILED_DIR = os.getenv("FOLDER_FAILED_DIR", os.path.join(WATCH_DIR, "failed"))
+FOLDER_WATCHER_USER_ID = int(os.getenv("FOLDER_WATCHER_USER_ID", "1"))     # owner of dropped invoices
+FOLDER_WATCHER_WORKERS = int(os.getenv("FOLDER_WATCHER_WORKERS", "4"))
+FOLDER_WATCHER_QUEUE_SIZE = int(os.getenv("FOLDER_WATCHER_QUEUE_SIZE", "100"))
+FOLDER_SETTLE_SECONDS = float(os.getenv("FOLDER_SETTLE_SECONDS", "1.0"))   # unchanged this long = written
+FOLDER_SETTLE_TIMEOUT = float(os.getenv("FOLDER_SETTLE_TIMEOUT", "300"))   # give up on files still growing
+
+INVOICE_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
+
+
+def is_invoice_file(path: str) -> bool:
+    name = os.path.basename(path)
+    return not name.startswith(".") and name.lower().endswith(INVOICE_EXTENSIONS)
+
+
+# ---------------- WRITE COMPLETION ----------------
+def wait_until_stable(path: str, settle: float = FOLDER_SETTLE_SECONDS, timeout: float = FOLDER_SETTLE_TIMEOUT,
+                      closed: Callable[[], bool] = lambda: False) -> bool:
+    """
+    True once size and mtime stay unchanged for `settle` seconds, or as soon
+    as closed() reports the writer is done; False if the file vanished or
+    never settled.
+    """
+    deadline = time.monotonic() + timeout
+    last = None
+    stable_since = time.monotonic()
+    while time.monotonic() < deadline:
+        if closed():
+            return os.path.exists(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        current = (st.st_size, st.st_mtime_ns)
+        if current != last:
+            last, stable_since = current, time.monotonic()
+        elif time.monotonic() - stable_since >= settle:
+            return True
+        time.sleep(min(settle / 4, 0.5) or 0.05)
+    return False
+
+
+# ---------------- RESULT FOLDERS ----------------
+def _move(path: str, dest_dir: str) -> str:
+    """Move into dest_dir without overwriting an earlier file of the same name."""
+    os.makedirs(dest_dir, exist_ok=True)
+    name = os.path.basename(path)
+    dest = os.path.join(dest_dir, name)
+    if os.path.exists(dest):
+        stem, ext = os.path.splitext(name)
+        dest = os.path.join(dest_dir, f"{stem}_{int(time.time() * 1000)}{ext}")
+    shutil.move(path, dest)
+    return dest
+
+
+def mark_done(path: str) -> str:
+    return _move(path, DONE_DIR)
+
+
+def mark_failed(path: str, reason: str) -> str:
+    dest = _move(path, FAILED_DIR)
+    with open(dest + ".error.txt", "w") as f:
+        f.write(reason + "\n")
+    return dest
+
+
+# ---------------- LEDGER ----------------
+def ledger_record(path: str, st: os.stat_result, status: str, content_hash: Optional[str] = None,
+                  invoice_id: Optional[int] = None, error: Optional[str] = None):
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO folder_ledger (path, size, mtime_ns, content_hash, status, invoice_id, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                size = excluded.size, mtime_ns = excluded.mtime_ns,
+                content_hash = COALESCE(excluded.content_hash, content_hash),
+                status = excluded.status, invoice_id = excluded.invoice_id,
+                error = excluded.error, updated_at = excluded.updated_at
+            """,
+            (path, st.st_size, st.st_mtime_ns, content_hash, status, invoice_id, error, time.time())
+        )
+
+
+def ledger_snapshot() -> Dict[str, Tuple[int, int, str]]:
+    """path -> (size, mtime_ns, status) for every file under WATCH_DIR, in one query."""
+    prefix = os.path.join(os.path.abspath(WATCH_DIR), "")
+    rows = get_conn().execute(
+        "SELECT path, size, mtime_ns, status FROM folder_ledger WHERE substr(path, 1, ?) = ?",
+        (len(prefix), prefix)
+    )
+    return {path: (size, mtime_ns, status) for path, size, mtime_ns, status in rows}
+
+
+def scan_backlog() -> Tuple[List[Tuple[str, float]], List[Tuple[str, str]]]:
+    """
+    One os.scandir pass over WATCH_DIR against the ledger. Returns (to_process,
+    to_file): (path, mtime) of new or changed files, oldest first, and
+    (path, status) for files the ledger already finished but that were never
+    moved out.
+    """
+    known = ledger_snapshot()
+    to_process, to_file = [], []
+    with os.scandir(WATCH_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False) or not is_invoice_file(entry.name):
+                continue
+            path = os.path.abspath(entry.path)
+            st = entry.stat(follow_symlinks=False)
+            seen = known.get(path)
+            if seen and seen[:2] == (st.st_size, st.st_mtime_ns) and seen[2] in ("done", "failed"):
+                to_file.append((path, seen[2]))
+            else:
+                to_process.append((path, st.st_mtime))
+    to_process.sort(key=lambda item: item[1])
+    return to_process, to_file
 
-class InvoiceHandler(FileSystemEventHandler):
-    def on_created(self, event):
-        if event.is_directory:
-            return
 
-        if not (event.src_path.endswith(".pdf") or event.src_path.endswith(".jpg") or event.src_path.endswith(".png")):
+# ---------------- WORKER POOL ----------------
+class FolderWorkerPool:
+    """Bounded queue of paths + worker threads that process and file them."""
+
+    def __init__(self, workers: int = FOLDER_WATCHER_WORKERS, queue_size: int = FOLDER_WATCHER_QUEUE_SIZE,
+                 user_id: int = FOLDER_WATCHER_USER_ID):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._pending = set()         # queued or in progress; created + closed events arrive for one file
+        self._closed = set()          # pending files whose writer has closed them
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"folder-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        for _ in self._threads:
+            self.queue.put(None)
+        for t in self._threads:
+            t.join()
+
+    def submit(self, path: str, closed: bool = False):
+        """Queue a file (blocks while the queue is full). closed=True: the writer is known to be done."""
+        path = os.path.abspath(path)
+        with self._lock:
+            if closed:
+                self._closed.add(path)
+            if path in self._pending:
+                return
+            self._pending.add(path)
+        self.queue.put(path)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.handle(item)
+            except Exception:
+                logging.exception(f"Folder worker crashed on {item}")
+            finally:
+                with self._lock:
+                    self._pending.discard(item)
+                    self._closed.discard(item)
+
+    def handle(self, path: str):
+        if not wait_until_stable(path, closed=lambda: path in self._closed):
+            if os.path.exists(path):
+                logging.warning(f"File never finished writing, skipped: {path}")
+            return
+        if not os.path.exists(path):
             return
 
-        filepath = event.src_path
-        logging.info(f" New file detected: {filepath}")
+        st = os.stat(path)
+        if st.st_size > MAX_UPLOAD_BYTES:
+            error = f"File is {st.st_size} bytes, limit is {MAX_UPLOAD_BYTES}"
+            ledger_record(path, st, "failed", error=error)
+            mark_failed(path, error)
+            return
 
+        document = Document.from_path(path, self.user_id, "folder")
+        content_hash = None
         try:
-            time.sleep(1)  # Wait for file to finish writing
-            result = process_invoice(filepath)
-            logging.info(f" Processed invoice successfully: {result}")
+            with heartbeat.working("folder-worker"):
+                # Hashed once: the pipeline reuses it for its duplicate check
+                content_hash = document.content_hash
+                ledger_record(path, st, "processing", content_hash)
+                result = process_document(document)
         except Exception as e:
-            logging.error(f" Error processing invoice {filepath}: {e}")
+            logging.error(f" Error processing invoice {path}: {e}")
+            result = {"status": "failed", "error": str(e)}
+        finally:
+            document.close()
+
+        if result.get("status") == "success":
+            ledger_record(path, st, "done", content_hash, invoice_id=result.get("invoice_id"))
+            dest = mark_done(path)
+            logging.info(f" Processed invoice {dest}: invoice_id={result.get('invoice_id')}")
+        else:
+            error = result.get("error") or "Unknown error"
+            ledger_record(path, st, "failed", content_hash, error=error)
+            dest = mark_failed(path, error)
+            logging.warning(f" Invoice failed, moved to {dest}: {error}")
+
+
+def reconcile(pool: FolderWorkerPool) -> int:
+    """Startup catch-up: queue unseen/changed files, finish interrupted moves. Returns files queued."""
+    started = time.perf_counter()
+    to_process, to_file = scan_backlog()
+    for path, status in to_file:
+        if status == "done":
+            mark_done(path)
+        else:
+            mark_failed(path, "Failed before restart (see folder_ledger)")
+
+    # Files older than the settle window were written before we started
+    settled_before = time.time() - FOLDER_SETTLE_SECONDS
+    logging.info(f" Folder backlog: {len(to_process)} file(s) to process, {len(to_file)} already handled "
+                 f"(scan took {time.perf_counter() - started:.3f}s)")
+    for path, mtime in to_process:
+        pool.submit(path, closed=mtime < settled_before)
+    return len(to_process)
 
 
-def start_folder_watcher():
+# ---------------- WATCHDOG ----------------
+class InvoiceHandler(FileSystemEventHandler):
+    def __init__(self, pool: FolderWorkerPool):
+        super().__init__()
+        self.pool = pool
+
+    def _submit(self, path: str, closed: bool = False):
+        if is_invoice_file(path) and os.path.dirname(os.path.abspath(path)) == os.path.abspath(WATCH_DIR):
+            logging.info(f" New file detected: {path}")
+            self.pool.submit(path, closed)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._submit(event.src_path)
+
+    def on_moved(self, event):
+        # Atomic "write to temp name, then rename" drops arrive as moves
+        if not event.is_directory:
+            self._submit(event.dest_path, closed=True)
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE: the writer closed the file, no need to poll its size
+        if not event.is_directory:
+            self._submit(event.src_path, closed=True)
+
+
+def start_folder_watcher(stop: Optional[threading.Event] = None):
+    """Blocks until KeyboardInterrupt (or `stop` is set)."""
     os.makedirs(WATCH_DIR, exist_ok=True)
-    event_handler = InvoiceHandler()
+    init_db()
+
+    pool = FolderWorkerPool()
+    pool.start()
     observer = Observer()
-    observer.schedule(event_handler, WATCH_DIR, recursive=False)
+    observer.schedule(InvoiceHandler(pool), WATCH_DIR, recursive=False)
     observer.start()
 
-    logging.info(f" Watching folder: {WATCH_DIR}")
+    # After the observer is running, so nothing dropped in between is missed
+    # (the pool ignores a path that is already queued)
+    threading.Thread(target=reconcile, args=(pool,), name="folder-reconcile", daemon=True).start()
+
+    logging.info(f" Watching folder: {WATCH_DIR} ({FOLDER_WATCHER_WORKERS} workers, user {FOLDER_WATCHER_USER_ID})")
+    stop = stop or threading.Event()
     try:
-        while True:
-            time.sleep(10)
+        while not stop.wait(10):
+            if not observer.is_alive():
+                raise RuntimeError("folder observer thread died")
+            heartbeat.beat("folder-watcher")
     except KeyboardInterrupt:
-        observer.stop()
+        pass
+    heartbeat.forget("folder-watcher")
 
+    observer.stop()
     observer.join()
+    pool.stop()
+
+
+if __name__ == "__main__":
+    start_folder_watcher()
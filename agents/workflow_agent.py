@@ -1,49 +1,284 @@
+# agents/workflow_agent.py
+"""
+Autonomous workflow agent: the API, the folder and email watchers, the job
+pipeline and the ERP outbox, started together.
+
+By default every role runs in its own process under a small supervisor, so
+OCR in the watchers no longer competes with request handling for one GIL:
+
+- api       uvicorn with WORKFLOW_API_WORKERS worker processes; the API only
+            enqueues jobs and writes the ERP outbox (JOB_DISPATCH=0,
+            ERP_OUTBOX_DISPATCH=0 in its environment)
+- pipeline  WORKFLOW_PIPELINE_PROCESSES processes, each a job dispatcher plus
+            a StagedPipeline; job claims are leases, so they share the queue
+- erp       one ERP outbox dispatcher and the Zoho token refresher
+- folder    the folder watcher (WORKFLOW_FOLDER_WATCHER=0 to disable)
+- email     the email agent (WORKFLOW_EMAIL_WATCHER=0 to disable)
+
+A child that exits, stops sending heartbeats for SUPERVISOR_HEALTH_TIMEOUT
+seconds or (api) fails SUPERVISOR_HEALTH_FAILURES health probes in a row is
+killed and restarted with exponential backoff. Heartbeats come from the
+roles' own work loops (job and outbox dispatchers, pipeline stages, folder
+workers, the email agent loop; see backend/heartbeat.py): a loop that stops
+going round or one document stuck in a stage for the timeout counts as hung,
+even though the process is still alive. Work in flight is not lost:
+jobs and outbox rows are leased, the folder ledger and email UID watermark
+pick up where the dead process stopped.
+
+    python agents/workflow_agent.py                      # supervisor
+    python agents/workflow_agent.py --api-workers 4 --pipeline-processes 2
+    python agents/workflow_agent.py --threads            # old single-process mode
+"""
 import sys, os
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(ROOT_DIR)
 
+import argparse
+import logging
+import multiprocessing
+import signal
 import threading
 import time
-import logging
-import uvicorn
-from folder_watcher import start_folder_watcher
-from email_watcher import start_email_watcher
-from backend.main import app
-
-# Make sure backend imports work
-# sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+import urllib.request
+from typing import Callable, Dict, List, Optional
 
+from dotenv import load_dotenv
 
+# Nothing from backend/ is imported at module level: spawned children import
+# this module too, and the API child must set its environment before
+# backend.main reads it.
 
+load_dotenv()
 
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+WORKFLOW_API_WORKERS = int(os.getenv("WORKFLOW_API_WORKERS", "2"))
+WORKFLOW_PIPELINE_PROCESSES = int(os.getenv("WORKFLOW_PIPELINE_PROCESSES", "1"))
+WORKFLOW_FOLDER_WATCHER = os.getenv("WORKFLOW_FOLDER_WATCHER", "1") == "1"
+WORKFLOW_EMAIL_WATCHER = os.getenv("WORKFLOW_EMAIL_WATCHER", "1") == "1"
+EMAIL_WATCHER_INTERVAL = float(os.getenv("EMAIL_WATCHER_INTERVAL", "600"))   # poll fallback without IDLE
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+SUPERVISOR_HEARTBEAT = float(os.getenv("SUPERVISOR_HEARTBEAT", "5"))           # child → supervisor, seconds
+SUPERVISOR_HEALTH_TIMEOUT = float(os.getenv("SUPERVISOR_HEALTH_TIMEOUT", "300"))  # hung loop/stage → restart
+SUPERVISOR_HEALTH_FAILURES = int(os.getenv("SUPERVISOR_HEALTH_FAILURES", "3"))  # failed /health probes → restart
+SUPERVISOR_STARTUP_GRACE = float(os.getenv("SUPERVISOR_STARTUP_GRACE", "60"))   # before the first probe counts
+SUPERVISOR_RESTART_MAX = float(os.getenv("SUPERVISOR_RESTART_MAX", "60"))       # backoff cap, seconds
+SUPERVISOR_STOP_TIMEOUT = float(os.getenv("SUPERVISOR_STOP_TIMEOUT", "15"))     # SIGTERM → SIGKILL
 
 
-def run_api():
+# ---------------- ROLES (run inside the child process) ----------------
+def run_api(workers: int = 1):
     """Run FastAPI app"""
-    logging.info(" Starting FastAPI Backend (Document Processing Agent)...")
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=False)
+    # Job and outbox dispatch live in their own processes under the supervisor
+    os.environ["JOB_DISPATCH"] = "0"
+    os.environ["ERP_OUTBOX_DISPATCH"] = "0"
+    # multiprocessing closed our stdin; uvicorn would hand its fd to the workers
+    sys.stdin = None
+    import uvicorn
+    logging.info(f" Starting FastAPI Backend (Document Processing Agent, {workers} worker(s))...")
+    uvicorn.run("backend.main:app", host=API_HOST, port=API_PORT, workers=workers, reload=False)
+
+
+def run_pipeline_worker():
+    """Claim jobs from the queue and run them through a StagedPipeline."""
+    from backend.db import init_db
+    from backend import job_queue
+    from backend.pipeline import StagedPipeline
+
+    init_db()
+    pipeline = StagedPipeline().start()
+    job_queue.start_job_dispatcher(pipeline.submit)
+    try:
+        while True:
+            time.sleep(SUPERVISOR_HEARTBEAT)
+            if not any(t.is_alive() for t in job_queue._dispatchers):
+                raise RuntimeError("job dispatcher thread died")
+    finally:
+        job_queue.stop_job_dispatcher()
+        pipeline.shutdown()
+
+
+def run_erp_worker():
+    """Push committed invoices from the outbox to Zoho."""
+    from backend.db import init_db
+    from backend import erp_outbox, zoho_auth
+
+    init_db()
+    zoho_auth.start_token_refresher()
+    erp_outbox.start_outbox_dispatcher()
+    try:
+        while True:
+            time.sleep(SUPERVISOR_HEARTBEAT)
+            if not any(t.is_alive() for t, _ in erp_outbox._dispatchers):
+                raise RuntimeError("ERP outbox dispatcher thread died")
+    finally:
+        erp_outbox.stop_outbox_dispatcher()
+        zoho_auth.stop_token_refresher()
 
 
 def run_folder_agent():
     """Run Folder Watcher"""
+    from agents.folder_watcher import start_folder_watcher
     logging.info(" Starting Folder Watcher Agent...")
     start_folder_watcher()
 
 
 def run_email_agent():
     """Run Email Watcher Agent"""
+    from agents.email_watcher import start_email_watcher
     logging.info(" Starting Email Watcher Agent...")
-    start_email_watcher(interval=600)  # every 10 minutes
+    start_email_watcher(interval=EMAIL_WATCHER_INTERVAL)
 
 
-if __name__ == "__main__":
-    logging.info(" Initializing Autonomous Workflow Agent...")
+def _heartbeat_loop(beat):
+    """Publish the stalest liveness mark of this process's work loops (backend/heartbeat.py)."""
+    from backend import heartbeat
+    while True:
+        beat.value = heartbeat.oldest()
+        time.sleep(SUPERVISOR_HEARTBEAT)
+
+
+def _child_main(name: str, target: Callable, args: tuple, beat):
+    """Entry point of every supervised process."""
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [%(levelname)s] [{name}] %(message)s", force=True)
+    # SIGTERM from the supervisor unwinds like Ctrl-C, so roles run their cleanup
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    beat.value = time.time()
+    threading.Thread(target=_heartbeat_loop, args=(beat,), name="heartbeat", daemon=True).start()
+    try:
+        target(*args)
+    except KeyboardInterrupt:
+        return
+    except Exception:
+        logging.exception(f"{name} crashed")
+        sys.exit(1)
+
 
-    # Run all in parallel
-    api_thread = threading.Thread(target=run_api, daemon=True)
+# ---------------- SUPERVISOR ----------------
+def api_healthy(timeout: float = 5) -> bool:
+    host = "127.0.0.1" if API_HOST in ("0.0.0.0", "") else API_HOST
+    try:
+        with urllib.request.urlopen(f"http://{host}:{API_PORT}/health", timeout=timeout) as resp:
+            return resp.status == 200
+    except Exception:
+        return False
+
+
+class Supervisor:
+    """
+    Starts one process per role and keeps them running. A child is restarted
+    when it exits, misses heartbeats, or fails its probe (if it has one);
+    restarts of the same role back off exponentially up to
+    SUPERVISOR_RESTART_MAX and reset once it has stayed up that long.
+    """
+
+    def __init__(self):
+        self.mp = multiprocessing.get_context("spawn")
+        self.children: List[Dict] = []
+        self.stopping = False
+
+    def add(self, name: str, target: Callable, args: tuple = (), probe: Optional[Callable[[], bool]] = None):
+        self.children.append({
+            "name": name, "target": target, "args": args, "probe": probe,
+            "process": None, "beat": self.mp.Value("d", 0.0), "started_at": 0.0,
+            "failures": 0, "restarts": 0, "next_start": 0.0,
+        })
+
+    def _start(self, child: Dict):
+        child["beat"].value = time.time()
+        process = self.mp.Process(
+            target=_child_main, name=child["name"],
+            args=(child["name"], child["target"], child["args"], child["beat"]),
+        )
+        process.start()
+        child.update(process=process, started_at=time.time(), failures=0)
+        logging.info(f"Started {child['name']} (pid {process.pid})")
+
+    def _stop(self, child: Dict):
+        process = child["process"]
+        if process is None:
+            return
+        if process.is_alive():
+            process.terminate()
+            process.join(SUPERVISOR_STOP_TIMEOUT)
+            if process.is_alive():
+                logging.warning(f"{child['name']} (pid {process.pid}) ignored SIGTERM, killing")
+                process.kill()
+                process.join()
+        child["process"] = None
+
+    def _restart_later(self, child: Dict, reason: str):
+        now = time.time()
+        if now - child["started_at"] > SUPERVISOR_RESTART_MAX:
+            child["restarts"] = 0
+        delay = min(SUPERVISOR_RESTART_MAX, 2 ** child["restarts"])
+        child["restarts"] += 1
+        child["next_start"] = now + delay
+        logging.error(f"{child['name']} {reason}; restarting in {delay:.0f}s")
+
+    def check(self, child: Dict):
+        process = child["process"]
+        if process is None:
+            if time.time() >= child["next_start"]:
+                self._start(child)
+            return
+
+        if not process.is_alive():
+            self._restart_later(child, f"exited with code {process.exitcode}")
+            child["process"] = None
+            return
+
+        if time.time() - child["beat"].value > SUPERVISOR_HEALTH_TIMEOUT:
+            self._stop(child)
+            self._restart_later(child, f"sent no heartbeat for {SUPERVISOR_HEALTH_TIMEOUT:.0f}s")
+            return
+
+        if child["probe"] and time.time() - child["started_at"] > SUPERVISOR_STARTUP_GRACE:
+            child["failures"] = 0 if child["probe"]() else child["failures"] + 1
+            if child["failures"] >= SUPERVISOR_HEALTH_FAILURES:
+                self._stop(child)
+                self._restart_later(child, f"failed {child['failures']} health checks")
+
+    def run(self):
+        """Blocks until SIGINT/SIGTERM, then stops every child."""
+        def request_stop(signum, frame):
+            self.stopping = True
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        logging.info(" Supervising: " + ", ".join(c["name"] for c in self.children))
+        while not self.stopping:
+            for child in self.children:
+                self.check(child)
+            time.sleep(1)
+
+        logging.info(" Stopping workflow agent...")
+        for child in self.children:
+            if child["process"] is not None and child["process"].is_alive():
+                child["process"].terminate()
+        for child in self.children:
+            self._stop(child)
+
+
+def build_supervisor(api_workers: int, pipeline_processes: int, folder: bool, email: bool) -> Supervisor:
+    supervisor = Supervisor()
+    supervisor.add("api", run_api, (api_workers,), probe=api_healthy)
+    for i in range(pipeline_processes):
+        supervisor.add(f"pipeline-{i}", run_pipeline_worker)
+    supervisor.add("erp", run_erp_worker)
+    if folder:
+        supervisor.add("folder", run_folder_agent)
+    if email:
+        supervisor.add("email", run_email_agent)
+    return supervisor
+
+
+# ---------------- SINGLE-PROCESS MODE ----------------
+def run_threads():
+    """Everything in one interpreter, as daemon threads (development)."""
+    api_thread = threading.Thread(target=run_api_in_process, daemon=True)
     folder_thread = threading.Thread(target=run_folder_agent, daemon=True)
     email_thread = threading.Thread(target=run_email_agent, daemon=True)
 
@@ -56,3 +291,34 @@ if __name__ == "__main__":
             time.sleep(10)
     except KeyboardInterrupt:
         logging.info(" Workflow Agent stopped manually.")
+
+
+def run_api_in_process():
+    import uvicorn
+    from backend.main import app
+    logging.info(" Starting FastAPI Backend (Document Processing Agent)...")
+    uvicorn.run(app, host=API_HOST, port=API_PORT, reload=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", action="store_true", help="run everything in this process (no supervisor)")
+    parser.add_argument("--api-workers", type=int, default=WORKFLOW_API_WORKERS)
+    parser.add_argument("--pipeline-processes", type=int, default=WORKFLOW_PIPELINE_PROCESSES)
+    parser.add_argument("--no-folder", action="store_true", help="do not run the folder watcher")
+    parser.add_argument("--no-email", action="store_true", help="do not run the email watcher")
+    args = parser.parse_args()
+
+    logging.info(" Initializing Autonomous Workflow Agent...")
+    if args.threads:
+        run_threads()
+    else:
+        # Migrations once, before the children race to open the DB
+        from backend.db import init_db
+        init_db()
+        build_supervisor(
+            api_workers=args.api_workers,
+            pipeline_processes=args.pipeline_processes,
+            folder=WORKFLOW_FOLDER_WATCHER and not args.no_folder,
+            email=WORKFLOW_EMAIL_WATCHER and not args.no_email,
+        ).run()
@@ -0,0 +1,113 @@
+# backend/artifact_store.py
+"""
+Compressed, content-addressed store for pipeline artifacts (OCR text, word
+boxes, raw LLM responses, pre-validation extraction JSON).
+
+Blobs are zstd-compressed files under ARTIFACT_DIR named by the SHA-256 of
+their uncompressed bytes (so identical artifacts are stored once); the
+invoice_artifacts table links them to invoice rows by kind.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional
+
+import zstandard
+from dotenv import load_dotenv
+
+from backend.db import get_conn
+
+load_dotenv()
+
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "DB/artifacts")
+ARTIFACT_ZSTD_LEVEL = int(os.getenv("ARTIFACT_ZSTD_LEVEL", "10"))
+
+# Artifact kinds written by process_invoice
+OCR_TEXT = "ocr_text"
+OCR_WORDS = "ocr_words"
+CLASSIFICATION = "classification"
+LLM_RESPONSE = "llm_response"
+EXTRACTED = "extracted"
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return json.dumps(value, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _blob_path(digest: str) -> str:
+    return os.path.join(ARTIFACT_DIR, digest[:2], digest[2:] + ".zst")
+
+
+# ---------------- BLOBS ----------------
+def put_blob(data: bytes) -> str:
+    """Store bytes (compressed) and return their digest. No-op if already stored."""
+    digest = hashlib.sha256(data).hexdigest()
+    path = _blob_path(digest)
+    if os.path.exists(path):
+        return digest
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    compressed = zstandard.ZstdCompressor(level=ARTIFACT_ZSTD_LEVEL).compress(data)
+
+    # Write-then-rename so readers never see a partial blob
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(compressed)
+    os.replace(tmp_path, path)
+    return digest
+
+
+def get_blob(digest: str) -> bytes:
+    with open(_blob_path(digest), "rb") as f:
+        return zstandard.ZstdDecompressor().decompress(f.read())
+
+
+# ---------------- INVOICE ARTIFACTS ----------------
+def save_artifacts(invoice_id: int, artifacts: Dict[str, object]):
+    """Store {kind: bytes | str | JSON-able} for an invoice, replacing older versions of each kind."""
+    rows = []
+    for kind, value in artifacts.items():
+        if value is None:
+            continue
+        data = _to_bytes(value)
+        rows.append((invoice_id, kind, put_blob(data), "zstd", len(data)))
+
+    conn = get_conn()
+    with conn:
+        conn.executemany(
+            """
+            INSERT OR REPLACE INTO invoice_artifacts (invoice_id, kind, digest, codec, size)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+
+
+def load_artifact(invoice_id: int, kind: str, as_json: bool = False) -> Optional[object]:
+    cursor = get_conn().cursor()
+    cursor.execute(
+        "SELECT digest FROM invoice_artifacts WHERE invoice_id = ? AND kind = ?",
+        (invoice_id, kind)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+
+    text = get_blob(row[0]).decode("utf-8")
+    return json.loads(text) if as_json else text
+
+
+def invoices_with_artifact(kind: str, invoice_ids=None):
+    """Invoice ids that have an artifact of this kind (optionally restricted to invoice_ids)."""
+    cursor = get_conn().cursor()
+    cursor.execute("SELECT invoice_id FROM invoice_artifacts WHERE kind = ? ORDER BY invoice_id", (kind,))
+    found = [row[0] for row in cursor.fetchall()]
+    if invoice_ids:
+        wanted = set(invoice_ids)
+        found = [i for i in found if i in wanted]
+    return found
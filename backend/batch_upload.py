@@ -0,0 +1,91 @@
+# backend/batch_upload.py
+"""
+Batch uploads: many files and/or ZIP archives in one request.
+
+Each supported document becomes one job (backend/job_queue.py) tagged with
+the batch id, so the pipeline processes them in parallel and /batches/{id}
+aggregates the per-file results. ZIP members are streamed straight from the
+(spooled) upload into the job spool, never loaded whole into memory.
+"""
+import os
+import zipfile
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from backend.job_queue import create_batch, enqueue_job, set_batch_skipped
+from backend.uploads import MAX_UPLOAD_BYTES
+
+load_dotenv()
+
+SUPPORTED_EXTENSIONS = (".pdf", ".jpg", ".jpeg", ".png")
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "1000"))
+BATCH_MAX_MEMBER_BYTES = int(os.getenv("BATCH_MAX_MEMBER_BYTES", str(MAX_UPLOAD_BYTES)))
+
+
+def _is_zip(filename: str, fileobj: BinaryIO) -> bool:
+    if (filename or "").lower().endswith(".zip"):
+        return True
+    position = fileobj.tell()
+    try:
+        return zipfile.is_zipfile(fileobj)
+    finally:
+        fileobj.seek(position)
+
+
+def iter_documents(filename: str, fileobj: BinaryIO, skipped: List[Dict]) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    Yield (name, stream) for every supported document in one upload: the
+    upload itself, or each member of a ZIP. Unsupported entries go to `skipped`.
+    """
+    if not _is_zip(filename, fileobj):
+        if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            yield filename, fileobj
+        else:
+            skipped.append({"filename": filename, "reason": "unsupported file type"})
+        return
+
+    try:
+        archive = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        skipped.append({"filename": filename, "reason": "invalid ZIP archive"})
+        return
+
+    with archive:
+        for info in archive.infolist():
+            name = f"{filename}/{info.filename}"
+            base = os.path.basename(info.filename)
+            if info.is_dir() or not base or base.startswith(".") or info.filename.startswith("__MACOSX/"):
+                continue
+            if not base.lower().endswith(SUPPORTED_EXTENSIONS):
+                skipped.append({"filename": name, "reason": "unsupported file type"})
+                continue
+            if info.file_size > BATCH_MAX_MEMBER_BYTES:
+                skipped.append({"filename": name, "reason": f"larger than {BATCH_MAX_MEMBER_BYTES} bytes"})
+                continue
+
+            with archive.open(info) as member:
+                yield name, member
+
+
+def enqueue_batch(user_id: int, uploads: List[Tuple[str, BinaryIO]]) -> Dict:
+    """uploads: [(filename, binary file object), ...] → {"batch_id", "queued", "skipped"}."""
+    batch_id = create_batch(user_id)
+    skipped, queued = [], 0
+
+    for filename, fileobj in uploads:
+        for name, stream in iter_documents(filename or "upload", fileobj, skipped):
+            if queued >= BATCH_MAX_FILES:
+                skipped.append({"filename": name, "reason": f"batch limit of {BATCH_MAX_FILES} files reached"})
+                continue
+            try:
+                enqueue_job(user_id, name, stream, batch_id=batch_id, max_bytes=BATCH_MAX_MEMBER_BYTES)
+            except HTTPException as e:
+                # Size limit hit mid-copy (e.g. a ZIP member larger than it claimed)
+                skipped.append({"filename": name, "reason": e.detail})
+                continue
+            queued += 1
+
+    set_batch_skipped(batch_id, skipped)
+    return {"batch_id": batch_id, "queued": queued, "skipped": skipped}
@@ -0,0 +1,135 @@
+# backend/bulk_ingest.py
+"""
+Bulk ingestion for backfills.
+
+Pre-extracted invoices (JSON lines) are validated and written with
+db.save_invoices_bulk, one transaction per batch. Raw files go through the
+invoice pipeline like every other channel (Document.from_path →
+process_document, channel "bulk"), so they get the same duplicate checks,
+fingerprints and artifacts. Backfilled invoices are only stored, they are NOT
+pushed to the ERP.
+
+    python -m backend.bulk_ingest --user-id 1 invoices.jsonl more.jsonl
+    python -m backend.bulk_ingest --user-id 1 --files scans/*.pdf --workers 4
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+from backend.data_validator import validate_invoice_data
+from backend.db import init_db, save_invoices_bulk, BULK_BATCH_SIZE
+from backend.document import Document
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_invoice_line(line: str) -> Dict:
+    """
+    Parse + validate one JSON line. Accepts both the extractor shape ("items")
+    and the validated/DB shape ("line_items"). Raises ValueError if invalid.
+    """
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("Each line must be a JSON object")
+
+    if "items" not in data and "line_items" in data:
+        data["items"] = data.pop("line_items")
+
+    validated = validate_invoice_data(data)
+    if not validated:
+        raise ValueError("Invalid invoice data")
+    return validated
+
+
+def iter_jsonl_invoices(lines: Iterable[str]) -> Iterable[Tuple[int, Dict, str]]:
+    """Yield (line_no, validated_invoice_or_None, error) for every non-blank line."""
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_no, parse_invoice_line(line), None
+        except Exception as e:
+            yield line_no, None, str(e)
+
+
+def ingest_file(path: str, user_id: int) -> Dict:
+    """Run one file through the pipeline without an ERP push. Returns the pipeline result."""
+    from backend.pipeline import process_document
+
+    # Memory-mapped, not read: hashed in place, OCR gets the path
+    with Document.from_path(path, user_id, "bulk") as document:
+        result = process_document(document, erp_sync=False)
+    if result.get("status") != "success":
+        raise ValueError(result.get("error") or "Unknown error")
+    return result
+
+
+def ingest_jsonl(paths: List[str], user_id: int, batch_size: int = BULK_BATCH_SIZE) -> Dict:
+    batch, inserted, rejected = [], 0, []
+
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line_no, invoice, error in iter_jsonl_invoices(f):
+                if error:
+                    rejected.append({"file": path, "line": line_no, "error": error})
+                    continue
+                batch.append(invoice)
+                if len(batch) >= batch_size:
+                    inserted += len(save_invoices_bulk(batch, user_id, batch_size))
+                    batch = []
+
+    if batch:
+        inserted += len(save_invoices_bulk(batch, user_id, batch_size))
+
+    return {"inserted": inserted, "rejected": rejected}
+
+
+def ingest_files(paths: List[str], user_id: int, workers: int = 4) -> Dict:
+    inserted, duplicates, rejected = 0, [], []
+
+    def run(path):
+        try:
+            return path, ingest_file(path, user_id), None
+        except Exception as e:
+            return path, None, str(getattr(e, "detail", e))
+
+    # OCR/LLM per file in parallel; each file is saved as its pipeline run finishes
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, result, error in pool.map(run, paths):
+            if error:
+                logging.error(f"Skipping {path}: {error}")
+                rejected.append({"file": path, "error": error})
+            elif result.get("duplicate"):
+                duplicates.append({"file": path, "invoice_id": result["invoice_id"]})
+            else:
+                inserted += 1
+
+    return {"inserted": inserted, "duplicates": duplicates, "rejected": rejected}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="JSON lines files (or documents with --files)")
+    parser.add_argument("--user-id", type=int, required=True)
+    parser.add_argument("--files", action="store_true", help="treat paths as PDF/image documents to OCR")
+    parser.add_argument("--workers", type=int, default=4, help="parallel OCR/LLM workers for --files")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="invoices per transaction (JSON lines)")
+    args = parser.parse_args()
+
+    init_db()
+    started = time.perf_counter()
+    if args.files:
+        summary = ingest_files(args.paths, args.user_id, args.workers)
+    else:
+        summary = ingest_jsonl(args.paths, args.user_id, args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    for r in summary["rejected"]:
+        logging.warning(f"Rejected: {r}")
+    logging.info(
+        f"Inserted {summary['inserted']} invoice(s), {len(summary.get('duplicates', []))} already stored, "
+        f"rejected {len(summary['rejected'])} in {elapsed:.1f}s"
+    )
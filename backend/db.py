@@ -1,14 +1,77 @@
 # database.py
 
 import sqlite3
-from typing import Dict, Optional
+import json
+import threading
+import time
+from typing import Dict, List, Optional
 import os
 from dotenv import load_dotenv
 
+from backend import fingerprint
+
 load_dotenv()
 
 DB_NAME = os.getenv("INVOICE_DB_PATH", "DB/invoices.db")
 
+# Connection tuning (see get_conn)
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "30"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))        # 64 MB page cache per connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256 MB memory-mapped reads
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))                     # invoices per transaction in save_invoices_bulk
+
+
+# CONNECTION MANAGER
+# One writer connection and one read-only connection per thread, opened lazily
+# and reused for the life of the thread. WAL lets the watchers write while the
+# chatbot reads; query_only makes the read connection refuse any write.
+
+_local = threading.local()
+
+
+def _open_conn(read_only: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_NAME, timeout=SQLITE_BUSY_TIMEOUT)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def _pooled_conn(read_only: bool) -> sqlite3.Connection:
+    conns = getattr(_local, "conns", None)
+    # Forked children must not reuse the parent's handles
+    if conns is None or _local.pid != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+
+    key = (DB_NAME, read_only)
+    conn = conns.get(key)
+    if conn is None:
+        conn = conns[key] = _open_conn(read_only)
+    return conn
+
+
+def get_conn() -> sqlite3.Connection:
+    """Thread-local read/write connection. Do not close it; use `with conn:` for transactions."""
+    return _pooled_conn(read_only=False)
+
+
+def get_read_conn() -> sqlite3.Connection:
+    """Thread-local read-only (query_only) connection for the query engine."""
+    return _pooled_conn(read_only=True)
+
+
+def close_thread_connections():
+    """Close this thread's pooled connections (e.g. before a worker thread exits)."""
+    conns = getattr(_local, "conns", None) or {}
+    for conn in conns.values():
+        conn.close()
+    conns.clear()
+
 
 # USERS TABLE
 
@@ -54,98 +117,613 @@ CREATE TABLE IF NOT EXISTS invoice_items (
 """
 
 
+# MIGRATIONS
+# Applied in order on top of the base tables; PRAGMA user_version stores the
+# number of the last one applied. Never edit a shipped migration, append a new one.
+
+MIGRATIONS = [
+    # 1: covering indexes for the chatbot's hot paths (user scope + date/customer
+    #    filters, and the invoices -> invoice_items join used for totals)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_date ON invoices (user_id, invoice_date, total)",
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_customer ON invoices (user_id, customer_name, total)",
+        "CREATE INDEX IF NOT EXISTS idx_invoice_items_invoice ON invoice_items (invoice_id, quantity, rate)",
+    ],
+    # 2: user columns the register API and the email watcher already expect
+    [
+        "ALTER TABLE users ADD COLUMN email TEXT",
+        "ALTER TABLE users ADD COLUMN imap_host TEXT",
+        "ALTER TABLE users ADD COLUMN imap_user TEXT",
+        "ALTER TABLE users ADD COLUMN imap_pass TEXT",
+    ],
+    # 3: document fingerprints for idempotent ingestion (see backend/fingerprint.py).
+    #    Alias rows (same invoice, different file) carry a NULL invoice_key.
+    [
+        """
+        CREATE TABLE IF NOT EXISTS document_fingerprints (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            content_hash TEXT NOT NULL,
+            invoice_key TEXT,
+            invoice_id INTEGER NOT NULL,
+            result_json TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, content_hash),
+            UNIQUE (user_id, invoice_key),
+            FOREIGN KEY (invoice_id) REFERENCES invoices(id)
+        )
+        """,
+    ],
+    # 4: FTS5 search over line-item descriptions and customer names (external
+    #    content tables kept in sync by triggers, so every insert path is covered)
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS invoice_items_fts USING fts5(
+            description, content='invoice_items', content_rowid='id',
+            tokenize='porter unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts USING fts5(
+            customer_name, content='invoices', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS invoice_items_fts_ai AFTER INSERT ON invoice_items BEGIN
+            INSERT INTO invoice_items_fts (rowid, description) VALUES (new.id, new.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS invoice_items_fts_ad AFTER DELETE ON invoice_items BEGIN
+            INSERT INTO invoice_items_fts (invoice_items_fts, rowid, description) VALUES ('delete', old.id, old.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS invoice_items_fts_au AFTER UPDATE OF description ON invoice_items BEGIN
+            INSERT INTO invoice_items_fts (invoice_items_fts, rowid, description) VALUES ('delete', old.id, old.description);
+            INSERT INTO invoice_items_fts (rowid, description) VALUES (new.id, new.description);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS invoices_fts_ai AFTER INSERT ON invoices BEGIN
+            INSERT INTO invoices_fts (rowid, customer_name) VALUES (new.id, new.customer_name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS invoices_fts_ad AFTER DELETE ON invoices BEGIN
+            INSERT INTO invoices_fts (invoices_fts, rowid, customer_name) VALUES ('delete', old.id, old.customer_name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS invoices_fts_au AFTER UPDATE OF customer_name ON invoices BEGIN
+            INSERT INTO invoices_fts (invoices_fts, rowid, customer_name) VALUES ('delete', old.id, old.customer_name);
+            INSERT INTO invoices_fts (rowid, customer_name) VALUES (new.id, new.customer_name);
+        END
+        """,
+        # Index rows that existed before this migration
+        "INSERT INTO invoice_items_fts (invoice_items_fts) VALUES ('rebuild')",
+        "INSERT INTO invoices_fts (invoices_fts) VALUES ('rebuild')",
+    ],
+    # 5: pipeline artifacts per invoice (blobs live in backend/artifact_store.py's ARTIFACT_DIR)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS invoice_artifacts (
+            invoice_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            codec TEXT NOT NULL,
+            size INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (invoice_id, kind),
+            FOREIGN KEY (invoice_id) REFERENCES invoices(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_invoice_artifacts_kind ON invoice_artifacts (kind, invoice_id)",
+    ],
+    # 6: durable job queue for /process-invoice/ (see backend/job_queue.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            filename TEXT,
+            payload_path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT,
+            stages_json TEXT,
+            result_json TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_until REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)",
+    ],
+    # 7: batch uploads (many files / a ZIP → one job per document)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS batches (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            skipped_json TEXT,
+            created_at REAL NOT NULL
+        )
+        """,
+        "ALTER TABLE jobs ADD COLUMN batch_id TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id)",
+    ],
+    # 8: admin flag (per-request profiling); grant with UPDATE users SET is_admin = 1
+    [
+        "ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0",
+    ],
+    # 9: ERP outbox, one row per invoice to push to Zoho (see backend/erp_outbox.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS erp_outbox (
+            invoice_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            payload_json TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            lease_until REAL,
+            zoho_invoice_id TEXT,
+            zoho_invoice_number TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL,
+            synced_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_erp_outbox_due ON erp_outbox (status, next_attempt_at)",
+    ],
+    # 10: shared Zoho OAuth access token + refresh lease (see backend/zoho_auth.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS zoho_tokens (
+            name TEXT PRIMARY KEY,
+            access_token TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            refreshed_at REAL,
+            refreshing_until REAL NOT NULL DEFAULT 0
+        )
+        """,
+    ],
+    # 11: local mirror of Zoho contacts for customer lookup (see backend/zoho_contacts.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS zoho_contacts (
+            contact_id TEXT PRIMARY KEY,
+            contact_name TEXT NOT NULL,
+            normalized_name TEXT NOT NULL,
+            email TEXT,
+            last_modified REAL NOT NULL DEFAULT 0,
+            synced_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_zoho_contacts_modified ON zoho_contacts (last_modified)",
+        "CREATE TABLE IF NOT EXISTS zoho_sync_state (name TEXT PRIMARY KEY, value TEXT)",
+    ],
+    # 12: shared Zoho rate-limit bucket (see backend/erp_governor.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS erp_rate_limits (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            day TEXT NOT NULL,
+            day_count INTEGER NOT NULL DEFAULT 0,
+            blocked_until REAL NOT NULL DEFAULT 0,
+            throttled INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+    ],
+    # 13: files the folder watcher has seen, for the startup catch-up scan
+    #     (see agents/folder_watcher.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS folder_ledger (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            content_hash TEXT,
+            status TEXT NOT NULL,
+            invoice_id INTEGER,
+            error TEXT,
+            updated_at REAL NOT NULL
+        )
+        """,
+    ],
+    # 14: per-mailbox UID watermark of the email agent (see agents/email_watcher.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS email_sync_state (
+            user_id INTEGER NOT NULL,
+            mailbox TEXT NOT NULL,
+            uidvalidity INTEGER NOT NULL,
+            last_uid INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (user_id, mailbox)
+        )
+        """,
+    ],
+    # 15: per-user version, bumped by every UPDATE (API or by hand); auth principal
+    #     caches compare it on each hit, so other processes see changes at once
+    [
+        "ALTER TABLE users ADD COLUMN auth_version INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TRIGGER IF NOT EXISTS users_auth_version AFTER UPDATE ON users
+        WHEN NEW.auth_version = OLD.auth_version BEGIN
+            UPDATE users SET auth_version = OLD.auth_version + 1 WHERE id = NEW.id;
+        END
+        """,
+    ],
+    # 16: UNIQUE (user_id, ...) lets NULL user_id rows repeat, so fingerprint
+    #     dedupe did nothing for them; enforce it on COALESCE(user_id, 0) instead
+    #     (ids start at 1). Of duplicates already stored the oldest row wins; later
+    #     rows with a taken invoice_key stay as aliases of their file.
+    [
+        """
+        DELETE FROM document_fingerprints WHERE user_id IS NULL AND id NOT IN (
+            SELECT MIN(id) FROM document_fingerprints WHERE user_id IS NULL GROUP BY content_hash
+        )
+        """,
+        """
+        UPDATE document_fingerprints SET invoice_key = NULL
+        WHERE user_id IS NULL AND invoice_key IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM document_fingerprints
+            WHERE user_id IS NULL AND invoice_key IS NOT NULL GROUP BY invoice_key
+        )
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_fingerprints_user_hash
+        ON document_fingerprints (COALESCE(user_id, 0), content_hash)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_fingerprints_user_key
+        ON document_fingerprints (COALESCE(user_id, 0), invoice_key) WHERE invoice_key IS NOT NULL
+        """,
+    ],
+]
+
+
+def _apply_statement(cursor, statement: str):
+    try:
+        cursor.execute(statement)
+    except sqlite3.OperationalError as e:
+        # Column already added by hand / by an older build
+        if "duplicate column name" not in str(e):
+            raise
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Bring the schema up to len(MIGRATIONS). Safe to call from several processes."""
+    cursor = conn.cursor()
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        if cursor.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+
+        # IMMEDIATE takes the write lock first, so re-check after acquiring it
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if cursor.execute("PRAGMA user_version").fetchone()[0] < version:
+                for statement in statements:
+                    _apply_statement(cursor, statement)
+                cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
 # INIT DB
 
 def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
+    conn = get_conn()
+    with conn:
         cursor = conn.cursor()
         cursor.execute(CREATE_TABLE_USERS)
         cursor.execute(CREATE_TABLE_INVOICES)
         cursor.execute(CREATE_TABLE_ITEMS)
-        conn.commit()
+
+    run_migrations(conn)
 
 
 # USER AUTH DB FUNCTIONS
 
 
+# Called with the user id after every write to `users` (e.g. to drop cached auth principals)
+_user_change_listeners = []
+
+
+def on_user_change(callback):
+    _user_change_listeners.append(callback)
+
+
+def _user_changed(user_id: int):
+    for callback in _user_change_listeners:
+        callback(user_id)
+
+
 def create_user(username: str, password_hash: str, email: Optional[str] = None) -> int:
-    with sqlite3.connect(DB_NAME) as conn:
+    conn = get_conn()
+    with conn:
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (username, password_hash)
+            "INSERT INTO users (username, password_hash, email) VALUES (?, ?, ?)",
+            (username, password_hash, email)
         )
-        conn.commit()
-        return cursor.lastrowid
+        user_id = cursor.lastrowid
+    _user_changed(user_id)
+    return user_id
+
+
+USER_COLUMNS = ("username", "password_hash", "email", "imap_host", "imap_user", "imap_pass", "is_admin")
+
+
+def update_user(user_id: int, **fields):
+    """Update columns of one user row (only USER_COLUMNS)."""
+    unknown = set(fields) - set(USER_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown user column(s): {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+
+    assignments = ", ".join(f"{column} = ?" for column in fields)
+    conn = get_conn()
+    with conn:
+        conn.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*fields.values(), user_id))
+    _user_changed(user_id)
 
 
 def get_user_by_username(username: str):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        return dict(user) if user else None
+    cursor = get_conn().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
+    user = cursor.fetchone()
+    return dict(user) if user else None
 
 
 def get_user_by_id(user_id: int):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        return dict(user) if user else None
+    cursor = get_conn().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    user = cursor.fetchone()
+    return dict(user) if user else None
+
+
+def get_user_auth_version(user_id: int) -> Optional[int]:
+    """users.auth_version (None if the user was deleted); one primary-key lookup."""
+    row = get_read_conn().execute("SELECT auth_version FROM users WHERE id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
 
 
 
 
 # SAVE INVOICE (USER LINKED)
 
-def save_invoice_to_db(data: Dict, user_id: int) -> int:
-    with sqlite3.connect(DB_NAME) as conn:
+INSERT_INVOICE = """
+INSERT INTO invoices (id, user_id, invoice_number, reference_number, customer_name, email, invoice_date, total)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_ITEM = """
+INSERT INTO invoice_items (invoice_id, description, quantity, rate)
+VALUES (?, ?, ?, ?)
+"""
+
+
+def _invoice_row(invoice_id: Optional[int], data: Dict, user_id: int) -> tuple:
+    return (
+        invoice_id,
+        user_id,
+        data.get("invoice_number"),
+        data.get("reference_number"),
+        data.get("customer_name"),
+        data.get("email"),
+        data.get("invoice_date"),
+        data.get("total", 0.0),
+    )
+
+
+def _item_rows(invoice_id: int, data: Dict) -> List[tuple]:
+    return [
+        (
+            invoice_id,
+            item.get("description"),
+            item.get("quantity", 1),
+            item.get("rate", 0.0),
+        )
+        for item in data.get("line_items", [])
+    ]
+
+
+INSERT_OUTBOX = """
+INSERT INTO erp_outbox (invoice_id, user_id, payload_json, status, next_attempt_at, created_at)
+VALUES (?, ?, ?, 'pending', ?, ?)
+"""
+
+
+def save_invoice_to_db(
+    data: Dict,
+    user_id: int,
+    content_hash: Optional[str] = None,
+    invoice_key: Optional[str] = None,
+    erp_sync: bool = False,
+) -> int:
+    """
+    Insert one invoice + its line items. When content_hash is given the
+    fingerprint is written in the same transaction, so a concurrent duplicate
+    raises sqlite3.IntegrityError and nothing is saved. With erp_sync the
+    invoice is queued in erp_outbox in that same transaction too, so it is
+    pushed to Zoho exactly when it was committed.
+    """
+    conn = get_conn()
+    with conn:
         cursor = conn.cursor()
 
+        cursor.execute(INSERT_INVOICE, _invoice_row(None, data, user_id))
+        invoice_id = cursor.lastrowid
+
+        cursor.executemany(INSERT_ITEM, _item_rows(invoice_id, data))
+
+        if content_hash:
+            cursor.execute(
+                """
+                INSERT INTO document_fingerprints (user_id, content_hash, invoice_key, invoice_id, result_json)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (user_id, content_hash, invoice_key, invoice_id, json.dumps(data, default=str))
+            )
+
+        if erp_sync:
+            now = time.time()
+            cursor.execute(INSERT_OUTBOX, (invoice_id, user_id, json.dumps(data, default=str), now, now))
+
+        return invoice_id
+
+
+def save_invoices_bulk(invoices: List[Dict], user_id: int, batch_size: int = BULK_BATCH_SIZE) -> List[int]:
+    """
+    Insert many validated invoices for one user.
+    Each batch is a single transaction with two executemany calls; invoice ids
+    are reserved up front under the write lock so line items can be batched too.
+    Returns the new invoice ids in input order.
+    """
+    conn = get_conn()
+    invoice_ids = []
+
+    for start in range(0, len(invoices), batch_size):
+        batch = invoices[start:start + batch_size]
+
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # AUTOINCREMENT never reuses ids, so start above both MAX(id) and the sequence
+            cursor.execute(
+                "SELECT MAX(COALESCE((SELECT MAX(id) FROM invoices), 0), "
+                "COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'invoices'), 0))"
+            )
+            next_id = cursor.fetchone()[0] + 1
+            batch_ids = list(range(next_id, next_id + len(batch)))
+
+            cursor.executemany(
+                INSERT_INVOICE,
+                [_invoice_row(invoice_id, data, user_id) for invoice_id, data in zip(batch_ids, batch)]
+            )
+            cursor.executemany(
+                INSERT_ITEM,
+                [row for invoice_id, data in zip(batch_ids, batch) for row in _item_rows(invoice_id, data)]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        invoice_ids.extend(batch_ids)
+
+    return invoice_ids
+
+
+def update_invoice(invoice_id: int, data: Dict):
+    """
+    Overwrite an invoice's fields and line items (used when reprocessing from
+    stored artifacts). The invoice's fingerprint key is recomputed so dedupe
+    keeps matching it; if another invoice already holds the new key, the
+    stale key is cleared instead (the file's content hash still matches).
+    """
+    key = fingerprint.invoice_key(data)
+    conn = get_conn()
+    with conn:
+        cursor = conn.cursor()
         cursor.execute(
             """
-            INSERT INTO invoices (user_id, invoice_number, reference_number, customer_name, email, invoice_date, total)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            UPDATE invoices
+            SET invoice_number = ?, reference_number = ?, customer_name = ?, email = ?, invoice_date = ?, total = ?
+            WHERE id = ?
             """,
             (
-                user_id,
                 data.get("invoice_number"),
                 data.get("reference_number"),
                 data.get("customer_name"),
                 data.get("email"),
                 data.get("invoice_date"),
                 data.get("total", 0.0),
+                invoice_id,
             )
         )
-        invoice_id = cursor.lastrowid
+        cursor.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
+        cursor.executemany(INSERT_ITEM, _item_rows(invoice_id, data))
+        cursor.execute(
+            "UPDATE document_fingerprints SET result_json = ? WHERE invoice_id = ?",
+            (json.dumps(data, default=str), invoice_id)
+        )
+        cursor.execute(
+            "UPDATE OR IGNORE document_fingerprints SET invoice_key = ? WHERE invoice_id = ? AND invoice_key IS NOT NULL",
+            (key, invoice_id)
+        )
+        cursor.execute(
+            "UPDATE document_fingerprints SET invoice_key = NULL WHERE invoice_id = ? AND invoice_key != ?",
+            (invoice_id, key)
+        )
 
-        for item in data.get("line_items", []):
-            cursor.execute(
-                """
-                INSERT INTO invoice_items (invoice_id, description, quantity, rate)
-                VALUES (?, ?, ?, ?)
-                """,
-                (
-                    invoice_id,
-                    item.get("description"),
-                    item.get("quantity", 1),
-                    item.get("rate", 0.0),
-                )
-            )
 
-        conn.commit()
-        return invoice_id
+def get_invoice_user_id(invoice_id: int) -> Optional[int]:
+    cursor = get_conn().cursor()
+    cursor.execute("SELECT user_id FROM invoices WHERE id = ?", (invoice_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+# DOCUMENT FINGERPRINTS
+
+def _fingerprint_from_row(row) -> Optional[Dict]:
+    if not row:
+        return None
+    return {"invoice_id": row[0], "data": json.loads(row[1]) if row[1] else None}
+
+
+def find_fingerprint_by_hash(user_id: int, content_hash: str) -> Optional[Dict]:
+    cursor = get_conn().cursor()
+    cursor.execute(
+        "SELECT invoice_id, result_json FROM document_fingerprints WHERE user_id IS ? AND content_hash = ?",
+        (user_id, content_hash)
+    )
+    return _fingerprint_from_row(cursor.fetchone())
+
+
+def find_fingerprint_by_key(user_id: int, invoice_key: str) -> Optional[Dict]:
+    cursor = get_conn().cursor()
+    cursor.execute(
+        "SELECT invoice_id, result_json FROM document_fingerprints WHERE user_id IS ? AND invoice_key = ?",
+        (user_id, invoice_key)
+    )
+    return _fingerprint_from_row(cursor.fetchone())
+
+
+def add_fingerprint_alias(user_id: int, content_hash: str, invoice_id: int, data: Optional[Dict]):
+    """Remember another file for an invoice we already have, so it short-circuits next time."""
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO document_fingerprints (user_id, content_hash, invoice_key, invoice_id, result_json)
+            VALUES (?, ?, NULL, ?, ?)
+            """,
+            (user_id, content_hash, invoice_id, json.dumps(data, default=str))
+        )
 
 
 # FETCH USER INVOICES
 
 def fetch_user_invoices(user_id: int):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM invoices WHERE user_id = ?", (user_id,))
-        return [dict(row) for row in cursor.fetchall()]
-
+    cursor = get_read_conn().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute("SELECT * FROM invoices WHERE user_id = ?", (user_id,))
+    return [dict(row) for row in cursor.fetchall()]
@@ -1,9 +1,11 @@
 import os
 # from groq import Groq
 from backend.llm_extractor import sanitize_text
+import time
 import requests
 from dotenv import load_dotenv
 import logging
+from backend import metrics
 load_dotenv()
 
 """
@@ -80,6 +82,8 @@ Return EXACTLY one label with no explanation.
     }
 
     
+    started = time.perf_counter()
+    status = "error"
     try:
         response = requests.post(
             "https://api.groq.com/openai/v1/chat/completions",
@@ -87,6 +91,7 @@ Return EXACTLY one label with no explanation.
             json=payload,
             timeout=30
         )
+        status = str(response.status_code)
 
         if response.status_code != 200:
             logging.error(f"Groq API error: {response.text}")
@@ -94,6 +99,7 @@ Return EXACTLY one label with no explanation.
 
         # Extract JSON correctly
         data = response.json()
+        metrics.record_llm_usage("classify", data.get("usage"))
 
         # CORRECT: extract LLM output
         label = data["choices"][0]["message"]["content"].strip().lower()
@@ -108,3 +114,6 @@ Return EXACTLY one label with no explanation.
     except Exception as e:
         logging.error(f"LLM classify error: {str(e)}")
         return "others"
+
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, caller="classify", status=status)
@@ -0,0 +1,125 @@
+# backend/document.py
+"""
+One ingestion interface for every front door: API uploads, queued jobs
+(single and batch uploads), the folder watcher, the email watcher and file
+backfills (backend/bulk_ingest.py).
+
+A Document is the content plus where it came from (channel, user,
+filename). Whatever the source, the pipeline sees a zero-copy buffer:
+
+- Document.from_bytes()   bytes / memoryview / mmap, used as they are
+- Document.from_path()    the file is memory-mapped on first use; the path is
+                          what crosses into OCR worker processes
+- Document.from_stream()  copied once, in chunks and size-limited, into a
+                          SpooledUpload (memory when small, temp file when large)
+- Document.from_upload()  an already spooled API upload
+
+Documents are context managers; close() unmaps the file and removes the
+spool, if the Document owns one.
+
+    with Document.from_path(path, user_id, "folder") as doc:
+        result = process_document(doc)
+"""
+import os
+from typing import BinaryIO, Optional
+
+from backend.fingerprint import document_hash
+from backend.uploads import MAX_UPLOAD_BYTES, SpooledUpload, close_view, copy_limited, open_view
+
+CHANNELS = ("api", "batch", "folder", "email", "bulk", "cli")
+
+
+class Document:
+    """An invoice to process: content (lazily mapped) + channel, user, filename."""
+
+    def __init__(
+        self,
+        user_id: int,
+        channel: str,
+        filename: Optional[str] = None,
+        content=None,
+        path: Optional[str] = None,
+        spool: Optional[SpooledUpload] = None,
+    ):
+        if channel not in CHANNELS:
+            raise ValueError(f"Unknown channel {channel!r}")
+        self.user_id = user_id
+        self.channel = channel
+        self.filename = filename or (os.path.basename(path) if path else None)
+        self.path = path              # set when the content is a file on disk
+        self._content = content
+        self._spool = spool
+        self._mapped = None           # mmap we opened, closed in close()
+        self._hash = None
+
+    # ---------------- CONSTRUCTORS ----------------
+    @classmethod
+    def from_bytes(cls, data, user_id: int, channel: str, filename: Optional[str] = None) -> "Document":
+        return cls(user_id, channel, filename, content=data)
+
+    @classmethod
+    def from_path(cls, path: str, user_id: int, channel: str, filename: Optional[str] = None) -> "Document":
+        return cls(user_id, channel, filename, path=path)
+
+    @classmethod
+    def from_upload(cls, upload: SpooledUpload, user_id: int, channel: str = "api") -> "Document":
+        """Takes ownership of the spool: close() removes its temp file."""
+        return cls(user_id, channel, upload.filename, path=upload.path, spool=upload)
+
+    @classmethod
+    def from_stream(
+        cls,
+        stream: BinaryIO,
+        user_id: int,
+        channel: str,
+        filename: Optional[str] = None,
+        max_bytes: Optional[int] = MAX_UPLOAD_BYTES,
+    ) -> "Document":
+        """Spool a binary stream; raises HTTP 413 once more than max_bytes were read."""
+        spool = SpooledUpload(filename or os.path.basename(getattr(stream, "name", "") or "") or None)
+        try:
+            copy_limited(stream, spool, max_bytes)
+            spool.finish()
+        except Exception:
+            spool.finish()
+            spool.close()
+            raise
+        return cls.from_upload(spool, user_id, channel)
+
+    # ---------------- ACCESS ----------------
+    @property
+    def content(self):
+        """Zero-copy buffer over the document (a file is mapped on first access)."""
+        if self._content is None:
+            if self._spool is not None:
+                self._content = self._spool.view()
+            else:
+                self._content = self._mapped = open_view(self.path)
+        return self._content
+
+    @property
+    def content_hash(self) -> str:
+        """sha256 of the content, computed once (the pipeline's dedupe key)."""
+        if self._hash is None:
+            self._hash = document_hash(self.content)
+        return self._hash
+
+    def __len__(self) -> int:
+        return len(self.content)
+
+    def __repr__(self) -> str:
+        return f"<Document {self.channel}:{self.filename or '-'} user={self.user_id}>"
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._content = None
+        elif self._mapped is not None:
+            close_view(self._mapped)
+            self._content = self._mapped = None
+
+    def __enter__(self) -> "Document":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
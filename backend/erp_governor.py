@@ -0,0 +1,157 @@
+# backend/erp_governor.py
+"""
+Shared rate governor for Zoho Books API calls.
+
+Zoho limits requests per organization per minute and per day. Every Zoho call
+(erp_integration.zoho_request) first takes a token from one bucket stored in
+the `erp_rate_limits` table, so the limits hold across threads and across
+processes (API workers, watchers, batch tools):
+
+- minute bucket: ZOHO_RATE_PER_MINUTE tokens, refilled continuously
+- day counter:   ZOHO_RATE_PER_DAY calls per UTC day
+- a 429 empties the bucket and blocks everyone until Retry-After has passed
+
+acquire() blocks (up to a timeout) instead of letting a burst hit Zoho.
+"""
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from backend.db import get_conn
+from backend import metrics
+
+load_dotenv()
+
+ZOHO_RATE_PER_MINUTE = float(os.getenv("ZOHO_RATE_PER_MINUTE", "100"))
+ZOHO_RATE_PER_DAY = int(os.getenv("ZOHO_RATE_PER_DAY", "1000"))
+ZOHO_RATE_WAIT_SECONDS = float(os.getenv("ZOHO_RATE_WAIT_SECONDS", "120"))   # max wait in acquire()
+ZOHO_DEFAULT_RETRY_AFTER = 60.0
+
+BUCKET = "zoho"
+
+
+class RateLimited(Exception):
+    """No capacity within the wait budget; retry_after says when to try again."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _seconds_to_midnight(now: float) -> float:
+    return 86400 - now % 86400
+
+
+def _try_take(now: float) -> float:
+    """One token if available (returns 0.0), else the seconds to wait. Runs under BEGIN IMMEDIATE."""
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        row = cursor.execute(
+            "SELECT tokens, updated_at, day, day_count, blocked_until FROM erp_rate_limits WHERE name = ?",
+            (BUCKET,)
+        ).fetchone()
+        if row is None:
+            row = (ZOHO_RATE_PER_MINUTE, now, _today(), 0, 0.0)
+            cursor.execute(
+                "INSERT INTO erp_rate_limits (name, tokens, updated_at, day, day_count, blocked_until) VALUES (?, ?, ?, ?, ?, ?)",
+                (BUCKET, *row)
+            )
+
+        tokens, updated_at, day, day_count, blocked_until = row
+        tokens = min(ZOHO_RATE_PER_MINUTE, tokens + (now - updated_at) * ZOHO_RATE_PER_MINUTE / 60)
+        if day != _today():
+            day, day_count = _today(), 0
+
+        if blocked_until > now:
+            wait = blocked_until - now
+        elif day_count >= ZOHO_RATE_PER_DAY:
+            wait = _seconds_to_midnight(now)
+        elif tokens < 1:
+            wait = (1 - tokens) * 60 / ZOHO_RATE_PER_MINUTE
+        else:
+            tokens, day_count, wait = tokens - 1, day_count + 1, 0.0
+
+        cursor.execute(
+            "UPDATE erp_rate_limits SET tokens = ?, updated_at = ?, day = ?, day_count = ? WHERE name = ?",
+            (tokens, now, day, day_count, BUCKET)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return wait
+
+
+def acquire(timeout: Optional[float] = None):
+    """Block until a Zoho call is allowed; raises RateLimited if that takes longer than timeout."""
+    timeout = ZOHO_RATE_WAIT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    waited = 0.0
+    while True:
+        wait = _try_take(time.time())
+        if wait == 0.0:
+            if waited:
+                metrics.ZOHO_RATE_WAIT_SECONDS.observe(waited)
+            return
+        if time.monotonic() + wait > deadline:
+            metrics.ZOHO_THROTTLED.inc(source="governor")
+            raise RateLimited(f"Zoho rate limit: no capacity for {wait:.0f}s", wait)
+        time.sleep(wait)
+        waited += wait
+
+
+def penalize(retry_after: Optional[float]):
+    """Zoho answered 429: stop every caller until Retry-After has passed."""
+    retry_after = retry_after if retry_after is not None else ZOHO_DEFAULT_RETRY_AFTER
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            UPDATE erp_rate_limits
+            SET tokens = 0, updated_at = ?, blocked_until = MAX(blocked_until, ?), throttled = throttled + 1
+            WHERE name = ?
+            """,
+            (now, now + retry_after, BUCKET)
+        )
+    metrics.ZOHO_THROTTLED.inc(source="zoho")
+    logging.warning(f"Zoho returned 429, pausing ERP calls for {retry_after:.0f}s")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(float(value), 0.0) if value else None
+    except ValueError:
+        return None
+
+
+def headroom() -> Dict:
+    """Current limit state: tokens left this minute, calls left today, active 429 block."""
+    now = time.time()
+    row = get_conn().execute(
+        "SELECT tokens, updated_at, day, day_count, blocked_until, throttled FROM erp_rate_limits WHERE name = ?",
+        (BUCKET,)
+    ).fetchone()
+    if row is None:
+        row = (ZOHO_RATE_PER_MINUTE, now, _today(), 0, 0.0, 0)
+    tokens, updated_at, day, day_count, blocked_until, throttled = row
+    day_count = day_count if day == _today() else 0
+    return {
+        "per_minute_limit": ZOHO_RATE_PER_MINUTE,
+        "minute_tokens": round(min(ZOHO_RATE_PER_MINUTE, tokens + (now - updated_at) * ZOHO_RATE_PER_MINUTE / 60), 2),
+        "per_day_limit": ZOHO_RATE_PER_DAY,
+        "day_used": day_count,
+        "day_remaining": max(ZOHO_RATE_PER_DAY - day_count, 0),
+        "blocked_for_seconds": round(max(blocked_until - now, 0.0), 1),
+        "throttled_total": throttled,
+    }
@@ -1,17 +1,21 @@
 import os
+import time
+import threading
 import requests
 import logging
 from datetime import datetime
 from dotenv import load_dotenv 
-from backend.zoho_auth import get_zoho_access_token
+from backend.zoho_auth import get_zoho_access_token, invalidate_access_token
+from backend import metrics, zoho_contacts, erp_governor
+from backend.erp_governor import RateLimited
 
 load_dotenv()
 
 ZOHO_ORG_ID = os.getenv("ZOHO_ORG_ID")
-BASE_URL = "https://www.zohoapis.in/books/v3"
+BASE_URL = os.getenv("ZOHO_BASE_URL", "https://www.zohoapis.in/books/v3")  # benchmarks/mock_zoho.py for local runs
 
-def get_headers():
-    token = get_zoho_access_token()
+def get_headers(token: str = None):
+    token = token or get_zoho_access_token()
     if not token:
         raise ValueError("Zoho access token fetch failed.")
     return {
@@ -20,17 +24,141 @@ def get_headers():
         "Content-Type": "application/json"
     }
 
+def _timed_request(method: str, endpoint: str, url: str, **kwargs):
+    """requests.request timed as zoho_request_seconds{endpoint, status}."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        resp = requests.request(method, url, **kwargs)
+        status = str(resp.status_code)
+        return resp
+    finally:
+        metrics.ZOHO_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, status=status)
+
+def _governed_request(method: str, endpoint: str, url: str, **kwargs):
+    # Every call spends a token from the shared per-minute / per-day budget
+    erp_governor.acquire()
+    resp = _timed_request(method, endpoint, url, **kwargs)
+    if resp.status_code == 429:
+        erp_governor.penalize(erp_governor.parse_retry_after(resp.headers.get("Retry-After")))
+    return resp
+
+def zoho_request(method: str, endpoint: str, url: str, **kwargs):
+    """
+    Authenticated, rate-governed Zoho call (cached token); on 401 the token is
+    dropped and the call retried once. Raises RateLimited when the governor
+    has no capacity within its wait budget.
+    """
+    token = get_zoho_access_token()
+    resp = _governed_request(method, endpoint, url, headers=get_headers(token), **kwargs)
+    if resp.status_code == 401:
+        logging.warning(f"Zoho rejected the access token on {endpoint}, refreshing")
+        invalidate_access_token(token)
+        resp = _governed_request(method, endpoint, url, headers=get_headers(), **kwargs)
+    return resp
+
+def _retry_after(resp) -> float:
+    return erp_governor.parse_retry_after(resp.headers.get("Retry-After")) or erp_governor.ZOHO_DEFAULT_RETRY_AFTER
+
+def _error(resp, message: str):
+    """Error result; a 429 carries retry_after so the outbox waits as long as Zoho asked."""
+    result = {"status": "error", "message": message}
+    if resp.status_code == 429:
+        result["retry_after"] = _retry_after(resp)
+    return result
+
+def _raise_if_throttled(resp, endpoint: str):
+    """A 429 on a contact call is throttling, not a failure: raise RateLimited for the outbox."""
+    if resp.status_code == 429:
+        raise RateLimited(f"Zoho throttled {endpoint}", _retry_after(resp))
+
+ZOHO_CONTACTS_PER_PAGE = 200  # Zoho's maximum page size
+
+_contact_sync_lock = threading.Lock()
+
+def sync_contacts(full: bool = False, if_stale: bool = False) -> int:
+    """
+    Mirror Zoho contacts into the local index (backend/zoho_contacts.py).
+    Full: every page. Incremental (default once a full sync exists): newest
+    first by last_modified_time, stopping at the stored watermark.
+    One sync at a time: threads queue on a lock, processes on the sync lease
+    (waiting up to ZOHO_CONTACT_SYNC_WAIT for another syncer). if_stale:
+    return without syncing when someone else refreshed the index meanwhile.
+    Returns the number of contacts written.
+    """
+    with _contact_sync_lock:
+        deadline = time.monotonic() + zoho_contacts.ZOHO_CONTACT_SYNC_WAIT
+        while True:
+            if if_stale and not zoho_contacts.needs_sync():
+                return 0
+            holder = zoho_contacts.claim_sync()
+            if holder:
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutError("Timed out waiting for another process to sync Zoho contacts")
+            time.sleep(0.5)
+
+        try:
+            return _fetch_contacts(full, holder)
+        finally:
+            zoho_contacts.release_sync(holder)
+
+def _fetch_contacts(full: bool, holder: str) -> int:
+    started = time.time()
+    state = zoho_contacts.sync_state()
+    full = full or not state["full_sync_at"]
+    watermark = state["last_modified"]
+
+    contacts, page = [], 1
+    while True:
+        params = {"organization_id": ZOHO_ORG_ID, "page": page, "per_page": ZOHO_CONTACTS_PER_PAGE}
+        if not full:
+            params.update(sort_column="last_modified_time", sort_order="D")
+        resp = zoho_request("GET", "contacts.list", f"{BASE_URL}/contacts", params=params, timeout=30)
+        _raise_if_throttled(resp, "contacts.list")
+        if not resp.ok:
+            raise RuntimeError(f"Failed to fetch customers (page {page}): {resp.text}")
+
+        body = resp.json()
+        batch = body.get("contacts", [])
+        if not full:
+            fresh = [c for c in batch if zoho_contacts.parse_zoho_time(c.get("last_modified_time")) > watermark]
+            contacts.extend(fresh)
+            if len(fresh) < len(batch):
+                break
+        else:
+            contacts.extend(batch)
+
+        if not body.get("page_context", {}).get("has_more_page"):
+            break
+        page += 1
+        zoho_contacts.claim_sync(holder)   # renew the lease for long syncs
+
+    written = zoho_contacts.upsert_contacts(contacts, full=full, started=started)
+    logging.info(f"Zoho contacts synced ({'full' if full else 'incremental'}): {written} contact(s), {page} page(s)")
+    return written
+
 def get_customer_id(customer_name: str):
-    url = f"{BASE_URL}/contacts?organization_id={ZOHO_ORG_ID}"
-    resp = requests.get(url, headers=get_headers(), timeout=30)
-    if not resp.ok:
-        logging.error(f" Failed to fetch customers: {resp.text}")
-        return None
-    for c in resp.json().get("contacts", []):
-        if c["contact_name"].lower() == customer_name.lower():
-            return c["contact_id"]
-    logging.warning(f" Customer not found: {customer_name}")
-    return None
+    """
+    Contact id from the local index; refreshes it from Zoho when stale before
+    giving up. If that refresh failed, a miss proves nothing (the contact may
+    exist in Zoho already), so the sync error is raised instead of returning
+    None and letting the caller create a duplicate customer.
+    """
+    sync_error = None
+    if zoho_contacts.needs_sync():
+        try:
+            sync_contacts(if_stale=True)
+        except Exception as e:
+            logging.error(f" Zoho contact sync failed, using the local index as is: {e}")
+            sync_error = e
+
+    contact_id = zoho_contacts.find_contact(customer_name)
+    if not contact_id:
+        if sync_error is not None:
+            raise sync_error
+        logging.warning(f" Customer not found: {customer_name}")
+    return contact_id
 
 def create_customer(customer_name: str, email="auto@system.com"):
     url = f"{BASE_URL}/contacts?organization_id={ZOHO_ORG_ID}"
@@ -39,9 +167,13 @@ def create_customer(customer_name: str, email="auto@system.com"):
         "email": email,
         "billing_address": {"address": "Auto-created by OCR Agent"}
     }
-    resp = requests.post(url, headers=get_headers(), json=payload, timeout=30)
+    resp = zoho_request("POST", "contacts.create", url, json=payload, timeout=30)
+    _raise_if_throttled(resp, "contacts.create")
     if resp.ok:
-        contact_id = resp.json().get("contact", {}).get("contact_id")
+        contact = resp.json().get("contact", {})
+        contact_id = contact.get("contact_id")
+        if contact_id:
+            zoho_contacts.add_contact({"contact_name": customer_name, **contact})
         logging.info(f" Created new customer: {customer_name}")
         return contact_id
     logging.error(f" Customer creation failed: {resp.text}")
@@ -69,43 +201,60 @@ def create_invoice(customer_id: str, reference_number: str, date: str, items: li
     }
 
     logging.info(f" ERP Payload: {payload}")
-    resp = requests.post(f"{BASE_URL}/invoices?organization_id={ZOHO_ORG_ID}",
-                         headers=get_headers(), json=payload, timeout=30)
-    data = resp.json()
+    resp = zoho_request("POST", "invoices.create", f"{BASE_URL}/invoices?organization_id={ZOHO_ORG_ID}",
+                        json=payload, timeout=30)
+    try:
+        data = resp.json()
+    except ValueError:
+        data = {"message": resp.text}
     if resp.ok:
         logging.info(f" Invoice created: {data.get('invoice', {}).get('invoice_number')}")
         return {"status": "success", "message": "Invoice created successfully", "data": data.get("invoice", {})}
     logging.error(f" Invoice creation failed: {data}")
-    return {"status": "error", "message": data.get("message", "Unknown error")}
+    return _error(resp, data.get("message", "Unknown error"))
+
+def invoice_items(data: dict) -> list:
+    items = data.get("items") or data.get("line_items", [])
+
+    #  Fallback: if items empty, create one default item
+    if not items:
+        items = [{
+            "description": data.get("description", "Auto Imported Item"),
+            "quantity": float(data.get("quantity", 1)),
+            "rate": float(data.get("rate", data.get("total", 0)))
+        }]
+    return items
+
+def resolve_customer(customer_name: str, email: str = "auto@system.com"):
+    """Contact id for a customer, creating the contact in Zoho if it does not exist yet."""
+    customer_id = get_customer_id(customer_name)
+    if not customer_id:
+        logging.info(f"Creating new customer: {customer_name}")
+        customer_id = create_customer(customer_name, email)
+    return customer_id
+
+def push_invoice(data: dict, customer_id: str):
+    """Send one invoice for an already resolved customer."""
+    ref_no = data.get("reference_number", "N/A")
+    date = data.get("invoice_date", datetime.today().strftime("%Y-%m-%d"))
+    items = invoice_items(data)
+    logging.info(f" Final normalized items: {items}")
+    return create_invoice(customer_id, ref_no, date, items)
 
 def push_to_erp(data: dict):
     """End-to-end flow: find/create customer → send invoice."""
     try:
         customer_name = data.get("customer_name", "Walk-In Customer")
         email = data.get("email", "auto@system.com")
-        ref_no = data.get("reference_number", "N/A")
-        date = data.get("invoice_date", datetime.today().strftime("%Y-%m-%d"))
-        items = data.get("items") or data.get("line_items", [])
-
-        #  Fallback: if items empty, create one default item
-        if not items:
-            items = [{
-                "description": data.get("description", "Auto Imported Item"),
-                "quantity": float(data.get("quantity", 1)),
-                "rate": float(data.get("rate", data.get("total", 0)))
-            }]
-
-        customer_id = get_customer_id(customer_name)
-        if not customer_id:
-            logging.info(f"reating new customer: {customer_name}")
-            customer_id = create_customer(customer_name, email)
 
+        customer_id = resolve_customer(customer_name, email)
         if not customer_id:
             return {"status": "error", "message": "Failed to create or locate customer"}
 
-        logging.info(f" Final normalized items: {items}")
-        return create_invoice(customer_id, ref_no, date, items)
+        return push_invoice(data, customer_id)
 
+    except RateLimited as e:
+        return {"status": "error", "message": str(e), "retry_after": e.retry_after}
     except Exception as e:
         logging.exception(" ERP push failed:")
         return {"status": "error", "message": str(e)}
@@ -0,0 +1,328 @@
+# backend/erp_outbox.py
+"""
+Transactional outbox for the Zoho push.
+
+save_invoice_to_db(..., erp_sync=True) writes an `erp_outbox` row in the same
+transaction as the invoice, so uploads return right after the DB commit. A
+dispatcher thread claims due rows in batches (leased like jobs and renewed
+while the batch is pushed, so a crashed process's claims come back but a slow
+one's are not pushed twice), groups them by customer so each contact is
+resolved once per batch, pushes the groups on a bounded worker pool and stores
+the Zoho invoice id, or the error plus the time of the next attempt
+(exponential backoff with jitter, or Zoho's Retry-After on 429). Every Zoho
+call goes through the shared rate governor (backend/erp_governor.py).
+
+Row status: pending → in_flight → synced | (pending again | dead after ERP_MAX_ATTEMPTS)
+
+Throttling (the governor's budget is spent, or Zoho answered 429) is not a
+failed attempt: the row goes back to pending at Retry-After with its attempt
+refunded, so sustained throttling cannot push rows to dead.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from backend.db import get_conn
+from backend.erp_integration import push_invoice, resolve_customer
+from backend.erp_governor import RateLimited, headroom
+from backend.zoho_contacts import normalize_name
+from backend import heartbeat, metrics
+
+load_dotenv()
+
+ERP_OUTBOX_DISPATCH = os.getenv("ERP_OUTBOX_DISPATCH", "1") == "1"     # 0 = this process only writes the outbox
+ERP_OUTBOX_WORKERS = int(os.getenv("ERP_OUTBOX_WORKERS", "4"))          # customer groups pushed concurrently
+ERP_OUTBOX_BATCH = int(os.getenv("ERP_OUTBOX_BATCH", "50"))            # rows claimed per poll
+ERP_OUTBOX_POLL_INTERVAL = float(os.getenv("ERP_OUTBOX_POLL_INTERVAL", "5"))
+ERP_OUTBOX_LEASE_SECONDS = float(os.getenv("ERP_OUTBOX_LEASE_SECONDS", "300"))   # renewed while the batch runs
+ERP_MAX_ATTEMPTS = int(os.getenv("ERP_MAX_ATTEMPTS", "8"))
+ERP_BACKOFF_BASE = float(os.getenv("ERP_BACKOFF_BASE", "30"))          # seconds, doubled per attempt
+ERP_BACKOFF_MAX = float(os.getenv("ERP_BACKOFF_MAX", "3600"))
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_dispatchers = []
+
+
+def notify():
+    """Wake the dispatcher (in this process) right after a commit instead of at the next poll."""
+    _wakeup.set()
+
+
+def backoff_delay(attempts: int) -> float:
+    """Seconds before retry number `attempts` (1-based): base * 2^(n-1), capped, ±20% jitter."""
+    delay = min(ERP_BACKOFF_MAX, ERP_BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.8, 1.2)
+
+
+# ---------------- OUTBOX OPERATIONS ----------------
+def claim_due(limit: int = ERP_OUTBOX_BATCH) -> List[Dict]:
+    """Atomically lease up to `limit` rows that are due (or whose lease expired)."""
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        rows = conn.execute(
+            """
+            UPDATE erp_outbox
+            SET status = 'in_flight', attempts = attempts + 1, lease_until = ?, updated_at = ?
+            WHERE invoice_id IN (
+                SELECT invoice_id FROM erp_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'in_flight' AND lease_until < ?)
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+            RETURNING invoice_id, user_id, payload_json, attempts
+            """,
+            (now + ERP_OUTBOX_LEASE_SECONDS, now, now, now, limit)
+        ).fetchall()
+
+    return [
+        {"invoice_id": r[0], "user_id": r[1], "data": json.loads(r[2]), "attempts": r[3]}
+        for r in rows
+    ]
+
+
+def renew_leases(invoice_ids) -> int:
+    """Push lease_until out for rows this dispatcher is still pushing."""
+    invoice_ids = list(invoice_ids)
+    if not invoice_ids:
+        return 0
+    conn = get_conn()
+    with conn:
+        cursor = conn.execute(
+            f"UPDATE erp_outbox SET lease_until = ? WHERE status = 'in_flight' "
+            f"AND invoice_id IN ({','.join('?' * len(invoice_ids))})",
+            (time.time() + ERP_OUTBOX_LEASE_SECONDS, *invoice_ids)
+        )
+    return cursor.rowcount
+
+
+def mark_synced(invoice_id: int, zoho_invoice: Dict):
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            UPDATE erp_outbox
+            SET status = 'synced', zoho_invoice_id = ?, zoho_invoice_number = ?, last_error = NULL,
+                lease_until = NULL, updated_at = ?, synced_at = ?
+            WHERE invoice_id = ? AND status = 'in_flight'
+            """,
+            (zoho_invoice.get("invoice_id"), zoho_invoice.get("invoice_number"), now, now, invoice_id)
+        )
+
+
+def mark_failed(invoice_id: int, attempts: int, error: str):
+    """Record the error; schedule a retry, or give up after ERP_MAX_ATTEMPTS."""
+    now = time.time()
+    dead = attempts >= ERP_MAX_ATTEMPTS
+    delay = backoff_delay(attempts)
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            UPDATE erp_outbox
+            SET status = ?, last_error = ?, next_attempt_at = ?, lease_until = NULL, updated_at = ?
+            WHERE invoice_id = ? AND status = 'in_flight'
+            """,
+            ("dead" if dead else "pending", error, now + delay, now, invoice_id)
+        )
+    return dead
+
+
+def mark_throttled(invoice_id: int, retry_after: float, error: str):
+    """Back to pending at retry_after; the attempt claim_due() counted is given back."""
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            UPDATE erp_outbox
+            SET status = 'pending', attempts = MAX(attempts - 1, 0), last_error = ?,
+                next_attempt_at = ?, lease_until = NULL, updated_at = ?
+            WHERE invoice_id = ? AND status = 'in_flight'
+            """,
+            (error, now + retry_after, now, invoice_id)
+        )
+
+
+def requeue(invoice_id: int) -> bool:
+    """Retry a dead (or pending) row now, with a fresh attempt budget."""
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        cursor = conn.execute(
+            """
+            UPDATE erp_outbox SET status = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ?
+            WHERE invoice_id = ? AND status IN ('pending', 'dead')
+            """,
+            (now, now, invoice_id)
+        )
+    notify()
+    return cursor.rowcount > 0
+
+
+def get_sync_status(invoice_id: int) -> Optional[Dict]:
+    cursor = get_conn().cursor()
+    cursor.row_factory = lambda c, r: {d[0]: v for d, v in zip(c.description, r)}
+    cursor.execute(
+        """
+        SELECT invoice_id, user_id, status, attempts, next_attempt_at, zoho_invoice_id,
+               zoho_invoice_number, last_error, created_at, updated_at, synced_at
+        FROM erp_outbox WHERE invoice_id = ?
+        """,
+        (invoice_id,)
+    )
+    return cursor.fetchone()
+
+
+def outbox_counts() -> Dict[str, int]:
+    rows = get_conn().execute("SELECT status, COUNT(*) FROM erp_outbox GROUP BY status").fetchall()
+    return {status: count for status, count in rows}
+
+
+# ---------------- DISPATCHER ----------------
+def _record(entry: Dict, result: Dict) -> str:
+    """Store the outcome of one push. Returns the row's new status."""
+    invoice_id = entry["invoice_id"]
+    if result.get("status") == "success":
+        mark_synced(invoice_id, result.get("data") or {})
+        metrics.ERP_PUSHES.inc(outcome="synced")
+        logging.info(f"ERP sync done for invoice ID={invoice_id}")
+        return "synced"
+
+    error = result.get("message") or "Unknown ERP error"
+    if result.get("retry_after") is not None:
+        # Rate limited (governor or Zoho 429): reschedule without using up an attempt
+        mark_throttled(invoice_id, result["retry_after"], error)
+        metrics.ERP_PUSHES.inc(outcome="throttled")
+        logging.info(f"ERP sync for invoice ID={invoice_id} throttled, retrying in {result['retry_after']:.0f}s")
+        return "pending"
+
+    dead = mark_failed(invoice_id, entry["attempts"], error)
+    metrics.ERP_PUSHES.inc(outcome="dead" if dead else "retry")
+    logging.warning(f"ERP sync failed for invoice ID={invoice_id} (attempt {entry['attempts']}): {error}")
+    return "dead" if dead else "pending"
+
+
+def push_group(entries: List[Dict]) -> List[str]:
+    """
+    Push claimed rows that share a customer: the contact is resolved (or
+    created) once for the whole group, then one Zoho call per invoice.
+    """
+    first = entries[0]["data"]
+    try:
+        with heartbeat.working("erp-push"):
+            customer_id = resolve_customer(
+                first.get("customer_name", "Walk-In Customer"), first.get("email", "auto@system.com")
+            )
+        failure = None if customer_id else {"status": "error", "message": "Failed to create or locate customer"}
+    except RateLimited as e:
+        failure = {"status": "error", "message": str(e), "retry_after": e.retry_after}
+    except Exception as e:
+        logging.exception("ERP customer resolution failed")
+        failure = {"status": "error", "message": str(e)}
+
+    statuses = []
+    for entry in entries:
+        if failure is None:
+            try:
+                with heartbeat.working("erp-push"):
+                    result = push_invoice(entry["data"], customer_id)
+            except RateLimited as e:
+                # Out of budget: the rest of the group waits for the same window
+                failure = result = {"status": "error", "message": str(e), "retry_after": e.retry_after}
+            except Exception as e:
+                logging.exception("ERP push failed")
+                result = {"status": "error", "message": str(e)}
+        else:
+            result = failure
+        statuses.append(_record(entry, result))
+    return statuses
+
+
+def group_by_customer(entries: List[Dict]) -> List[List[Dict]]:
+    groups = {}
+    for entry in entries:
+        key = normalize_name(entry["data"].get("customer_name") or "Walk-In Customer")
+        groups.setdefault(key, []).append(entry)
+    return list(groups.values())
+
+
+def sync_stats() -> Dict:
+    """Outbox backlog, recent throughput and Zoho rate-limit headroom."""
+    now = time.time()
+    conn = get_conn()
+    synced_minute, synced_hour = conn.execute(
+        "SELECT SUM(synced_at > ?), SUM(synced_at > ?) FROM erp_outbox WHERE status = 'synced'",
+        (now - 60, now - 3600)
+    ).fetchone()
+    return {
+        "outbox": outbox_counts(),
+        "throughput": {
+            "synced_last_minute": synced_minute or 0,
+            "synced_last_hour": synced_hour or 0,
+        },
+        "rate_limit": headroom(),
+        "workers": ERP_OUTBOX_WORKERS,
+    }
+
+
+def _dispatcher_loop(pool: ThreadPoolExecutor):
+    while not _stop.is_set():
+        heartbeat.beat("erp-outbox")
+        try:
+            batch = claim_due()
+        except Exception:
+            logging.exception("ERP outbox claim failed")
+            batch = []
+
+        if not batch:
+            _wakeup.wait(ERP_OUTBOX_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        # Wait for the batch so claims never run ahead of the workers; each
+        # push carries its own heartbeat mark, so waiting here counts as alive
+        pending = [pool.submit(push_group, group) for group in group_by_customer(batch)]
+        invoice_ids = [entry["invoice_id"] for entry in batch]
+        while pending:
+            heartbeat.beat("erp-outbox")
+            done, pending = wait(pending, timeout=min(ERP_OUTBOX_POLL_INTERVAL, ERP_OUTBOX_LEASE_SECONDS / 3))
+            for future in done:
+                if future.exception():
+                    logging.error("ERP push group failed", exc_info=future.exception())
+            if pending:
+                # A long batch (throttled Zoho, big groups) must not outlive its
+                # leases, or another dispatcher claims and pushes the rows again
+                try:
+                    renew_leases(invoice_ids)
+                except Exception:
+                    logging.exception("ERP outbox lease renewal failed")
+    heartbeat.forget("erp-outbox")
+
+
+def start_outbox_dispatcher():
+    _stop.clear()
+    pool = ThreadPoolExecutor(max_workers=ERP_OUTBOX_WORKERS, thread_name_prefix="erp-push")
+    t = threading.Thread(target=_dispatcher_loop, args=(pool,), name="erp-outbox", daemon=True)
+    t.start()
+    _dispatchers.append((t, pool))
+    logging.info("ERP outbox dispatcher started")
+
+
+def stop_outbox_dispatcher(timeout: float = 5):
+    _stop.set()
+    _wakeup.set()
+    for t, pool in _dispatchers:
+        t.join(timeout)
+        pool.shutdown(wait=False, cancel_futures=True)
+    _dispatchers.clear()
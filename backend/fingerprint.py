@@ -0,0 +1,40 @@
+# backend/fingerprint.py
+"""
+Document fingerprints used to short-circuit duplicate ingestion.
+
+- document_hash: SHA-256 of the raw upload bytes (same file sent twice)
+- invoice_key:   SHA-256 of the normalized customer, reference number, date and
+                 total (same invoice arriving as a different file, e.g. a scan
+                 dropped in the folder and the PDF from email)
+"""
+import hashlib
+import re
+
+
+def document_hash(content) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _normalize_name(name) -> str:
+    name = re.sub(r"[^a-z0-9 ]", " ", str(name or "").lower())
+    return " ".join(name.split())
+
+
+def _normalize_reference(ref) -> str:
+    return re.sub(r"[^A-Z0-9]", "", str(ref or "").upper())
+
+
+def invoice_key(data: dict) -> str:
+    """Key over validated invoice data (see data_validator.validate_invoice_data)."""
+    try:
+        total = f"{float(data.get('total') or 0):.2f}"
+    except (TypeError, ValueError):
+        total = "0.00"
+
+    parts = [
+        _normalize_name(data.get("customer_name")),
+        _normalize_reference(data.get("reference_number")),
+        str(data.get("invoice_date") or "").strip(),
+        total,
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
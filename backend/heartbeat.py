@@ -0,0 +1,48 @@
+# backend/heartbeat.py
+"""
+Liveness marks for the workflow supervisor (agents/workflow_agent.py).
+
+Work loops call beat(name) on every iteration, including while they wait on
+a queue or on backpressure; one unit of work (a pipeline stage, a folder
+file, an ERP push) runs inside `with working(name):`. oldest() is the
+timestamp of the stalest mark: a loop that stopped iterating or a unit of
+work that has been running too long drags it back, and that is the
+heartbeat the supervisor judges the process by. A process with no marks
+(e.g. the API, which has its /health probe) always reads as alive.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+_marks = {}                  # (name, thread id or None) -> time
+_lock = threading.Lock()
+
+
+def beat(name: str):
+    """The loop `name` just went round."""
+    with _lock:
+        _marks[(name, None)] = time.time()
+
+
+def forget(name: str):
+    """The loop `name` ended on purpose; stop judging the process by it."""
+    with _lock:
+        _marks.pop((name, None), None)
+
+
+@contextmanager
+def working(name: str):
+    """Marks one unit of work from its start until it returns."""
+    key = (name, threading.get_ident())
+    with _lock:
+        _marks[key] = time.time()
+    try:
+        yield
+    finally:
+        with _lock:
+            _marks.pop(key, None)
+
+
+def oldest() -> float:
+    with _lock:
+        return min(_marks.values()) if _marks else time.time()
@@ -0,0 +1,374 @@
+# backend/imap_client.py
+"""
+Minimal asyncio IMAP4rev1 client for the email agent (agents/email_watcher.py).
+
+imaplib is blocking and has no IDLE, which the agent needs to keep hundreds of
+mailboxes open on one event loop. This implements only what the agent uses:
+LOGIN, CAPABILITY, SELECT, UID SEARCH / FETCH / STORE, NOOP, IDLE, LOGOUT.
+
+Responses are parsed into nested lists: atoms and quoted strings as bytes,
+NIL as None, literals ({n}) as bytes, parenthesized lists as lists.
+body_parts() turns a BODYSTRUCTURE into its leaf parts so callers can fetch
+single sections (BODY.PEEK[2]) instead of whole messages.
+"""
+import asyncio
+import binascii
+import quopri
+import re
+import ssl as ssl_lib
+from email.header import decode_header, make_header
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+IMAP_LINE_LIMIT = 1024 * 1024  # longest non-literal line (BODYSTRUCTURE of big messages)
+
+_TOKEN = re.compile(
+    rb"""\s*(?:
+        (?P<open>\() | (?P<close>\)) |
+        "(?P<quoted>(?:[^"\\]|\\.)*)" |
+        \{(?P<literal>\d+)\}$ |
+        (?P<atom>[^\s()"\[]+(?:\[[^\]]*\](?:<[\d.]+>)?)?)
+    )""",
+    re.VERBOSE,
+)
+_LITERAL = re.compile(rb"\{(\d+)\}\r\n$")
+
+
+class IMAPError(Exception):
+    pass
+
+
+def parse_server(host: str) -> Tuple[str, int, bool]:
+    """imap_host column → (host, port, use_ssl). Accepts host, host:port, imap://h:p (plain) and imaps://h:p."""
+    if "://" not in host:
+        host = f"imaps://{host}"
+    url = urlparse(host)
+    use_ssl = url.scheme != "imap"
+    return url.hostname, url.port or (993 if use_ssl else 143), use_ssl
+
+
+def quote(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def parse_items(parts: List[bytes]) -> list:
+    """Tokenize one response (text fragments alternating with literal bodies) into nested lists."""
+    root = []
+    stack = [root]
+    literal_next = False
+    for index, part in enumerate(parts):
+        if literal_next:
+            stack[-1].append(part)
+            literal_next = False
+            continue
+        pos = 0
+        while pos < len(part):
+            m = _TOKEN.match(part, pos)
+            if not m or m.end() == pos:
+                if part[pos:].strip():
+                    raise IMAPError(f"Unparsable response near {part[pos:pos + 40]!r}")
+                break
+            pos = m.end()
+            if m.group("open"):
+                stack.append([])
+                stack[-2].append(stack[-1])
+            elif m.group("close"):
+                if len(stack) > 1:
+                    stack.pop()
+            elif m.group("quoted") is not None:
+                stack[-1].append(re.sub(rb"\\(.)", rb"\1", m.group("quoted")))
+            elif m.group("literal") is not None:
+                literal_next = True
+            elif m.group("atom"):
+                atom = m.group("atom")
+                stack[-1].append(None if atom.upper() == b"NIL" else atom)
+    return root
+
+
+def fetch_items(response: List[bytes]) -> Tuple[int, Dict[str, object]]:
+    """'* 3 FETCH (UID 17 RFC822 {..})' → (3, {"UID": b"17", "RFC822": b"..."}), keys upper-cased."""
+    tokens = parse_items(response)
+    seq, values = int(tokens[1]), tokens[3]
+    items = {}
+    for i in range(0, len(values) - 1, 2):
+        key = values[i].decode().upper()
+        # Servers answer BODY.PEEK[...] as BODY[...]
+        items[key.replace("BODY.PEEK[", "BODY[")] = values[i + 1]
+    return seq, items
+
+
+# ---------------- BODYSTRUCTURE ----------------
+def _text(value) -> str:
+    return value.decode(errors="replace") if isinstance(value, bytes) else ""
+
+
+def _params(values) -> Dict[str, str]:
+    """("NAME" "x.pdf" "CHARSET" "utf-8") → {"name": "x.pdf", "charset": "utf-8"}."""
+    if not isinstance(values, list):
+        return {}
+    return {_text(values[i]).lower(): _text(values[i + 1]) for i in range(0, len(values) - 1, 2)}
+
+
+def _filename(disposition_params: Dict[str, str], type_params: Dict[str, str]) -> Optional[str]:
+    for params in (disposition_params, type_params):
+        for key in ("filename", "name"):
+            if params.get(key + "*"):   # RFC 2231: utf-8''invoice%20M%C3%A4rz.pdf
+                charset, _, value = params[key + "*"].split("'", 2) if params[key + "*"].count("'") >= 2 \
+                    else ("utf-8", "", params[key + "*"])
+                try:
+                    return unquote(value, encoding=charset or "utf-8", errors="replace")
+                except LookupError:
+                    return unquote(value, errors="replace")
+            if params.get(key):         # RFC 2047 encoded words are common here too
+                try:
+                    return str(make_header(decode_header(params[key])))
+                except Exception:
+                    return params[key]
+    return None
+
+
+def body_parts(structure: list, section: str = "") -> List[Dict]:
+    """
+    Leaf parts of a BODYSTRUCTURE with their section numbers ("1", "2.1", ...):
+    dicts with section, type ("application/pdf"), encoding, size (encoded
+    bytes), disposition and filename. Attached messages (message/rfc822)
+    are listed as one part, not descended into.
+    """
+    if structure and isinstance(structure[0], list):
+        # Children come first, then the subtype and extension data (which may contain lists too)
+        parts = []
+        for i, child in enumerate(structure):
+            if not isinstance(child, list):
+                break
+            parts.extend(body_parts(child, f"{section}.{i + 1}" if section else str(i + 1)))
+        return parts
+
+    maintype, subtype = _text(structure[0]).lower(), _text(structure[1]).lower()
+    extension = 7
+    if maintype == "text":
+        extension = 8
+    elif (maintype, subtype) == ("message", "rfc822"):
+        extension = 10
+    # extension data: body MD5, then disposition ("attachment" ("filename" "x.pdf"))
+    disposition = structure[extension + 1] if len(structure) > extension + 1 else None
+    disposition_type, disposition_params = None, {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = _text(disposition[0]).lower()
+        disposition_params = _params(disposition[1] if len(disposition) > 1 else None)
+
+    return [{
+        "section": section or "1",
+        "type": f"{maintype}/{subtype}",
+        "encoding": _text(structure[5]).lower() if len(structure) > 5 else "7bit",
+        "size": int(structure[6]) if len(structure) > 6 and structure[6] else 0,
+        "disposition": disposition_type,
+        "filename": _filename(disposition_params, _params(structure[2])),
+    }]
+
+
+def decode_part(data: bytes, encoding: str) -> bytes:
+    """Undo the Content-Transfer-Encoding of a fetched section."""
+    if encoding == "base64":
+        return binascii.a2b_base64(data)
+    if encoding == "quoted-printable":
+        return quopri.decodestring(data)
+    return data
+
+
+# ---------------- CLIENT ----------------
+async def _wait_for(aw, timeout: float):
+    """
+    asyncio.wait_for without its cancellation race: before Python 3.12 a
+    cancel that lands as the awaited read completes is swallowed and the
+    result returned, so a cancelled watcher carried on into a 25-minute IDLE.
+    """
+    task = asyncio.ensure_future(aw)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=max(timeout, 0))
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        raise asyncio.TimeoutError()
+    return task.result()
+
+
+class AsyncIMAP:
+    """One IMAP connection. Not safe for concurrent commands; one task owns it."""
+
+    def __init__(self, host: str, port: int = 993, use_ssl: bool = True, timeout: float = 30):
+        self.host, self.port, self.use_ssl, self.timeout = host, port, use_ssl, timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.capabilities = set()
+        self.new_mail = False   # set by any untagged EXISTS/RECENT; the caller clears it before a sweep
+        self._tag = 0
+
+    @classmethod
+    def from_url(cls, host: str, timeout: float = 30) -> "AsyncIMAP":
+        return cls(*parse_server(host), timeout=timeout)
+
+    # ---------------- WIRE ----------------
+    async def connect(self):
+        context = ssl_lib.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await _wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context, limit=IMAP_LINE_LIMIT), self.timeout
+        )
+        greeting = await self._read_response()
+        if not greeting[0].startswith((b"* OK", b"* PREAUTH")):
+            raise IMAPError(f"Unexpected greeting: {greeting[0]!r}")
+        await self.capability()
+
+    async def _read_response(self) -> List[bytes]:
+        """One response line plus any literals it announces: [text, literal, text, ...]."""
+        parts = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("IMAP server closed the connection")
+            m = _LITERAL.search(line)
+            if not m:
+                parts.append(line.rstrip(b"\r\n"))
+                words = parts[0].split()
+                if len(words) >= 3 and words[0] == b"*" and words[2].upper() in (b"EXISTS", b"RECENT"):
+                    self.new_mail = True
+                return parts
+            parts.append(line[:m.start()] + b"{" + m.group(1) + b"}")
+            parts.append(await self.reader.readexactly(int(m.group(1))))
+
+    async def _send(self, line: str) -> str:
+        self._tag += 1
+        tag = f"A{self._tag:04d}"
+        self.writer.write(f"{tag} {line}\r\n".encode())
+        await self.writer.drain()
+        return tag
+
+    async def command(self, line: str, timeout: Optional[float] = None) -> List[List[bytes]]:
+        """Send a command, return its untagged responses; raises IMAPError unless tagged OK."""
+        return await _wait_for(self._command(line), timeout or self.timeout)
+
+    async def _command(self, line: str) -> List[List[bytes]]:
+        tag = (await self._send(line)).encode()
+        untagged = []
+        while True:
+            response = await self._read_response()
+            head = response[0]
+            if head.startswith(tag + b" "):
+                status = head[len(tag) + 1:]
+                if not status.upper().startswith(b"OK"):
+                    raise IMAPError(f"{line.split(' ', 1)[0]} failed: {status.decode(errors='replace')}")
+                return untagged
+            untagged.append(response)
+
+    # ---------------- COMMANDS ----------------
+    async def capability(self) -> set:
+        for response in await self.command("CAPABILITY"):
+            if response[0].upper().startswith(b"* CAPABILITY"):
+                self.capabilities = {c.decode().upper() for c in response[0].split()[2:]}
+        return self.capabilities
+
+    async def login(self, user: str, password: str):
+        await self.command(f"LOGIN {quote(user)} {quote(password)}")
+        # Servers may advertise more (IDLE, ...) after authentication
+        await self.capability()
+
+    async def select(self, mailbox: str = "INBOX") -> Dict[str, int]:
+        """Returns EXISTS, UIDVALIDITY, UIDNEXT (when the server sends them)."""
+        info = {}
+        for response in await self.command(f"SELECT {quote(mailbox)}"):
+            words = response[0].split()
+            if len(words) >= 3 and words[2].upper() == b"EXISTS":
+                info["EXISTS"] = int(words[1])
+            for key in (b"UIDVALIDITY", b"UIDNEXT"):
+                m = re.search(rb"\[" + key + rb" (\d+)\]", response[0], re.I)
+                if m:
+                    info[key.decode()] = int(m.group(1))
+        return info
+
+    async def uid_search(self, criteria: str) -> List[int]:
+        uids = []
+        for response in await self.command(f"UID SEARCH {criteria}"):
+            words = response[0].split()
+            if len(words) >= 2 and words[1].upper() == b"SEARCH":
+                uids.extend(int(w) for w in words[2:])
+        return uids
+
+    async def uid_fetch(self, uids: str, items: str, timeout: Optional[float] = None) -> Dict[int, Dict[str, object]]:
+        """uid → fetched items (see fetch_items). Unsolicited FETCHes without a UID are dropped."""
+        fetched = {}
+        for response in await self.command(f"UID FETCH {uids} {items}", timeout):
+            if b" FETCH " not in response[0].upper():
+                continue
+            _, data = fetch_items(response)
+            if data.get("UID") is not None:
+                fetched[int(data["UID"])] = data
+        return fetched
+
+    async def uid_store(self, uids: str, flags: str):
+        await self.command(f"UID STORE {uids} {flags}")
+
+    async def noop(self) -> List[List[bytes]]:
+        return await self.command("NOOP")
+
+    async def idle(self, timeout: float) -> bool:
+        """
+        IDLE until the server reports new mail (EXISTS/RECENT) or timeout
+        passes, then DONE. Returns True if new mail arrived, right away if it
+        was already announced during an earlier command.
+
+        timeout is one deadline for the whole IDLE: keepalives and other
+        untagged lines do not extend it (RFC 2177 servers drop clients that
+        stay past 29 minutes). A read still pending at the deadline is kept
+        and receives the first line after DONE.
+        """
+        if self.new_mail:
+            return True
+        tag = (await self._send("IDLE")).encode()
+        first = await _wait_for(self._read_response(), self.timeout)
+        if not first[0].startswith(b"+"):
+            raise IMAPError(f"IDLE rejected: {first[0]!r}")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        read = None
+        try:
+            while not self.new_mail:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                read = read or asyncio.ensure_future(self._read_response())
+                done, _ = await asyncio.wait({read}, timeout=remaining)
+                if not done:
+                    break
+                read, response = None, read
+                response.result()   # re-raises a dropped connection
+
+            self.writer.write(b"DONE\r\n")
+            await self.writer.drain()
+            while True:
+                # A read still pending from the IDLE loop gets the next line
+                read = read or asyncio.ensure_future(self._read_response())
+                response = await _wait_for(read, self.timeout)
+                read = None
+                if response[0].startswith(tag + b" "):
+                    return self.new_mail
+        finally:
+            if read is not None and not read.done():
+                read.cancel()
+
+    async def logout(self):
+        try:
+            await self.command("LOGOUT", timeout=5)
+        except Exception:
+            pass
+        await self.close()
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
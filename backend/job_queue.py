@@ -0,0 +1,336 @@
+# backend/job_queue.py
+"""
+Durable SQLite-backed job queue for invoice processing.
+
+The upload endpoint only spools the file and inserts a `jobs` row; a
+dispatcher thread claims jobs and hands them to the staged pipeline
+(backend/pipeline.py), recording per-stage progress. Claims are leases: a job
+whose process died (lease expired) is picked up again, so no broker is needed
+and restarts lose nothing. Leases of jobs this process holds are renewed every
+JOB_LEASE_SECONDS / 3 until they finish, including while a job waits in the
+pipeline's queues, so a live job is never claimed twice.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import BinaryIO, Callable, Dict, List, Optional, Union
+
+from dotenv import load_dotenv
+
+from backend import heartbeat
+from backend.db import get_conn
+from backend.document import Document
+from backend.uploads import save_upload_to, MAX_UPLOAD_BYTES
+
+load_dotenv()
+
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", "DB/jobs")
+JOB_DISPATCH = os.getenv("JOB_DISPATCH", "1") == "1"              # 0 = this process only enqueues
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))     # seconds between idle polls
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "600"))   # renewed on every stage change
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_dispatchers = []
+_in_flight = set()           # job ids claimed here and not finished yet
+_in_flight_lock = threading.Lock()
+
+
+# ---------------- QUEUE OPERATIONS ----------------
+def enqueue_job(
+    user_id: int,
+    filename: str,
+    content: Union[bytes, BinaryIO],
+    batch_id: Optional[str] = None,
+    max_bytes: Optional[int] = MAX_UPLOAD_BYTES,
+) -> str:
+    """
+    Spool content (bytes, or a binary stream copied in chunks) and queue a job
+    for it. Streams over max_bytes are rejected (HTTP 413) mid-copy.
+    """
+    job_id = uuid.uuid4().hex
+    os.makedirs(JOB_SPOOL_DIR, exist_ok=True)
+    payload_path = os.path.join(JOB_SPOOL_DIR, job_id)
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        with open(payload_path, "wb") as f:
+            f.write(content)
+    else:
+        save_upload_to(content, payload_path, max_bytes)
+
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO jobs (id, user_id, filename, payload_path, status, created_at, batch_id)
+            VALUES (?, ?, ?, ?, 'queued', ?, ?)
+            """,
+            (job_id, user_id, filename, payload_path, time.time(), batch_id)
+        )
+
+    _wakeup.set()
+    return job_id
+
+
+def create_batch(user_id: int) -> str:
+    batch_id = uuid.uuid4().hex
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO batches (id, user_id, created_at) VALUES (?, ?, ?)",
+            (batch_id, user_id, time.time())
+        )
+    return batch_id
+
+
+def set_batch_skipped(batch_id: str, skipped: List[Dict]):
+    conn = get_conn()
+    with conn:
+        conn.execute("UPDATE batches SET skipped_json = ? WHERE id = ?", (json.dumps(skipped), batch_id))
+
+
+def get_batch(batch_id: str) -> Optional[Dict]:
+    """Batch summary: counts per job status plus every file's job state and result."""
+    cursor = get_conn().cursor()
+    cursor.row_factory = lambda c, r: {d[0]: v for d, v in zip(c.description, r)}
+    cursor.execute("SELECT * FROM batches WHERE id = ?", (batch_id,))
+    batch = cursor.fetchone()
+    if not batch:
+        return None
+
+    cursor.execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at", (batch_id,))
+    jobs = [_job_from_row(row) for row in cursor.fetchall()]
+
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+
+    return {
+        "batch_id": batch_id,
+        "user_id": batch["user_id"],
+        "created_at": batch["created_at"],
+        "total": len(jobs),
+        "counts": counts,
+        "complete": all(job["status"] in ("done", "failed") for job in jobs),
+        "skipped": json.loads(batch["skipped_json"] or "[]"),
+        "files": [
+            {
+                "job_id": job["id"],
+                "filename": job["filename"],
+                "status": job["status"],
+                "stage": job["stage"],
+                "error": job["error"],
+                "result": job["result"],
+            }
+            for job in jobs
+        ],
+    }
+
+
+def _job_from_row(row) -> Dict:
+    job = dict(row)
+    job["stages"] = json.loads(job.pop("stages_json") or "{}")
+    job["result"] = json.loads(job.pop("result_json")) if job.get("result_json") else None
+    job.pop("payload_path", None)
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    cursor = get_conn().cursor()
+    cursor.row_factory = lambda c, r: {d[0]: v for d, v in zip(c.description, r)}
+    cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    return _job_from_row(row) if row else None
+
+
+def claim_job() -> Optional[Dict]:
+    """Atomically take the oldest queued job (or one whose lease expired)."""
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        cursor = conn.execute(
+            """
+            UPDATE jobs
+            SET status = 'running', started_at = ?, lease_until = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)
+                ORDER BY created_at
+                LIMIT 1
+            )
+            RETURNING id, user_id, filename, payload_path, attempts, batch_id
+            """,
+            (now, now + JOB_LEASE_SECONDS, now)
+        )
+        row = cursor.fetchone()
+
+    if not row:
+        return None
+    return {
+        "id": row[0], "user_id": row[1], "filename": row[2], "payload_path": row[3],
+        "attempts": row[4], "batch_id": row[5],
+    }
+
+
+def update_stage(job_id: str, stage: str):
+    """Mark `stage` as started (and the previous one as finished); renews the lease."""
+    now = time.time()
+    conn = get_conn()
+    with conn:
+        row = conn.execute("SELECT stage, stages_json FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        previous, stages = row[0], json.loads(row[1] or "{}")
+        if previous in stages:
+            stages[previous]["finished_at"] = now
+        stages[stage] = {"started_at": now}
+
+        conn.execute(
+            "UPDATE jobs SET stage = ?, stages_json = ?, lease_until = ? WHERE id = ?",
+            (stage, json.dumps(stages), now + JOB_LEASE_SECONDS, job_id)
+        )
+
+
+def renew_leases(job_ids) -> int:
+    """Push lease_until out for running jobs this process still holds."""
+    job_ids = list(job_ids)
+    if not job_ids:
+        return 0
+    conn = get_conn()
+    with conn:
+        cursor = conn.execute(
+            f"UPDATE jobs SET lease_until = ? WHERE status = 'running' AND id IN ({','.join('?' * len(job_ids))})",
+            (time.time() + JOB_LEASE_SECONDS, *job_ids)
+        )
+    return cursor.rowcount
+
+
+def finish_job(job_id: str, result: Dict, error: Optional[str] = None):
+    now = time.time()
+    status = "failed" if error or result.get("status") == "failed" else "done"
+    conn = get_conn()
+    with conn:
+        row = conn.execute("SELECT stage, stages_json, payload_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        stages = json.loads(row[1] or "{}")
+        if row[0] in stages:
+            stages[row[0]]["finished_at"] = now
+
+        conn.execute(
+            """
+            UPDATE jobs
+            SET status = ?, stages_json = ?, result_json = ?, error = ?, finished_at = ?, lease_until = NULL
+            WHERE id = ?
+            """,
+            (status, json.dumps(stages), json.dumps(result, default=str),
+             error or result.get("error"), now, job_id)
+        )
+
+    # Terminal either way (claim_job never picks failed jobs up again)
+    if os.path.exists(row[2]):
+        os.remove(row[2])
+
+
+# ---------------- DISPATCHER ----------------
+def _dispatch_one(job: Dict, submit: Callable):
+    job_id = job["id"]
+
+    if job["attempts"] > JOB_MAX_ATTEMPTS:
+        finish_job(job_id, {"status": "failed"}, error=f"Gave up after {JOB_MAX_ATTEMPTS} attempts")
+        return
+
+    document = Document.from_path(
+        job["payload_path"], job["user_id"], "batch" if job["batch_id"] else "api", filename=job["filename"]
+    )
+
+    def done(future):
+        document.close()
+        try:
+            finish_job(job_id, future.result())
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            finish_job(job_id, {"status": "failed"}, error=str(getattr(e, "detail", e)))
+        finally:
+            with _in_flight_lock:
+                _in_flight.discard(job_id)
+
+    with _in_flight_lock:
+        _in_flight.add(job_id)
+    try:
+        # Memory-mapped, not read: the pipeline hashes it in place and OCR workers get the path.
+        # Waits while the pipeline's first queue is full, so we never claim more than we can run
+        while True:
+            try:
+                future = submit(document, on_stage=lambda stage: update_stage(job_id, stage),
+                                timeout=JOB_POLL_INTERVAL)
+                break
+            except queue.Full:
+                heartbeat.beat("job-dispatcher")   # waiting on the pipeline is not hanging
+                if _stop.is_set():
+                    # Still leased; another dispatcher takes it once the lease runs out
+                    document.close()
+                    with _in_flight_lock:
+                        _in_flight.discard(job_id)
+                    return
+    except Exception as e:
+        logging.exception(f"Job {job_id} could not be dispatched")
+        document.close()
+        finish_job(job_id, {"status": "failed"}, error=str(e))
+        with _in_flight_lock:
+            _in_flight.discard(job_id)
+        return
+
+    future.add_done_callback(done)
+
+
+def _dispatcher_loop(submit: Callable):
+    while not _stop.is_set():
+        heartbeat.beat("job-dispatcher")
+        try:
+            job = claim_job()
+        except Exception:
+            logging.exception("Job claim failed")
+            job = None
+
+        if job is None:
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        _dispatch_one(job, submit)
+    heartbeat.forget("job-dispatcher")
+
+
+def _lease_renewer_loop():
+    while not _stop.wait(JOB_LEASE_SECONDS / 3):
+        with _in_flight_lock:
+            job_ids = list(_in_flight)
+        try:
+            renew_leases(job_ids)
+        except Exception:
+            logging.exception("Job lease renewal failed")
+
+
+def start_job_dispatcher(submit: Callable):
+    """
+    Start the dispatcher thread. submit(document, on_stage=..., timeout=...) must
+    return a concurrent.futures.Future, or raise queue.Full when no slot freed up
+    within timeout seconds (e.g. StagedPipeline.submit).
+    """
+    _stop.clear()
+    t = threading.Thread(target=_dispatcher_loop, args=(submit,), name="job-dispatcher", daemon=True)
+    t.start()
+    _dispatchers.append(t)
+    renewer = threading.Thread(target=_lease_renewer_loop, name="job-lease-renewer", daemon=True)
+    renewer.start()
+    _dispatchers.append(renewer)
+    logging.info("Job dispatcher started")
+
+
+def stop_job_dispatcher(timeout: float = 5):
+    _stop.set()
+    _wakeup.set()
+    for t in _dispatchers:
+        t.join(timeout)
+    _dispatchers.clear()
@@ -75,8 +75,10 @@
 import re
 import json
 import os
+import time
 import requests
 from dotenv import load_dotenv 
+from backend import metrics
 
 load_dotenv()
 
@@ -124,6 +126,15 @@ def extract_fields(text: str) -> dict:
     Extract all invoice fields using LLM ONLY.
     No regex. Robust for messy OCR.
     """
+    fields, _ = extract_fields_raw(text)
+    return fields
+
+
+def extract_fields_raw(text: str):
+    """
+    Same as extract_fields, but returns (fields, raw_llm_content) so the raw
+    response can be archived. raw_llm_content is None if the call failed.
+    """
     text = sanitize_text(text)
     print("Cleaned OCR:",text)
 
@@ -173,6 +184,8 @@ OCR TEXT:
         "temperature": 0.1
     }
 
+    started = time.perf_counter()
+    status = "error"
     try:
         resp = requests.post(
             "https://api.groq.com/openai/v1/chat/completions",
@@ -180,12 +193,14 @@ OCR TEXT:
             json=payload,
             timeout=30
         )
+        status = str(resp.status_code)
 
         data = resp.json()
+        metrics.record_llm_usage("extract", data.get("usage"))
         result = data["choices"][0]["message"]["content"]
 
         
-        return force_json_fix(result)
+        return force_json_fix(result), result
 
     except Exception as e:
         print("LLM Extraction Error:", e)
@@ -195,4 +210,7 @@ OCR TEXT:
             "invoice_date": None,
             "reference_number": None,
             "items": []
-        }
+        }, None
+
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, caller="extract", status=status)
@@ -2,9 +2,13 @@
 
 import os
 import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import jwt
 from passlib.context import CryptContext
-from typing import Dict
+from typing import Dict, Optional
 from dotenv import load_dotenv
 from backend import db
 
@@ -14,6 +18,10 @@ JWT_SECRET = os.getenv("JWT_SECRET", "change-me-please")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRE_SECONDS = int(os.getenv("JWT_EXPIRE_SECONDS", "3600"))
 
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))     # seconds, backstop only
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))             # bcrypt threads
+
 pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # --- FIX: bcrypt supports only first 72 bytes ---
@@ -37,10 +45,80 @@ def create_access_token(data: Dict, expires_in: int = JWT_EXPIRE_SECONDS) -> str
     return token
 
 def decode_access_token(token: str) -> Dict:
-    try:
-        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-    except Exception:
-        raise
+    """Verified claims; raises jwt.InvalidTokenError (bad signature, expired, malformed)."""
+    return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+
+
+# --- bcrypt off the event loop ---
+# Own small pool so slow hashing (~100s of ms each) never starves the default threadpool
+_hash_executor = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, hash_password, password)
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, verify_password, plain, hashed)
+
+
+# --- principal cache ---
+# user id → (expires_at, auth_version, principal). A principal is the user row
+# without secrets. on_user_change only reaches this process; other API workers
+# (and edits made directly in SQLite) bump users.auth_version instead, which
+# every cache hit compares, so a revoked admin or deleted user is refused on
+# the next request, not after the TTL.
+_principals = OrderedDict()
+_principals_lock = threading.Lock()
+_SECRET_COLUMNS = ("password_hash", "imap_pass")
+
+
+def to_principal(user: Dict) -> Dict:
+    return {k: v for k, v in user.items() if k not in _SECRET_COLUMNS}
+
+
+def cache_principal(user: Dict) -> Dict:
+    principal = to_principal(user)
+    version = principal.pop("auth_version", 0)
+    with _principals_lock:
+        _principals[principal["id"]] = (time.monotonic() + PRINCIPAL_CACHE_TTL, version, principal)
+        _principals.move_to_end(principal["id"])
+        while len(_principals) > PRINCIPAL_CACHE_SIZE:
+            _principals.popitem(last=False)
+    return principal
+
+
+def cached_principal(user_id: int) -> Optional[Dict]:
+    with _principals_lock:
+        entry = _principals.get(user_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _principals[user_id]
+            return None
+        _principals.move_to_end(user_id)
+
+    if db.get_user_auth_version(user_id) != entry[1]:
+        invalidate_principal(user_id)
+        return None
+    return entry[2]
+
+
+def load_principal(user_id: int) -> Optional[Dict]:
+    """Cached principal, or load it from the DB (None if the user does not exist)."""
+    principal = cached_principal(user_id)
+    if principal is not None:
+        return principal
+    user = db.get_user_by_id(user_id)
+    return cache_principal(user) if user else None
+
+
+def invalidate_principal(user_id: int):
+    with _principals_lock:
+        _principals.pop(user_id, None)
+
+
+db.on_user_change(invalidate_principal)
 
 # --- DB wrappers ---
 def register_user(username: str, password: str, email: str = None):
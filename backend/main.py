@@ -1,32 +1,44 @@
 # backend/main.py
 import os
+import json
 import logging
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header
+import jwt
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Local imports
 from backend.ocr_extractor import extract_text_from_image
-from backend.llm_extractor import extract_fields
-from backend.data_validator import validate_invoice_data
 from backend.db import (
     init_db,
-    save_invoice_to_db,
-    get_user_by_id,
+    get_conn,
+    save_invoices_bulk,
+    BULK_BATCH_SIZE,
     get_user_by_username,
     create_user,
 )
-from backend.erp_integration import push_to_erp
-from backend.query_engine import question_to_answer
-from backend import login_auth
+from backend.query_engine import question_to_answer, question_to_answer_stream
+from backend import login_auth, metrics
+from backend.bulk_ingest import iter_jsonl_invoices
 from backend.doc_identify.llm_groq_classifier import classify_document_llm
+from backend import erp_outbox, zoho_auth
+from backend.job_queue import enqueue_job, get_job, get_batch, start_job_dispatcher, stop_job_dispatcher, JOB_DISPATCH
+from backend.batch_upload import enqueue_batch
+from backend.uploads import spool_upload, upload_limit_for
+from backend import profiling
+from backend.document import Document
+from backend.pipeline import process_document, StagedPipeline
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 app = FastAPI(title="Invoice + Multi-User Chatbot")
 
+pipeline = None  # StagedPipeline, started on startup when JOB_DISPATCH is on
+
 
 #  FIX — MOVE ALL INITIALIZATION INTO FASTAPI STARTUP EVENT
 # This code runs ONLY ONCE when the server starts.
@@ -39,9 +51,29 @@ async def startup_event():
     #  FIX — DB initialization moved here
     init_db()
 
+    # Staged pipeline fed by the job queue for /process-invoice/ uploads
+    global pipeline
+    if JOB_DISPATCH:
+        pipeline = StagedPipeline().start()
+        start_job_dispatcher(pipeline.submit)
+
+    # Zoho pushes for committed invoices (outbox rows from any process: API, watchers)
+    if erp_outbox.ERP_OUTBOX_DISPATCH:
+        zoho_auth.start_token_refresher()
+        erp_outbox.start_outbox_dispatcher()
+
     logging.info("✅ One-time setup completed.")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    stop_job_dispatcher()
+    erp_outbox.stop_outbox_dispatcher()
+    zoho_auth.stop_token_refresher()
+    if pipeline:
+        pipeline.shutdown()
+
+
 
 # CORS
 app.add_middleware(
@@ -53,6 +85,16 @@ app.add_middleware(
 )
 
 
+# Reject oversized uploads from Content-Length before the multipart body is parsed
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    limit = upload_limit_for(request.url.path)
+    length = request.headers.get("content-length")
+    if limit and length and length.isdigit() and int(length) > limit:
+        return JSONResponse({"detail": f"Request too large (max {limit} bytes)"}, status_code=413)
+    return await call_next(request)
+
+
 # Pydantic Models
 
 class RegisterPayload(BaseModel):
@@ -71,7 +113,13 @@ class ChatPayload(BaseModel):
 
 # Auth Dependency
 
-def get_current_user(authorization: str = Header(None)):
+async def get_current_user(authorization: str = Header(None)):
+    """
+    The JWT signature is trusted for the token's lifetime: a valid token costs a
+    decode, a principal-cache lookup and one indexed read of users.auth_version.
+    The full row is only loaded on a cache miss (first request, TTL expiry, or
+    after the user row changed in any process).
+    """
     if not authorization:
         raise HTTPException(401, "Missing Authorization header")
 
@@ -80,13 +128,18 @@ def get_current_user(authorization: str = Header(None)):
         raise HTTPException(401, "Invalid Authorization format")
 
     token = parts[1]
-    payload = login_auth.decode_access_token(token)
+    try:
+        payload = login_auth.decode_access_token(token)
+    except jwt.InvalidTokenError:
+        raise HTTPException(401, "Invalid or expired token")
 
     user_id = payload.get("user_id")
     if not user_id:
         raise HTTPException(401, "Invalid token")
 
-    user = get_user_by_id(user_id)
+    user = login_auth.cached_principal(user_id)
+    if user is None:
+        user = await run_in_threadpool(login_auth.load_principal, user_id)
     if not user:
         raise HTTPException(401, "User does not exist")
 
@@ -94,59 +147,177 @@ def get_current_user(authorization: str = Header(None)):
 
 
 
-# Invoice Processing Pipeline
+# POST — Invoice Upload
+# Only spools the file and queues a job; poll /jobs/{job_id} for progress and the result.
+@app.post("/process-invoice/")
+async def process_invoice_api(
+    request: Request,
+    file: UploadFile = File(...),
+    current_user=Depends(get_current_user)
+):
+    if profiling.profiling_requested(request):
+        profiling.require_admin(current_user)
+        return await _process_invoice_profiled(file, current_user["id"])
+
+    # Streamed from the multipart spool into the job spool in chunks, size-limited
+    job_id = await run_in_threadpool(enqueue_job, current_user["id"], file.filename, file.file)
+    return {"status": "queued", "job_id": job_id, "status_url": f"/jobs/{job_id}"}
+
 
-def process_invoice(invoice_bytes: bytes, user_id: int):
+async def _process_invoice_profiled(file: UploadFile, user_id: int):
+    # Inline (not queued) so the whole pipeline, OCR included, runs in the profiled thread
+    document = Document.from_upload(await spool_upload(file), user_id, "api")
+    timer = profiling.StageTimer()
     try:
-        raw_text = extract_text_from_image(invoice_bytes)
-        logging.info("1 OCR completed")
+        result, profile_id, _, wall = await run_in_threadpool(
+            profiling.run_profiled, process_document, document, on_stage=timer
+        )
+    finally:
+        document.close()
+
+    return {
+        **(result or {}),
+        "profile": {
+            "profile_id": profile_id,
+            "profile_url": f"/profiles/{profile_id}",
+            "wall_seconds": round(wall, 6),
+            "stages": timer.stop(),
+        },
+    }
 
-        check_doc_type = classify_document_llm(raw_text)
-        logging.info(f"Document Type: {check_doc_type}")
-        
-        if check_doc_type != "invoice": 
-            logging.error("doc type")
-            return {"status": "failed", "error": f"Uploaded document is not an invoice your doc type is {check_doc_type}"}
 
-        #  Field Extraction using LLM
-        
-        extracted = extract_fields(raw_text)
-        logging.info("2 Field extraction done")
+# POST — Batch upload: many files and/or ZIP archives → one job per document
+@app.post("/process-invoice/batch")
+async def process_invoice_batch_api(
+    files: list[UploadFile] = File(...),
+    current_user=Depends(get_current_user)
+):
+    batch = await run_in_threadpool(
+        enqueue_batch, current_user["id"], [(f.filename, f.file) for f in files]
+    )
+    if not batch["queued"]:
+        raise HTTPException(400, {"error": "No supported documents in upload", "skipped": batch["skipped"]})
+    return {"status": "queued", **batch, "status_url": f"/batches/{batch['batch_id']}"}
+
+
+# GET — Batch status with aggregated per-file results
+@app.get("/batches/{batch_id}")
+def batch_status(batch_id: str, current_user=Depends(get_current_user)):
+    batch = get_batch(batch_id)
+    if not batch or batch["user_id"] != current_user["id"]:
+        raise HTTPException(404, "Batch not found")
+    return batch
+
+
+# GET — Job status / result
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str, current_user=Depends(get_current_user)):
+    job = get_job(job_id)
+    if not job or job["user_id"] != current_user["id"]:
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+# GET — ERP (Zoho) sync state of one invoice: pending / in_flight / synced / dead
+@app.get("/invoices/{invoice_id}/sync-status")
+def invoice_sync_status(invoice_id: int, current_user=Depends(get_current_user)):
+    status = erp_outbox.get_sync_status(invoice_id)
+    if not status or status["user_id"] != current_user["id"]:
+        raise HTTPException(404, "No ERP sync for this invoice")
+    return status
+
+
+# GET — ERP sync throughput, backlog and Zoho rate-limit headroom (admins only: covers every user)
+@app.get("/erp/stats")
+def erp_stats(current_user=Depends(get_current_user)):
+    profiling.require_admin(current_user, "ERP stats")
+    return erp_outbox.sync_stats()
+
+
+# POST — Retry a dead ERP sync now
+@app.post("/invoices/{invoice_id}/sync-retry")
+def invoice_sync_retry(invoice_id: int, current_user=Depends(get_current_user)):
+    status = erp_outbox.get_sync_status(invoice_id)
+    if not status or status["user_id"] != current_user["id"]:
+        raise HTTPException(404, "No ERP sync for this invoice")
+    if not erp_outbox.requeue(invoice_id):
+        raise HTTPException(409, f"ERP sync is {status['status']}, nothing to retry")
+    return erp_outbox.get_sync_status(invoice_id)
+
+# POST — Bulk ingest of pre-extracted invoices (JSON lines body, one invoice per line)
+# Backfill only: invoices are validated and stored, not pushed to ERP.
+@app.post("/invoices/bulk")
+async def bulk_ingest_api(request: Request, current_user=Depends(get_current_user)):
+    user_id = current_user["id"]
+    invoice_ids, rejected, batch = [], [], []
+
+    async def lines():
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *complete, buffer = buffer.split(b"\n")
+            for line in complete:
+                yield line.decode("utf-8")
+        if buffer:
+            yield buffer.decode("utf-8")
+
+    line_no = 0
+    async for line in lines():
+        line_no += 1
+        for _, invoice, error in iter_jsonl_invoices([line]):
+            if error:
+                rejected.append({"line": line_no, "error": error})
+                continue
+            batch.append(invoice)
+
+        if len(batch) >= BULK_BATCH_SIZE:
+            invoice_ids += await run_in_threadpool(save_invoices_bulk, batch, user_id)
+            batch = []
+
+    if batch:
+        invoice_ids += await run_in_threadpool(save_invoices_bulk, batch, user_id)
 
-        validated = validate_invoice_data(extracted)
-        if not validated:
-            logging.error("Validation failed")
-            return {"status": "failed", "error": "Invalid invoice data"}
+    return {
+        "status": "success" if invoice_ids else "failed",
+        "inserted": len(invoice_ids),
+        "invoice_ids": invoice_ids,
+        "rejected": rejected,
+    }
 
-        validated["user_id"] = user_id
+# GET — Pipeline per-stage utilization and queue depth
+@app.get("/pipeline/stats")
+def pipeline_stats(current_user=Depends(get_current_user)):
+    if not pipeline:
+        return {"status": "disabled"}
+    return {"status": "ok", "stages": pipeline.stats()}
 
-        invoice_id = save_invoice_to_db(validated, user_id)
-        logging.info(f"4 Invoice saved ID={invoice_id}")
 
-        push_to_erp(validated)
+# Stored profiles (admins only): pstats file, or ?format=text for a summary
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "pstats", sort: str = "cumulative", current_user=Depends(get_current_user)):
+    profiling.require_admin(current_user)
+    if format == "text":
+        return PlainTextResponse(profiling.summary(profile_id, sort))
 
-        return {
-            "status": "success",
-            "invoice_id": invoice_id,
-            "saved_to_db": True,
-            "push_to_erp": True,
-            "data": validated,
-        }
+    path = profiling.profile_path(profile_id)
+    if not os.path.exists(path):
+        raise HTTPException(404, "Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.pstats")
 
-    except Exception as e:
-        logging.error(str(e))
-        raise
 
+# Liveness probe for the workflow supervisor and load balancers (no auth)
+@app.get("/health")
+def health():
+    get_conn().execute("SELECT 1")
+    return {"status": "ok"}
 
 
-# POST — Invoice Upload
-@app.post("/process-invoice/")
-async def process_invoice_api(
-    file: UploadFile = File(...),
-    current_user=Depends(get_current_user)
-):
-    content = await file.read()
-    return process_invoice(content, current_user["id"])
+# Prometheus scrape target (stage / LLM / SQL / Zoho latencies, token counts)
+@app.get("/metrics")
+def metrics_endpoint():
+    if pipeline:
+        pipeline.export_metrics()
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 #document type classification
 @app.post("/classify-document/")
@@ -154,34 +325,39 @@ async def classify_document_api(
     file: UploadFile = File(...),
     
 ):
-    content = await file.read()
-    raw_text = extract_text_from_image(content)
-    doc_type = classify_document_llm(raw_text)
+    upload = await spool_upload(file)
+    try:
+        raw_text = await run_in_threadpool(extract_text_from_image, upload.view(), None, upload.path)
+    finally:
+        upload.close()
+    doc_type = await run_in_threadpool(classify_document_llm, raw_text)
     return {"status": "success", "document_type": doc_type}
 
 
 # Authentication APIs
 
 @app.post("/auth/register")
-def register(payload: RegisterPayload):
-    if get_user_by_username(payload.username):
+async def register(payload: RegisterPayload):
+    if await run_in_threadpool(get_user_by_username, payload.username):
         raise HTTPException(400, "Username already exists")
 
-    pwd_hash = login_auth.hash_password(payload.password)
-    user_id = create_user(payload.username, pwd_hash, payload.email)
+    pwd_hash = await login_auth.hash_password_async(payload.password)
+    user_id = await run_in_threadpool(create_user, payload.username, pwd_hash, payload.email)
 
     return {"status": "ok", "user_id": user_id}
 
 
 @app.post("/auth/login")
-def login(payload: LoginPayload):
-    user = get_user_by_username(payload.username)
+async def login(payload: LoginPayload):
+    user = await run_in_threadpool(get_user_by_username, payload.username)
     if not user:
         raise HTTPException(401, "Invalid username")
 
-    if not login_auth.verify_password(payload.password, user["password_hash"]):
+    if not await login_auth.verify_password_async(payload.password, user["password_hash"]):
         raise HTTPException(401, "Invalid password")
 
+    # Warm the principal cache so the first authenticated request skips the DB
+    login_auth.cache_principal(user)
     token = login_auth.create_access_token({
         "user_id": user["id"],
         "username": user["username"]
@@ -191,26 +367,73 @@ def login(payload: LoginPayload):
 
 # Chatbot API
 
+# query_engine functions reported as stages of a profiled chatbot request
+CHAT_STAGES = (
+    "search_invoices", "generate_user_sql", "execute_for_user",
+    "interpret_answer", "fallback_reasoning_llm",
+)
+
 #  FIX: accept both /chatbot/query and /chatbot/query/ so frontend trailing slash won't 307 redirect
 @app.post("/chatbot/query")
 @app.post("/chatbot/query/")
-def chatbot_query(payload: ChatPayload, current_user=Depends(get_current_user)):
+def chatbot_query(payload: ChatPayload, request: Request, current_user=Depends(get_current_user)):
+    profile = None
     try:
         # FIX: Chatbot must only call the query engine. No invoice processing here.
-        result = question_to_answer(payload.question, current_user["id"])
+        if profiling.profiling_requested(request):
+            profiling.require_admin(current_user)
+            result, profile_id, stats, wall = profiling.run_profiled(
+                question_to_answer, payload.question, current_user["id"]
+            )
+            profile = {
+                "profile_id": profile_id,
+                "profile_url": f"/profiles/{profile_id}",
+                "wall_seconds": round(wall, 6),
+                "stages": profiling.function_times(stats, CHAT_STAGES),
+            }
+        else:
+            result = question_to_answer(payload.question, current_user["id"])
 
         if not result.get("ok"):
             # result may contain error info from query engine
             raise Exception(result.get("error") or "Unknown error from query engine")
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(" CHATBOT ERROR:", str(e))
         raise HTTPException(500, f"Chatbot crashed: {str(e)}")
 
     # FIX: return compact response (avoid sending large ERP payloads back to UI)
-    return {
+    response = {
         "status": "ok",
         "answer": result["answer"],
         "sql": result.get("sql"),
         "data": result.get("result")
     }
+    if profile:
+        response["profile"] = profile
+    return response
+
+
+# Chatbot API (streaming, Server-Sent Events)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@app.post("/chatbot/query/stream")
+@app.post("/chatbot/query/stream/")
+def chatbot_query_stream(payload: ChatPayload, current_user=Depends(get_current_user)):
+    # Progress events (sql, rows) first, then the answer token by token.
+    def event_stream():
+        for event, data in question_to_answer_stream(payload.question, current_user["id"]):
+            if event == "error":
+                print(" CHATBOT ERROR:", data.get("error"))
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
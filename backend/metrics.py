@@ -0,0 +1,197 @@
+# backend/metrics.py
+"""
+In-process metrics in the Prometheus text format (served on /metrics).
+
+Hand-rolled instead of pulling in prometheus_client: three metric types, one
+lock each, and an observe() is a bisect plus two additions, so the hot path
+cost stays around a microsecond.
+
+    with metrics.PIPELINE_STAGE_SECONDS.time(stage="ocr"):
+        ...
+    metrics.LLM_TOKENS.inc(usage["prompt_tokens"], caller="extract", kind="prompt")
+
+Values are per process; with several API workers each one exports its own.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Tuple
+
+# Seconds; spans SQL lookups (ms) up to slow OCR / LLM calls (tens of seconds)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self._header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    render = Counter.render
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts (+Inf last), sum]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1]) for key, state in self._values.items()]
+
+        lines = self._header()
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------------- PIPELINE ----------------
+PIPELINE_STAGE_SECONDS = Histogram(
+    "invoice_pipeline_stage_seconds", "Time spent in each pipeline stage (ocr, llm, store)", ["stage"]
+)
+PIPELINE_STEP_SECONDS = Histogram(
+    "invoice_pipeline_step_seconds", "Time spent in each pipeline step (ocr, classify, extract, validate, save)", ["step"]
+)
+PIPELINE_DOCUMENTS = Counter(
+    "invoice_pipeline_documents_total", "Documents that left the pipeline, by outcome and channel", ["outcome", "channel"]
+)
+PIPELINE_QUEUE_DEPTH = Gauge(
+    "invoice_pipeline_queue_depth", "Documents waiting in front of each pipeline stage", ["stage"]
+)
+PIPELINE_ACTIVE = Gauge(
+    "invoice_pipeline_active", "Documents currently being worked on in each pipeline stage", ["stage"]
+)
+
+# ---------------- LLM (GROQ) ----------------
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_seconds", "Groq chat completion latency", ["caller", "status"]
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total", "Tokens reported in the Groq usage field", ["caller", "kind"]
+)
+
+
+def record_llm_usage(caller: str, usage):
+    """usage: the `usage` object of a Groq/OpenAI response (may be None)."""
+    if not usage:
+        return
+    for kind in ("prompt", "completion"):
+        tokens = usage.get(f"{kind}_tokens")
+        if tokens:
+            LLM_TOKENS.inc(tokens, caller=caller, kind=kind)
+
+
+# ---------------- SQL (QUERY ENGINE) ----------------
+SQL_QUERY_SECONDS = Histogram(
+    "sql_query_seconds", "Query engine SQL execution time", ["query", "status"]
+)
+SQL_ROWS = Counter(
+    "sql_rows_total", "Rows returned by query engine SQL", ["query"]
+)
+
+# ---------------- ZOHO ----------------
+ZOHO_REQUEST_SECONDS = Histogram(
+    "zoho_request_seconds", "Zoho API call latency", ["endpoint", "status"]
+)
+ERP_PUSHES = Counter(
+    "erp_outbox_pushes_total", "ERP outbox push attempts, by outcome (synced, retry, dead)", ["outcome"]
+)
+ZOHO_RATE_WAIT_SECONDS = Histogram(
+    "zoho_rate_wait_seconds", "Time Zoho calls waited for the rate governor"
+)
+ZOHO_THROTTLED = Counter(
+    "zoho_throttled_total", "Zoho calls refused: by the governor (no capacity) or by Zoho (429)", ["source"]
+)
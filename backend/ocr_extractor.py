@@ -1,6 +1,6 @@
 import os
 import pytesseract
-from pdf2image import convert_from_bytes
+from pdf2image import convert_from_bytes, convert_from_path
 from fastapi import HTTPException
 from PIL import Image, ImageEnhance, ImageFilter, UnidentifiedImageError
 import io, cv2, numpy as np
@@ -17,10 +17,14 @@ def preprocess_image(image_bytes: bytes) -> Image.Image:
     """
     Enhance image using OpenCV (if available) for better OCR accuracy.
     Falls back to Pillow if OpenCV fails.
+    Accepts bytes or any buffer (memoryview, mmap) without copying it.
     """ 
     try:
         nparr = np.frombuffer(image_bytes, np.uint8)
         img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        # imdecode copies; drop the view now so no exception frame keeps the
+        # caller's mmap exported (it could not be closed then)
+        del nparr
         if img is None:
             raise ValueError("Empty image input for OpenCV")
 
@@ -32,30 +36,76 @@ def preprocess_image(image_bytes: bytes) -> Image.Image:
 
     except Exception as e:
         print("OpenCV preprocessing failed, using Pillow:", e)
-        image = Image.open(io.BytesIO(image_bytes)).convert("L")
+        image = Image.open(io.BytesIO(bytes(image_bytes))).convert("L")
         enhancer = ImageEnhance.Contrast(image)
         image = enhancer.enhance(2.0)
         return image.filter(ImageFilter.SHARPEN)
 
 
-def extract_text_from_image(file_bytes: bytes) -> str:
+def ocr_image(image: Image.Image, word_boxes: list = None, page: int = 1) -> str:
+    """
+    OCR one preprocessed page. When word_boxes is a list, a single
+    image_to_data pass produces both the text and the word boxes
+    (appended as dicts), so asking for boxes costs no extra OCR run.
+    """
+    if word_boxes is None:
+        return pytesseract.image_to_string(image)
+
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    lines, words, line_key = [], [], None
+    for i, word in enumerate(data["text"]):
+        if not word or not word.strip():
+            continue
+
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        if key != line_key and words:
+            lines.append(" ".join(words))
+            words = []
+        line_key = key
+        words.append(word)
+
+        word_boxes.append({
+            "page": page,
+            "text": word,
+            "left": data["left"][i],
+            "top": data["top"][i],
+            "width": data["width"][i],
+            "height": data["height"][i],
+            "conf": float(data["conf"][i]),
+        })
+
+    if words:
+        lines.append(" ".join(words))
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def extract_text_from_image(file_bytes: bytes, word_boxes: list = None, path: str = None) -> str:
     """
     Extract text from uploaded invoice (PDF or image)
     with preprocessing for best OCR accuracy.
     Works for: PDF, PNG, JPG, JPEG.
+    Pass a list as word_boxes to also collect per-word boxes.
+    file_bytes may be a memoryview / mmap; when the content is also on disk,
+    pass its path so poppler reads the file directly instead of a copy.
     """
     text = ""
     print(f" Uploaded file size: {len(file_bytes)} bytes")
 
     # ---------- Try PDF First ----------
     try:
-        images = convert_from_bytes(file_bytes, poppler_path=POPPLER_PATH)
+        header = bytes(memoryview(file_bytes)[:1024])
+        if b"%PDF-" not in header:
+            raise ValueError("not a PDF (no %PDF- header)")
+        if path:
+            images = convert_from_path(path, poppler_path=POPPLER_PATH)
+        else:
+            images = convert_from_bytes(bytes(file_bytes), poppler_path=POPPLER_PATH)
         print(f"PDF converted to {len(images)} image(s).")
-        for img in images:
+        for page, img in enumerate(images, start=1):
             img_bytes = io.BytesIO()
             img.save(img_bytes, format="PNG")
             processed = preprocess_image(img_bytes.getvalue())
-            text += pytesseract.image_to_string(processed)
+            text += ocr_image(processed, word_boxes, page)
         if text.strip():
             print(" Extracted text using OCR on PDF")
             return text
@@ -65,7 +115,7 @@ def extract_text_from_image(file_bytes: bytes) -> str:
     # ---------- Try Image Next ----------
     try:
         processed = preprocess_image(file_bytes)
-        text += pytesseract.image_to_string(processed)
+        text += ocr_image(processed, word_boxes)
         if text.strip():
             print(" Extracted text using OCR on image")
             return text
@@ -0,0 +1,431 @@
+# backend/pipeline.py
+"""
+Invoice processing pipeline.
+
+The pipeline is split into stages that share one context dict per document:
+
+    ocr    (CPU)      dedupe by content hash, PDF/image → text + word boxes
+    llm    (network)  document classification + field extraction
+    store  (DB)       validation, invoice-key dedupe, save (+ ERP outbox row), artifacts
+
+The Zoho push is not a stage: it happens after the commit, from the ERP
+outbox (backend/erp_outbox.py), so Zoho latency never reaches the upload.
+
+A stage ends a document early by setting ctx["result"].
+
+Every channel hands in a backend.document.Document (content + channel, user,
+filename), so uploads, jobs and both watchers run exactly the same stages.
+process_document() runs them back to back in the calling thread (used by
+the watchers). StagedPipeline runs them concurrently: each stage has its own
+worker count and a bounded queue in front of it, and the OCR stage runs on a
+process pool, so while document N waits on Groq, document N+1 is being OCRed.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from backend.ocr_extractor import extract_text_from_image
+from backend.llm_extractor import extract_fields_raw
+from backend.data_validator import validate_invoice_data
+from backend.db import (
+    save_invoice_to_db,
+    find_fingerprint_by_hash,
+    find_fingerprint_by_key,
+    add_fingerprint_alias,
+)
+from backend import erp_outbox
+from backend.doc_identify.llm_groq_classifier import classify_document_llm
+from backend.fingerprint import invoice_key
+from backend import artifact_store, heartbeat, metrics
+from backend.document import Document
+from backend.uploads import close_view, open_view
+
+load_dotenv()
+
+PIPELINE_OCR_WORKERS = int(os.getenv("PIPELINE_OCR_WORKERS", str(os.cpu_count() or 2)))
+PIPELINE_LLM_WORKERS = int(os.getenv("PIPELINE_LLM_WORKERS", "8"))
+PIPELINE_STORE_WORKERS = int(os.getenv("PIPELINE_STORE_WORKERS", "1"))   # SQLite has a single writer anyway
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+
+
+def _success_result(invoice_id: int, data: dict, duplicate: bool = False, erp_sync: bool = True):
+    result = {
+        "status": "success",
+        "invoice_id": invoice_id,
+        "saved_to_db": True,
+        "erp_sync": "queued",       # pushed from the outbox; see erp_sync_url
+        "erp_sync_url": f"/invoices/{invoice_id}/sync-status",
+        "data": data,
+    }
+    if not erp_sync:
+        result["erp_sync"] = "off"
+        del result["erp_sync_url"]
+    if duplicate:
+        result["duplicate"] = True
+    return result
+
+
+def new_context(document: Document, on_stage: Optional[Callable] = None, erp_sync: bool = True) -> Dict:
+    """
+    Per-document state. content is the Document's zero-copy buffer; path, when
+    the content is a file on disk, lets OCR workers open the file themselves
+    instead of receiving a pickled copy.
+    on_stage(name) is called as each step starts (ocr, classify, extract,
+    validate, save) for progress reporting.
+    erp_sync=False saves without an ERP outbox row (backfills).
+    """
+    return {
+        "document": document,
+        "content": document.content,
+        "path": document.path,
+        "user_id": document.user_id,
+        "on_stage": on_stage,
+        "erp_sync": erp_sync,
+    }
+
+
+def _progress(ctx: Dict, name: str):
+    _end_step(ctx)
+    ctx["step"] = (name, time.perf_counter())
+    if ctx.get("on_stage"):
+        ctx["on_stage"](name)
+
+
+def _end_step(ctx: Dict):
+    step = ctx.pop("step", None)
+    if step:
+        metrics.PIPELINE_STEP_SECONDS.observe(time.perf_counter() - step[1], step=step[0])
+
+
+def _run_stage(ctx: Dict, name: str, fn: Callable, *args):
+    with metrics.PIPELINE_STAGE_SECONDS.time(stage=name):
+        fn(ctx, *args)
+
+
+def _finish(ctx: Dict, error: Optional[Exception] = None):
+    """Close the last step timer and count the document's outcome."""
+    _end_step(ctx)
+    if error is not None:
+        outcome = "error"
+    else:
+        result = ctx.get("result") or {}
+        outcome = "duplicate" if result.get("duplicate") else result.get("status", "unknown")
+    metrics.PIPELINE_DOCUMENTS.inc(outcome=outcome, channel=ctx["document"].channel)
+
+
+# ---------------- STAGES ----------------
+class UnreadableDocument(ValueError):
+    """
+    OCR rejected the input (not a PDF/image, no text). Raised instead of the
+    extractor's HTTPException, which cannot be unpickled: coming back from a
+    worker process it would break the whole process pool.
+    """
+
+
+def ocr_document(content, path: Optional[str] = None):
+    """
+    Module-level so it can run in a worker process. Returns (text, word_boxes).
+    With content=None the file at path is memory-mapped here.
+    """
+    word_boxes = []
+    view = open_view(path) if content is None else None
+    error = None
+    try:
+        text = extract_text_from_image(content if view is None else view, word_boxes=word_boxes, path=path)
+    except HTTPException as e:
+        # Keep only the message: the traceback's frames may still hold buffers into the mmap
+        error = e.detail
+    finally:
+        if view is not None:
+            close_view(view)
+
+    if error is not None:
+        raise UnreadableDocument(error)
+    return text, word_boxes
+
+
+def stage_ocr(ctx: Dict, executor=None):
+    #  Same file already processed → return the prior result, skip OCR/LLM/ERP
+    ctx["content_hash"] = ctx["document"].content_hash
+    prior = find_fingerprint_by_hash(ctx["user_id"], ctx["content_hash"])
+    if prior:
+        logging.info(f"Duplicate upload of invoice ID={prior['invoice_id']}, skipping pipeline")
+        ctx["result"] = _success_result(prior["invoice_id"], prior["data"], duplicate=True)
+        return
+
+    _progress(ctx, "ocr")
+    try:
+        if executor and ctx["path"]:
+            # Only the path crosses the process boundary; the worker mmaps the file
+            ctx["raw_text"], ctx["word_boxes"] = executor.submit(ocr_document, None, ctx["path"]).result()
+        elif executor:
+            ctx["raw_text"], ctx["word_boxes"] = executor.submit(ocr_document, bytes(ctx["content"])).result()
+        else:
+            ctx["raw_text"], ctx["word_boxes"] = ocr_document(ctx["content"], ctx["path"])
+    except UnreadableDocument as e:
+        raise HTTPException(status_code=400, detail=str(e)) from None
+    logging.info("1 OCR completed")
+
+
+def stage_llm(ctx: Dict):
+    _progress(ctx, "classify")
+    check_doc_type = classify_document_llm(ctx["raw_text"])
+    logging.info(f"Document Type: {check_doc_type}")
+
+    if check_doc_type != "invoice":
+        logging.error("doc type")
+        ctx["result"] = {"status": "failed", "error": f"Uploaded document is not an invoice your doc type is {check_doc_type}"}
+        return
+
+    #  Field Extraction using LLM
+    _progress(ctx, "extract")
+    extracted, llm_response = extract_fields_raw(ctx["raw_text"])
+    logging.info("2 Field extraction done")
+
+    # Keep what we paid for, so extractor/validator fixes can be replayed without OCR
+    ctx["extracted"] = extracted
+    ctx["artifacts"] = {
+        artifact_store.OCR_TEXT: ctx["raw_text"],
+        artifact_store.OCR_WORDS: ctx["word_boxes"],
+        artifact_store.CLASSIFICATION: check_doc_type,
+        artifact_store.LLM_RESPONSE: llm_response,
+        artifact_store.EXTRACTED: json.dumps(extracted, default=str),
+    }
+
+
+def stage_store(ctx: Dict):
+    user_id, content_hash = ctx["user_id"], ctx["content_hash"]
+
+    _progress(ctx, "validate")
+    validated = validate_invoice_data(ctx["extracted"])
+    if not validated:
+        logging.error("Validation failed")
+        ctx["result"] = {"status": "failed", "error": "Invalid invoice data"}
+        return
+
+    validated["user_id"] = user_id
+
+    #  Same invoice from a different file (e.g. folder + email) → no second save / ERP push
+    key = invoice_key(validated)
+    prior = find_fingerprint_by_key(user_id, key)
+    if prior:
+        logging.info(f"Invoice already stored as ID={prior['invoice_id']}, skipping save and ERP push")
+        add_fingerprint_alias(user_id, content_hash, prior["invoice_id"], prior["data"])
+        ctx["result"] = _success_result(prior["invoice_id"], prior["data"], duplicate=True)
+        return
+
+    _progress(ctx, "save")
+    try:
+        invoice_id = save_invoice_to_db(
+            validated, user_id, content_hash=content_hash, invoice_key=key, erp_sync=ctx["erp_sync"]
+        )
+    except sqlite3.IntegrityError:
+        # Lost a race with a concurrent copy of the same document
+        prior = find_fingerprint_by_hash(user_id, content_hash) or find_fingerprint_by_key(user_id, key)
+        if not prior:
+            raise
+        ctx["result"] = _success_result(prior["invoice_id"], prior["data"], duplicate=True)
+        return
+    logging.info(f"4 Invoice saved ID={invoice_id}")
+
+    try:
+        artifact_store.save_artifacts(invoice_id, ctx["artifacts"])
+    except Exception:
+        logging.exception(f"Failed to store artifacts for invoice ID={invoice_id}")
+
+    if ctx["erp_sync"]:
+        erp_outbox.notify()
+    ctx["result"] = _success_result(invoice_id, validated, erp_sync=ctx["erp_sync"])
+
+
+# (name, function, default workers, runs on a process pool)
+STAGES = [
+    ("ocr", stage_ocr, PIPELINE_OCR_WORKERS, True),
+    ("llm", stage_llm, PIPELINE_LLM_WORKERS, False),
+    ("store", stage_store, PIPELINE_STORE_WORKERS, False),
+]
+
+
+# ---------------- INLINE (ONE DOCUMENT) ----------------
+def process_document(document: Document, on_stage=None, erp_sync: bool = True):
+    """Full pipeline for one document in the calling thread."""
+    ctx = new_context(document, on_stage, erp_sync)
+    try:
+        for name, fn, _, _ in STAGES:
+            _run_stage(ctx, name, fn)
+            if "result" in ctx:
+                _finish(ctx)
+                return ctx["result"]
+
+    except Exception as e:
+        logging.error(f"{document}: {e}")
+        _finish(ctx, e)
+        raise
+
+
+def process_invoice(invoice_bytes: bytes, user_id: int, on_stage=None):
+    """Shortcut for scripts and the shell: in-memory content, channel "cli"."""
+    return process_document(Document.from_bytes(invoice_bytes, user_id, "cli"), on_stage)
+
+
+# ---------------- STAGED EXECUTOR ----------------
+_STOP = object()
+
+
+class StagedPipeline:
+    """
+    Runs STAGES concurrently with a bounded queue in front of each stage.
+    submit() blocks when the first queue is full, which is the backpressure
+    signal for whoever feeds documents in.
+    """
+
+    def __init__(self, workers: Optional[Dict[str, int]] = None, queue_size: int = PIPELINE_QUEUE_SIZE):
+        workers = workers or {}
+        self.stages = [
+            {
+                "name": name,
+                "fn": fn,
+                "workers": workers.get(name, default_workers),
+                "processes": processes,
+                "queue": queue.Queue(maxsize=queue_size),
+                "busy": 0.0,
+                "processed": 0,
+                "failed": 0,
+                "active": 0,
+            }
+            for name, fn, default_workers, processes in STAGES
+        ]
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started_at = None
+
+    def start(self):
+        self._started_at = time.perf_counter()
+        for index, stage in enumerate(self.stages):
+            stage["executor"] = None
+            if stage["processes"]:
+                stage["executor"] = ProcessPoolExecutor(max_workers=stage["workers"])
+
+            for i in range(stage["workers"]):
+                t = threading.Thread(
+                    target=self._worker, args=(index,),
+                    name=f"pipeline-{stage['name']}-{i}", daemon=True
+                )
+                t.start()
+                self._threads.append(t)
+
+        logging.info("Pipeline started: " + ", ".join(f"{s['name']}={s['workers']}" for s in self.stages))
+        return self
+
+    def submit(self, document: Document, on_stage: Optional[Callable] = None,
+               timeout: Optional[float] = None) -> Future:
+        """Queue a document; raises queue.Full if no slot freed up within timeout seconds."""
+        ctx = new_context(document, on_stage)
+        ctx["future"] = Future()
+        self.stages[0]["queue"].put(ctx, timeout=timeout)
+        return ctx["future"]
+
+    def run_batch(self, documents: List[Document]) -> List:
+        """Results in the same order as documents (exceptions returned, not raised)."""
+        futures = [self.submit(document) for document in documents]
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _replace_executor(self, stage: Dict, broken: ProcessPoolExecutor):
+        """Swap in a fresh pool once a worker process died (first thread to notice wins)."""
+        with self._lock:
+            if stage["executor"] is not broken:
+                return
+            stage["executor"] = ProcessPoolExecutor(max_workers=stage["workers"])
+        broken.shutdown(wait=False, cancel_futures=True)
+        logging.error(f"Pipeline stage {stage['name']}: process pool broke, started a new one")
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        while True:
+            ctx = stage["queue"].get()
+            if ctx is _STOP:
+                return
+
+            with self._lock:
+                stage["active"] += 1
+            started = time.perf_counter()
+            executor = stage["executor"]
+            try:
+                with heartbeat.working(f"pipeline-{stage['name']}"):
+                    if executor:
+                        _run_stage(ctx, stage["name"], stage["fn"], executor)
+                    else:
+                        _run_stage(ctx, stage["name"], stage["fn"])
+                error = None
+            except Exception as e:
+                logging.error(f"Pipeline stage {stage['name']} failed for {ctx['document']}: {e}")
+                error = e
+                if isinstance(e, BrokenProcessPool):
+                    self._replace_executor(stage, executor)
+
+            with self._lock:
+                stage["active"] -= 1
+                stage["busy"] += time.perf_counter() - started
+                stage["processed"] += 1
+                stage["failed"] += error is not None
+
+            if error is not None:
+                _finish(ctx, error)
+                ctx["future"].set_exception(error)
+            elif "result" in ctx or index == len(self.stages) - 1:
+                _finish(ctx)
+                ctx["future"].set_result(ctx.get("result"))
+            else:
+                self.stages[index + 1]["queue"].put(ctx)
+
+    def stats(self) -> Dict:
+        """Per-stage utilization (busy time / worker capacity since start) and queue depth."""
+        elapsed = time.perf_counter() - self._started_at if self._started_at else 0.0
+        with self._lock:
+            return {
+                stage["name"]: {
+                    "workers": stage["workers"],
+                    "active": stage["active"],
+                    "queue_depth": stage["queue"].qsize(),
+                    "processed": stage["processed"],
+                    "failed": stage["failed"],
+                    "busy_seconds": round(stage["busy"], 3),
+                    "utilization": round(stage["busy"] / (elapsed * stage["workers"]), 4) if elapsed else 0.0,
+                }
+                for stage in self.stages
+            }
+
+    def export_metrics(self):
+        """Copy queue depth / active counts into the metrics gauges (called on scrape)."""
+        with self._lock:
+            for stage in self.stages:
+                metrics.PIPELINE_QUEUE_DEPTH.set(stage["queue"].qsize(), stage=stage["name"])
+                metrics.PIPELINE_ACTIVE.set(stage["active"], stage=stage["name"])
+
+    def shutdown(self):
+        for stage in self.stages:
+            for _ in range(stage["workers"]):
+                stage["queue"].put(_STOP)
+        for t in self._threads:
+            t.join(5)
+        for stage in self.stages:
+            if stage.get("executor"):
+                stage["executor"].shutdown(wait=False, cancel_futures=True)
+                stage["executor"] = None
+        self._threads.clear()
@@ -0,0 +1,103 @@
+# backend/profiling.py
+"""
+Opt-in per-request profiling for admins.
+
+A request with `X-Profile: 1` (or `?profile=1`) runs its work under cProfile;
+the pstats file is kept in PROFILE_DIR under a request id and served by
+GET /profiles/{id}. Responses carry the id and per-stage wall times:
+
+    curl -H "X-Profile: 1" -F file=@slow.pdf .../process-invoice/
+    python -m pstats DB/profiles/<profile_id>.pstats
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+
+load_dotenv()
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "DB/profiles")
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "40"))   # rows in the text summary
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def profiling_requested(request: Request) -> bool:
+    flag = request.headers.get("x-profile") or request.query_params.get("profile") or ""
+    return flag.lower() in ("1", "true", "yes")
+
+
+def require_admin(user: Dict, what: str = "Profiling"):
+    if not user.get("is_admin"):
+        raise HTTPException(403, f"{what} is restricted to admin users")
+
+
+class StageTimer:
+    """on_stage callback for the pipeline: wall time from each stage start to the next."""
+
+    def __init__(self):
+        self._current = None
+        self.timings = {}
+
+    def __call__(self, stage: str):
+        self.stop()
+        self._current = (stage, time.perf_counter())
+
+    def stop(self) -> Dict[str, float]:
+        if self._current:
+            stage, started = self._current
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + time.perf_counter() - started, 6)
+            self._current = None
+        return self.timings
+
+
+def profile_path(profile_id: str) -> str:
+    if not _PROFILE_ID.match(profile_id):
+        raise HTTPException(404, "Profile not found")
+    return os.path.join(PROFILE_DIR, f"{profile_id}.pstats")
+
+
+def run_profiled(fn: Callable, *args, **kwargs) -> Tuple[object, str, pstats.Stats, float]:
+    """
+    Run fn under cProfile in the calling thread and store the stats.
+    Returns (result, profile_id, stats, wall_seconds). Stats are stored even if fn raises.
+    """
+    profile_id = uuid.uuid4().hex
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        wall = time.perf_counter() - started
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(profile_path(profile_id))
+    return result, profile_id, pstats.Stats(profiler), wall
+
+
+def function_times(stats: pstats.Stats, names: Iterable[str]) -> Dict[str, float]:
+    """Cumulative seconds spent in (and under) each named function, summed over call sites."""
+    wanted = set(names)
+    times = {}
+    for (_, _, name), (_, _, _, cumulative, _) in stats.stats.items():
+        if name in wanted:
+            times[name] = round(times.get(name, 0.0) + cumulative, 6)
+    return times
+
+
+def summary(profile_id: str, sort: str = "cumulative", limit: Optional[int] = None) -> str:
+    """Text report of a stored profile (pstats print_stats output)."""
+    path = profile_path(profile_id)
+    if not os.path.exists(path):
+        raise HTTPException(404, "Profile not found")
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        raise HTTPException(400, f"Unknown sort key: {sort}")
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).strip_dirs().sort_stats(sort).print_stats(limit or PROFILE_TOP_N)
+    return out.getvalue()
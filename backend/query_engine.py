@@ -1,10 +1,13 @@
 # backend/query_engine.py
 
 import os
-import sqlite3
+import re
 import requests
 import json
+import time
 from dotenv import load_dotenv
+from backend.db import get_read_conn
+from backend import metrics
 
 load_dotenv()
 
@@ -12,12 +15,11 @@ load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GROQ_ENDPOINT = "https://api.groq.com/openai/v1/chat/completions"
 MODEL = os.getenv("GROQ_MODEL")
-DB_PATH = os.getenv("INVOICE_DB_PATH")
 ROW_LIMIT = int(os.getenv("SQL_ROW_LIMIT", "1050"))
 
 
 # ---------------- LLM CALL ----------------
-def call_groq(messages, temperature=0.0, timeout=30):
+def call_groq(messages, temperature=0.0, timeout=30, caller="query"):
     headers = {
         "Authorization": f"Bearer " + GROQ_API_KEY,
         "Content-Type": "application/json"
@@ -29,13 +31,65 @@ def call_groq(messages, temperature=0.0, timeout=30):
         "temperature": temperature
     }
 
-    res = requests.post(GROQ_ENDPOINT, headers=headers, json=payload, timeout=timeout)
-    res.raise_for_status()
-
-    data = res.json()
+    started = time.perf_counter()
+    status = "error"
+    try:
+        res = requests.post(GROQ_ENDPOINT, headers=headers, json=payload, timeout=timeout)
+        status = str(res.status_code)
+        res.raise_for_status()
+        data = res.json()
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, caller=caller, status=status)
+
+    metrics.record_llm_usage(caller, data.get("usage"))
     return data["choices"][0]["message"]["content"].strip()
 
 
+def call_groq_stream(messages, temperature=0.0, timeout=30, caller="answer_stream"):
+    """
+    Same as call_groq but yields the answer token by token
+    (Groq speaks the OpenAI SSE format: `data: {...}` lines, then `data: [DONE]`).
+    The latency recorded is the whole stream; usage arrives on the last chunk.
+    """
+    headers = {
+        "Authorization": f"Bearer " + GROQ_API_KEY,
+        "Content-Type": "application/json"
+    }
+
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True
+    }
+
+    started = time.perf_counter()
+    status = "error"
+    try:
+        with requests.post(GROQ_ENDPOINT, headers=headers, json=payload, timeout=timeout, stream=True) as res:
+            status = str(res.status_code)
+            res.raise_for_status()
+
+            for line in res.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+
+                chunk = line[len("data:"):].strip()
+                if chunk == "[DONE]":
+                    break
+
+                event = json.loads(chunk)
+                # Groq reports usage in x_groq on the final chunk, OpenAI-style APIs at the top level
+                metrics.record_llm_usage(caller, event.get("usage") or event.get("x_groq", {}).get("usage"))
+
+                choices = event.get("choices") or [{}]
+                delta = choices[0].get("delta", {})
+                if delta.get("content"):
+                    yield delta["content"]
+    finally:
+        metrics.LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, caller=caller, status=status)
+
+
 # ---------------- SCHEMA ----------------
 def get_user_schema():
     return (
@@ -53,7 +107,9 @@ def get_user_schema():
         " - invoice_id (INTEGER)\n"
         " - description (TEXT)\n"
         " - quantity (REAL)\n"
-        " - rate (REAL)\n"
+        " - rate (REAL)\n\n"
+        " - Table: invoice_items_fts (FTS5 full-text index of invoice_items.description, rowid = invoice_items.id)\n"
+        " - Table: invoices_fts (FTS5 full-text index of invoices.customer_name, rowid = invoices.id)\n"
     )
 
 
@@ -133,7 +189,10 @@ def generate_user_sql(question: str):
         "- If the user mentions a date, filter with:\n"
         "    invoices.invoice_date = 'YYYY-MM-DD'\n"
         "- If the user mentions a customer name, filter with:\n"
-        "    invoices.customer_name LIKE '%name%'\n"
+        "    invoices.id IN (SELECT rowid FROM invoices_fts WHERE invoices_fts MATCH '\"name\"*')\n"
+        "- If the user asks about items by words in their description, filter with:\n"
+        "    invoice_items.id IN (SELECT rowid FROM invoice_items_fts WHERE invoice_items_fts MATCH '\"word\"*')\n"
+        "- NEVER use LIKE '%...%' on description or customer_name.\n"
         "- If user mentions invoice number / reference number, filter with:\n"
         "    invoices.invoice_number = 'value'\n"
         "- If the user does not specify any filter, return a valid full SELECT query WITHOUT a WHERE clause.\n"
@@ -151,7 +210,7 @@ def generate_user_sql(question: str):
         "content": f"Schema:\n{schema}\n\nQuestion:\n{question}\n\nSQL only:"
     }
 
-    raw_sql = call_groq([system_msg, user_msg])
+    raw_sql = call_groq([system_msg, user_msg], caller="generate_sql")
     sql = clean_llm_sql(raw_sql)
  
     # Auto JOIN fix
@@ -166,6 +225,24 @@ def generate_user_sql(question: str):
 
 
 # ---------------- EXECUTE SQL ----------------
+def run_sql(query: str, sql: str, params=()):
+    """Execute on the read connection, timed as sql_query_seconds{query=...}. Returns (columns, rows)."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        cursor = get_read_conn().cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        columns = [d[0] for d in cursor.description]
+        cursor.close()
+        status = "ok"
+    finally:
+        metrics.SQL_QUERY_SECONDS.observe(time.perf_counter() - started, query=query, status=status)
+
+    metrics.SQL_ROWS.inc(len(rows), query=query)
+    return columns, rows
+
+
 def execute_for_user(sql: str, user_id: int):
     if not is_safe_select(sql):
         return {"error": "Unsafe SQL generated"}
@@ -199,21 +276,116 @@ def execute_for_user(sql: str, user_id: int):
     sql_final += f" LIMIT {ROW_LIMIT}"
 
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute(sql_final)
-        rows = cursor.fetchall()
-        columns = [d[0] for d in cursor.description]
-        conn.close()
-
+        columns, rows = run_sql("generated", sql_final)
         return {"columns": columns, "rows": rows, "sql_final": sql_final}
 
     except Exception as e:
         return {"error": str(e)}
 
 
+# ---------------- FULL-TEXT SEARCH ----------------
+# Text lookups ("invoices mentioning toner cartridges", "customer named alan d")
+# go through the FTS5 indexes with BM25 ranking instead of LIKE '%...%' scans.
+
+SEARCH_INTENT = re.compile(
+    r"\b(?:mention(?:s|ed|ing)?|contain(?:s|ed|ing)?|includ(?:es|ed|ing)|search(?:ing)? for|"
+    r"look(?:ing)? up|named|called|matching)\s+(.+)$",
+    re.IGNORECASE,
+)
+
+
+def fts_query(text: str):
+    """Turn free text into a safe FTS5 query: every word as a quoted prefix term (implicit AND)."""
+    tokens = re.findall(r"\w+", text.lower())
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def detect_search_intent(question: str):
+    """Return the search text if the question is a text lookup, else None."""
+    match = SEARCH_INTENT.search(question.strip().rstrip("?.! "))
+    if not match:
+        return None
+    return match.group(1).strip(" \"'")
+
+
+SEARCH_SQL = """
+SELECT * FROM (
+    SELECT
+        'item' AS matched_on,
+        bm25(invoice_items_fts) AS score,
+        invoices.invoice_number, invoices.reference_number, invoices.customer_name,
+        invoices.invoice_date, invoices.total,
+        invoice_items.description, invoice_items.quantity, invoice_items.rate
+    FROM invoice_items_fts
+    JOIN invoice_items ON invoice_items.id = invoice_items_fts.rowid
+    JOIN invoices ON invoices.id = invoice_items.invoice_id
+    WHERE invoice_items_fts MATCH :q AND invoices.user_id = :user_id
+
+    UNION ALL
+
+    SELECT
+        'customer' AS matched_on,
+        bm25(invoices_fts) AS score,
+        invoices.invoice_number, invoices.reference_number, invoices.customer_name,
+        invoices.invoice_date, invoices.total,
+        NULL, NULL, NULL
+    FROM invoices_fts
+    JOIN invoices ON invoices.id = invoices_fts.rowid
+    WHERE invoices_fts MATCH :q AND invoices.user_id = :user_id
+)
+ORDER BY score
+LIMIT :limit
+"""
+
+
+def search_sql(query: str):
+    """The search statement as shown to the user (sql events, answers)."""
+    return f"-- full-text search: {query}\n" + SEARCH_SQL.strip()
+
+
+def search_invoices(text: str, user_id: int, limit: int = ROW_LIMIT):
+    """
+    Search primitive: BM25-ranked matches on item descriptions and customer names.
+    Returns the same shape as execute_for_user.
+    """
+    query = fts_query(text)
+    if not query:
+        return {"error": "Empty search"}
+
+    try:
+        columns, rows = run_sql("search", SEARCH_SQL, {"q": query, "user_id": user_id, "limit": limit})
+        return {"columns": columns, "rows": rows, "sql_final": search_sql(query)}
+
+    except Exception as e:
+        return {"error": str(e)}
+
+
+# ---------------- INTENT ROUTER ----------------
+def plan_query(question: str, user_id: int):
+    """
+    Fetch data for a question: the full-text search primitive for text lookups
+    that find something, LLM-generated SQL otherwise. A generator, so callers
+    learn the SQL before it runs: yields ("sql", sql) ahead of each statement,
+    then ("result", exec_result) for the one whose result is used.
+    """
+    search_text = detect_search_intent(question)
+    query = fts_query(search_text) if search_text else None
+    if query:
+        yield "sql", search_sql(query)
+        result = search_invoices(search_text, user_id)
+        if "error" not in result and result["rows"]:
+            yield "result", result
+            return
+
+    sql = generate_user_sql(question)
+    yield "sql", sql
+    yield "result", execute_for_user(sql, user_id)
+
+
 # ---------------- INTERPRET RESULT ----------------
-def interpret_answer(question: str, sql_final: str, result):
+def interpret_messages(question: str, sql_final: str, result):
     preview = json.dumps(result["rows"][:5], ensure_ascii=False)
 
     system_msg = {
@@ -230,47 +402,42 @@ def interpret_answer(question: str, sql_final: str, result):
         "content": f"Question:\n{question}\nSQL:\n{sql_final}\nResults:\n{preview}"
     }
 
-    return call_groq([system_msg, user_msg])
+    return [system_msg, user_msg]
+
+
+def interpret_answer(question: str, sql_final: str, result):
+    return call_groq(interpret_messages(question, sql_final, result), caller="interpret")
 
 
 # ---------------- FALLBACK REASONING ----------------
-def fallback_reasoning_llm(question: str, user_id: int):
+def fallback_messages(question: str, user_id: int):
     """
     When SQL fails, this function loads **all invoices & item details**
-    for the user and lets LLM answer using reasoning.
+    for the user and builds the reasoning prompt from them.
+    Raises on DB errors.
     """
 
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT 
-                invoices.invoice_number,
-                invoices.reference_number,
-                invoices.customer_name,
-                invoices.email,
-                invoices.invoice_date,
-                invoices.total,
-                invoice_items.description,
-                invoice_items.quantity,
-                invoice_items.rate
-            FROM invoices
-            LEFT JOIN invoice_items 
-                ON invoices.id = invoice_items.invoice_id
-            WHERE invoices.user_id = ?
-        """, (user_id,))
-
-        rows = cursor.fetchall()
-        conn.close()
-
-    except Exception as e:
-        return f"Database read error: {str(e)}"
+    _, rows = run_sql("fallback", """
+        SELECT 
+            invoices.invoice_number,
+            invoices.reference_number,
+            invoices.customer_name,
+            invoices.email,
+            invoices.invoice_date,
+            invoices.total,
+            invoice_items.description,
+            invoice_items.quantity,
+            invoice_items.rate
+        FROM invoices
+        LEFT JOIN invoice_items 
+            ON invoices.id = invoice_items.invoice_id
+        WHERE invoices.user_id = ?
+    """, (user_id,))
 
     # Format DB rows into readable text
     rows_text = "\n".join([str(r) for r in rows])
 
-    prompt = [
+    return [
         {
             "role": "system",
             "content": (
@@ -295,17 +462,30 @@ def fallback_reasoning_llm(question: str, user_id: int):
         }
     ]
 
-    return call_groq(prompt)
+
+def fallback_reasoning_llm(question: str, user_id: int):
+    """
+    When SQL fails, this function loads **all invoices & item details**
+    for the user and lets LLM answer using reasoning.
+    """
+
+    try:
+        prompt = fallback_messages(question, user_id)
+    except Exception as e:
+        return f"Database read error: {str(e)}"
+
+    return call_groq(prompt, caller="fallback")
 
 
 # ---------------- MAIN FASTAPI HOOK ----------------
 def question_to_answer(question: str, user_id: int):
     try:
-        # 1️ Generate SQL from LLM
-        sql = generate_user_sql(question)
-
-        # 2️ Execute SQL
-        exec_result = execute_for_user(sql, user_id)
+        # 1️ Search primitive or SQL from LLM, 2️ execute
+        for step, value in plan_query(question, user_id):
+            if step == "sql":
+                sql = value
+            else:
+                exec_result = value
 
         # 3️ If SQL failed → fallback to reasoning
         if "error" in exec_result:
@@ -332,3 +512,65 @@ def question_to_answer(question: str, user_id: int):
 
     except Exception as e:
         return {"ok": False, "error": str(e), "sql": ""}
+
+
+# ---------------- STREAMING HOOK ----------------
+def question_to_answer_stream(question: str, user_id: int):
+    """
+    Streaming variant of question_to_answer.
+    Yields (event, data) tuples:
+      sql   -> SQL about to run (again if the search found nothing and LLM SQL follows)
+      rows  -> SQL executed (or fallback mode chosen)
+      token -> piece of the answer text
+      done  -> final payload (same shape as question_to_answer)
+      error -> something failed, stream ends
+    """
+    try:
+        # 1️ Search primitive or SQL from LLM, 2️ execute (sql is sent before it runs)
+        for step, value in plan_query(question, user_id):
+            if step == "sql":
+                sql = value
+                yield "sql", {"sql": sql}
+            else:
+                exec_result = value
+
+        # 3️ If SQL failed → fallback to reasoning
+        if "error" in exec_result:
+            print(" SQL FAILED → Switching to Reasoning Mode")
+            yield "rows", {"fallback": True, "error": exec_result["error"]}
+
+            try:
+                messages = fallback_messages(question, user_id)
+            except Exception as e:
+                answer = f"Database read error: {str(e)}"
+                yield "token", {"text": answer}
+                yield "done", {"answer": answer, "sql": sql, "fallback": True}
+                return
+
+            final_sql = sql
+            result = None
+        else:
+            yield "rows", {
+                "fallback": False,
+                "columns": exec_result["columns"],
+                "row_count": len(exec_result["rows"])
+            }
+            messages = interpret_messages(question, exec_result["sql_final"], exec_result)
+            final_sql = exec_result["sql_final"]
+            result = exec_result
+
+        # 4 Stream the answer as Groq produces it
+        parts = []
+        for token in call_groq_stream(messages):
+            parts.append(token)
+            yield "token", {"text": token}
+
+        yield "done", {
+            "answer": "".join(parts).strip(),
+            "sql": final_sql,
+            "data": result,
+            "fallback": result is None
+        }
+
+    except Exception as e:
+        yield "error", {"error": str(e)}
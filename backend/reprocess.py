@@ -0,0 +1,93 @@
+# backend/reprocess.py
+"""
+Re-run extraction/validation for stored invoices from their archived artifacts
+(see backend/artifact_store.py) instead of re-OCRing the original files.
+
+    python -m backend.reprocess --workers 8                  # re-extract from OCR text (LLM call)
+    python -m backend.reprocess --skip-llm                   # re-validate stored LLM output only
+    python -m backend.reprocess --invoice-id 12 40 --dry-run # show what would change
+
+Updated invoices are rewritten in the DB; nothing is pushed to the ERP.
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import artifact_store
+from backend.data_validator import validate_invoice_data
+from backend.db import init_db, update_invoice, get_invoice_user_id
+from backend.llm_extractor import extract_fields_raw
+
+logging.basicConfig(level=logging.INFO)
+
+
+def reprocess_invoice(invoice_id: int, skip_llm: bool = False, dry_run: bool = False) -> dict:
+    if skip_llm:
+        extracted = artifact_store.load_artifact(invoice_id, artifact_store.EXTRACTED, as_json=True)
+        if extracted is None:
+            return {"invoice_id": invoice_id, "status": "skipped", "error": "No stored extraction"}
+    else:
+        ocr_text = artifact_store.load_artifact(invoice_id, artifact_store.OCR_TEXT)
+        if ocr_text is None:
+            return {"invoice_id": invoice_id, "status": "skipped", "error": "No stored OCR text"}
+
+        extracted, llm_response = extract_fields_raw(ocr_text)
+        if llm_response is None:
+            # extracted is the empty fallback; keep the archived extraction for --skip-llm
+            return {"invoice_id": invoice_id, "status": "failed", "error": "LLM extraction failed"}
+        if not dry_run:
+            artifact_store.save_artifacts(invoice_id, {
+                artifact_store.LLM_RESPONSE: llm_response,
+                artifact_store.EXTRACTED: json.dumps(extracted, default=str),
+            })
+
+    validated = validate_invoice_data(extracted)
+    if not validated:
+        return {"invoice_id": invoice_id, "status": "failed", "error": "Invalid invoice data"}
+
+    validated["user_id"] = get_invoice_user_id(invoice_id)
+    if not dry_run:
+        update_invoice(invoice_id, validated)
+
+    return {"invoice_id": invoice_id, "status": "success", "data": validated}
+
+
+def reprocess_all(invoice_ids=None, workers: int = 8, skip_llm: bool = False, dry_run: bool = False):
+    kind = artifact_store.EXTRACTED if skip_llm else artifact_store.OCR_TEXT
+    targets = artifact_store.invoices_with_artifact(kind, invoice_ids)
+    logging.info(f"Reprocessing {len(targets)} invoice(s) with {workers} worker(s)")
+
+    def run(invoice_id):
+        try:
+            return reprocess_invoice(invoice_id, skip_llm, dry_run)
+        except Exception as e:
+            logging.exception(f"Reprocessing failed for invoice ID={invoice_id}")
+            return {"invoice_id": invoice_id, "status": "failed", "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, targets))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoice-id", type=int, nargs="*", help="only these invoices (default: all with artifacts)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--skip-llm", action="store_true", help="re-validate the stored LLM output, no LLM calls")
+    parser.add_argument("--dry-run", action="store_true", help="do not write anything")
+    args = parser.parse_args()
+
+    init_db()
+    started = time.perf_counter()
+    results = reprocess_all(args.invoice_id, args.workers, args.skip_llm, args.dry_run)
+
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+        if r["status"] != "success":
+            logging.warning(f"Invoice ID={r['invoice_id']}: {r['status']} - {r.get('error')}")
+        elif args.dry_run:
+            logging.info(f"Invoice ID={r['invoice_id']}: {r['data']}")
+
+    logging.info(f"Done in {time.perf_counter() - started:.1f}s: {counts}")
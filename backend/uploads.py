@@ -0,0 +1,149 @@
+# backend/uploads.py
+"""
+Upload handling without whole-file reads.
+
+- upload_limit_for(): per-route max request size, enforced from Content-Length
+  by the middleware in main.py before the body is parsed
+- copy_limited(): chunked copy that aborts with 413 as soon as the limit is hit
+  (covers chunked requests and ZIP members that lie about their size)
+- spool_upload(): keeps small uploads in memory and rolls larger ones to a temp
+  file; view() hands the OCR layer a memoryview / mmap instead of a bytes copy
+"""
+import io
+import logging
+import mmap
+import os
+import tempfile
+from typing import BinaryIO, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+
+load_dotenv()
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))              # one document
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(1024 * 1024 * 1024)))  # whole batch request
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))        # bigger → temp file
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MULTIPART_OVERHEAD = 64 * 1024  # boundaries + part headers on top of the file itself
+
+
+def upload_limit_for(path: str) -> Optional[int]:
+    """Max request body for upload routes (None = not an upload route)."""
+    if path.startswith("/process-invoice/batch"):
+        return MAX_BATCH_UPLOAD_BYTES + MULTIPART_OVERHEAD
+    if path.startswith(("/process-invoice", "/classify-document")):
+        return MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+    return None
+
+
+def _too_large(max_bytes: int):
+    return HTTPException(413, f"File too large (max {max_bytes} bytes)")
+
+
+def copy_limited(src: BinaryIO, dst: BinaryIO, max_bytes: Optional[int] = MAX_UPLOAD_BYTES) -> int:
+    """Copy src → dst in chunks; raises HTTP 413 once more than max_bytes were read."""
+    total = 0
+    while True:
+        chunk = src.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return total
+        total += len(chunk)
+        if max_bytes is not None and total > max_bytes:
+            raise _too_large(max_bytes)
+        dst.write(chunk)
+
+
+def open_view(path: str):
+    """Read-only mmap of a file (b"" for an empty file, which mmap refuses)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def close_view(view):
+    """
+    Close a view from open_view(). If a buffer still points into the mmap (a
+    numpy array kept alive by a traceback, say) closing raises BufferError;
+    then the mapping is left to the garbage collector instead of masking
+    whatever error is being handled.
+    """
+    if not hasattr(view, "close"):
+        return
+    try:
+        view.close()
+    except BufferError:
+        logging.debug("mmap still exported, leaving it to GC")
+
+
+class SpooledUpload:
+    """An upload held in memory (small) or in a temp file (large)."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self.path = None          # set once rolled to disk
+        self._buffer = io.BytesIO()
+        self._file = None
+        self._view = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._file is None and self.size > UPLOAD_SPOOL_THRESHOLD:
+            fd, self.path = tempfile.mkstemp(prefix="upload_")
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._buffer.write(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    def view(self):
+        """Zero-copy buffer over the content: memoryview (in memory) or mmap (on disk)."""
+        if self._view is None:
+            self._view = open_view(self.path) if self.path else self._buffer.getbuffer()
+        return self._view
+
+    def close(self):
+        if self._view is not None:
+            close_view(self._view)
+        self._view = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def spool_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """Stream an UploadFile into a SpooledUpload, enforcing max_bytes chunk by chunk."""
+    upload = SpooledUpload(file.filename)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if upload.size + len(chunk) > max_bytes:
+                raise _too_large(max_bytes)
+            upload.write(chunk)
+        upload.finish()
+    except Exception:
+        upload.finish()
+        upload.close()
+        raise
+    return upload
+
+
+def save_upload_to(src: BinaryIO, dest_path: str, max_bytes: Optional[int] = MAX_UPLOAD_BYTES) -> int:
+    """Copy a stream to dest_path with the size limit; removes the partial file on failure."""
+    try:
+        with open(dest_path, "wb") as dst:
+            return copy_limited(src, dst, max_bytes)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+
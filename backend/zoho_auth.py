@@ -1,66 +1,220 @@
+# backend/zoho_auth.py
+"""
+Zoho OAuth access tokens, cached and shared.
+
+Access tokens live ~1 hour but used to be fetched for every Zoho call (three
+refresh-token exchanges per invoice push, which Zoho throttles). Now:
+
+- the token is cached in memory and in the `zoho_tokens` table, so every
+  thread and process (API workers, watchers) reuses the same one
+- only one caller refreshes at a time: it takes a short lease on the row under
+  BEGIN IMMEDIATE, does the HTTP exchange without holding the DB lock, then
+  stores the new token; the others keep using the old one or wait for it
+- start_token_refresher() renews the token ZOHO_TOKEN_REFRESH_MARGIN seconds
+  before it expires, so requests never wait on accounts.zoho.in
+- invalidate_access_token() drops a token Zoho rejected (HTTP 401)
+
+Tokens are never printed or logged.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
 import requests
-from dotenv import load_dotenv 
-import os 
+from dotenv import load_dotenv
+
+from backend import metrics
+from backend.db import get_conn
 
 load_dotenv()
 
+ZOHO_TOKEN_URL = os.getenv("ZOHO_TOKEN_URL", "https://accounts.zoho.in/oauth/v2/token")
+ZOHO_TOKEN_REFRESH_MARGIN = float(os.getenv("ZOHO_TOKEN_REFRESH_MARGIN", "300"))  # refresh this early
+ZOHO_TOKEN_LEASE_SECONDS = float(os.getenv("ZOHO_TOKEN_LEASE_SECONDS", "30"))     # one refresher at a time
+ZOHO_TOKEN_WAIT_SECONDS = float(os.getenv("ZOHO_TOKEN_WAIT_SECONDS", "15"))       # wait for another refresher
+
+TOKEN_NAME = "default"
+
+_lock = threading.Lock()
+_cached = {"token": None, "expires_at": 0.0}
+_refresher = {"thread": None, "stop": threading.Event()}
+
+
+def _fresh(expires_at: float, margin: float = 0.0) -> bool:
+    return expires_at - margin > time.time()
+
 
-def get_zoho_access_token():
+# ---------------- TOKEN EXCHANGE ----------------
+def fetch_access_token() -> Tuple[str, float]:
+    """One refresh-token exchange with Zoho. Returns (access_token, expires_in seconds)."""
+    client_id = os.getenv("ZOHO_CLIENT_ID")
+    client_secret = os.getenv("ZOHO_CLIENT_SECRET")
+    refresh_token = os.getenv("ZOHO_REFRESH_TOKEN")
+    if not all([client_id, client_secret, refresh_token]):
+        raise ValueError("Missing one or more Zoho credentials.")
+
+    params = {
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "grant_type": "refresh_token"
+    }
+
+    started = time.perf_counter()
+    status = "error"
     try:
-        # --- Zoho Credentials (for testing only — not for production) ---
-        ZOHO_CLIENT_ID = os.getenv("ZOHO_CLIENT_ID") 
-        ZOHO_CLIENT_SECRET = os.getenv("ZOHO_CLIENT_SECRET") 
-        ZOHO_REFRESH_TOKEN = os.getenv("ZOHO_REFRESH_TOKEN")  
-        ZOHO_ORG_ID=  os.getenv("ZOHO_ORG_ID")                
-
-        # Validate required values
-        if not all([ZOHO_CLIENT_ID, ZOHO_CLIENT_SECRET, ZOHO_REFRESH_TOKEN]):
-            raise ValueError("Missing one or more Zoho credentials.")
-
-        # --- API URL and parameters ---
-        token_url = "https://accounts.zoho.in/oauth/v2/token"
-        params = {
-            "refresh_token": ZOHO_REFRESH_TOKEN,
-            "client_id": ZOHO_CLIENT_ID,
-            "client_secret": ZOHO_CLIENT_SECRET,
-            "grant_type": "refresh_token"
-        }
-
-        # --- Send POST request ---
-        response = requests.post(token_url, params=params, timeout=10)
-        response.raise_for_status()  # Raise error for bad HTTP status codes
-
-        # --- Parse response ---
-        data = response.json()
-        access_token = data.get("access_token")
-
-        if not access_token:
-            raise ValueError(f" Failed to fetch access token. Full response: {data}")
-
-        # ---  Print and return token ---
-        print(f"\nAccess Token: {access_token}")
-        print(f"🔹 Status Code: {response.status_code}\n")
-
-        return access_token
-
-    except requests.exceptions.Timeout:
-        print(" Error: Request to Zoho timed out.")
-    except requests.exceptions.ConnectionError:
-        print(" Error: Network connection failed.")
-    except requests.exceptions.HTTPError as e:
-        print(f" HTTP Error: {e.response.status_code} - {e.response.text}")
-    except ValueError as e:
-        print(f"{e}")
-    except Exception as e:
-        print(f" Unexpected Error: {e}")
+        response = requests.post(ZOHO_TOKEN_URL, params=params, timeout=10)
+        status = str(response.status_code)
     finally:
-        print("Execution completed.\n")
+        metrics.ZOHO_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="oauth.token", status=status)
+    response.raise_for_status()
+
+    data = response.json()
+    access_token = data.get("access_token")
+    if not access_token:
+        # Error responses carry no token, only e.g. {"error": "invalid_code"}
+        raise ValueError(f"Zoho token refresh failed: {data.get('error') or 'no access_token in response'}")
+
+    return access_token, float(data.get("expires_in") or 3600)
+
+
+# ---------------- SHARED CACHE (DB) ----------------
+def _load_stored() -> Tuple[Optional[str], float]:
+    row = get_conn().execute(
+        "SELECT access_token, expires_at FROM zoho_tokens WHERE name = ?", (TOKEN_NAME,)
+    ).fetchone()
+    return (row[0], row[1] or 0.0) if row else (None, 0.0)
+
+
+def _claim_refresh() -> bool:
+    """Take the refresh lease unless another thread/process holds it."""
+    now = time.time()
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            "INSERT OR IGNORE INTO zoho_tokens (name, expires_at, refreshing_until) VALUES (?, 0, 0)",
+            (TOKEN_NAME,)
+        )
+        cursor.execute(
+            "UPDATE zoho_tokens SET refreshing_until = ? WHERE name = ? AND COALESCE(refreshing_until, 0) < ?",
+            (now + ZOHO_TOKEN_LEASE_SECONDS, TOKEN_NAME, now)
+        )
+        claimed = cursor.rowcount == 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return claimed
+
+
+def _store(token: Optional[str], expires_at: float):
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE zoho_tokens SET access_token = ?, expires_at = ?, refreshed_at = ?, refreshing_until = 0 WHERE name = ?",
+            (token, expires_at, time.time(), TOKEN_NAME)
+        )
+
+
+def _release_claim():
+    conn = get_conn()
+    with conn:
+        conn.execute("UPDATE zoho_tokens SET refreshing_until = 0 WHERE name = ?", (TOKEN_NAME,))
+
+
+def refresh_access_token() -> Optional[str]:
+    """
+    Make sure a fresh token is stored (refreshing it here, or waiting for whoever
+    is already doing so) and return it.
+    """
+    deadline = time.monotonic() + ZOHO_TOKEN_WAIT_SECONDS
+    while True:
+        token, expires_at = _load_stored()
+        if token and _fresh(expires_at, ZOHO_TOKEN_REFRESH_MARGIN):
+            break
+
+        if _claim_refresh():
+            try:
+                token, expires_in = fetch_access_token()
+            except Exception:
+                _release_claim()
+                raise
+            expires_at = time.time() + expires_in
+            _store(token, expires_at)
+            logging.info(f"Zoho access token refreshed, valid for {int(expires_in)}s")
+            break
+
+        # Someone else is refreshing; an old token that has not expired yet is still usable
+        if token and _fresh(expires_at):
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError("Timed out waiting for another process to refresh the Zoho token")
+        time.sleep(0.2)
+
+    with _lock:
+        _cached["token"], _cached["expires_at"] = token, expires_at
+    return token
+
+
+def get_zoho_access_token() -> Optional[str]:
+    """Cached access token (memory → DB → refresh). None if it cannot be obtained."""
+    with _lock:
+        if _cached["token"] and _fresh(_cached["expires_at"], ZOHO_TOKEN_REFRESH_MARGIN / 2):
+            return _cached["token"]
+
+    try:
+        return refresh_access_token()
+    except Exception as e:
+        logging.error(f"Zoho access token unavailable: {e}")
+        return None
+
+
+def invalidate_access_token(token: str):
+    """Drop a token Zoho rejected (401) so the next call refreshes; no-op if already replaced."""
+    with _lock:
+        if _cached["token"] == token:
+            _cached["token"], _cached["expires_at"] = None, 0.0
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE zoho_tokens SET expires_at = 0 WHERE name = ? AND access_token = ?",
+            (TOKEN_NAME, token)
+        )
+
+
+# ---------------- PROACTIVE REFRESH ----------------
+def _refresher_loop(stop: threading.Event):
+    while not stop.is_set():
+        try:
+            refresh_access_token()
+            with _lock:
+                expires_at = _cached["expires_at"]
+            wait = max(expires_at - ZOHO_TOKEN_REFRESH_MARGIN - time.time(), 1.0)
+        except Exception as e:
+            logging.error(f"Background Zoho token refresh failed: {e}")
+            wait = 30.0
+        stop.wait(wait)
 
-    return None
 
+def start_token_refresher():
+    """Keep the shared token renewed ahead of expiry (one thread per process is enough)."""
+    if _refresher["thread"] and _refresher["thread"].is_alive():
+        return
+    if not os.getenv("ZOHO_REFRESH_TOKEN"):
+        logging.info("Zoho credentials not configured, token refresher not started")
+        return
+    _refresher["stop"].clear()
+    t = threading.Thread(target=_refresher_loop, args=(_refresher["stop"],), name="zoho-token", daemon=True)
+    t.start()
+    _refresher["thread"] = t
 
-#  Run the function directly 
 
-# if __name__ == "__main__":
-#     token = get_zoho_access_token()
-#     print(f"Result from function: {token}")
+def stop_token_refresher():
+    _refresher["stop"].set()
+    if _refresher["thread"]:
+        _refresher["thread"].join(5)
+        _refresher["thread"] = None
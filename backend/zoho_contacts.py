@@ -0,0 +1,285 @@
+# backend/zoho_contacts.py
+"""
+Local directory of Zoho Books contacts for customer lookup.
+
+get_customer_id() used to download one page of contacts per invoice and scan
+it linearly, so customers past the first page were never found and got
+re-created. Contacts are now mirrored into the `zoho_contacts` table (full
+sync with pagination, then incremental by last_modified_time, see
+erp_integration.sync_contacts) and loaded into an in-memory index:
+
+- exact:  normalized name → contact id (dict lookup)
+- fuzzy:  name trigrams → contact ids, scored by Dice similarity, for OCR'd
+          names that differ by a typo, punctuation or a "Pvt Ltd" suffix
+
+Each process keeps its own index and reloads it when the table changes
+(a version counter in zoho_sync_state, bumped by every write). The sync
+time and last_modified watermark are moved by sync_contacts only, never by
+add_contact(), so local creates neither postpone the next sync nor skip
+contacts changed in Zoho since the last one. One sync runs at a time across
+processes (claim_sync(), a lease like zoho_auth's refresh claim).
+"""
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from backend.db import get_conn
+
+load_dotenv()
+
+ZOHO_CONTACT_FUZZY_THRESHOLD = float(os.getenv("ZOHO_CONTACT_FUZZY_THRESHOLD", "0.9"))  # Dice, 0..1
+ZOHO_CONTACT_SYNC_INTERVAL = float(os.getenv("ZOHO_CONTACT_SYNC_INTERVAL", "300"))     # incremental refresh, seconds
+ZOHO_CONTACT_SYNC_LEASE = float(os.getenv("ZOHO_CONTACT_SYNC_LEASE", "60"))           # renewed every page
+ZOHO_CONTACT_SYNC_WAIT = float(os.getenv("ZOHO_CONTACT_SYNC_WAIT", "60"))             # wait for another syncer
+ZOHO_CONTACT_INDEX_CHECK = 5.0  # seconds between checks for writes by other processes
+
+# Legal-form words that OCR'd invoices include or drop at random
+_SUFFIXES = {
+    "pvt", "private", "ltd", "limited", "llc", "llp", "inc", "incorporated",
+    "co", "company", "corp", "corporation", "plc", "gmbh",
+}
+
+_lock = threading.Lock()
+_index = {"version": None, "checked_at": 0.0, "exact": {}, "trigrams": {}, "sizes": {}}
+
+
+# ---------------- NORMALIZATION ----------------
+def normalize_name(name: str) -> str:
+    words = re.sub(r"[^a-z0-9 ]", " ", str(name or "").lower()).split()
+    while len(words) > 1 and words[-1] in _SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def trigrams(normalized: str) -> set:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def parse_zoho_time(value: Optional[str]) -> float:
+    """Zoho timestamps look like 2024-05-02T10:15:00+0530; returns epoch seconds (0 if missing)."""
+    if not value:
+        return 0.0
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").timestamp()
+    except ValueError:
+        return 0.0
+
+
+# ---------------- STORAGE ----------------
+UPSERT_CONTACT = """
+INSERT INTO zoho_contacts (contact_id, contact_name, normalized_name, email, last_modified, synced_at)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(contact_id) DO UPDATE SET
+    contact_name = excluded.contact_name,
+    normalized_name = excluded.normalized_name,
+    email = excluded.email,
+    last_modified = excluded.last_modified,
+    synced_at = excluded.synced_at
+"""
+
+
+def _state(conn, name: str, default=None):
+    row = conn.execute("SELECT value FROM zoho_sync_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else default
+
+
+def _set_state(conn, name: str, value):
+    conn.execute("INSERT OR REPLACE INTO zoho_sync_state (name, value) VALUES (?, ?)", (name, str(value)))
+
+
+def _write_contacts(contacts: Iterable[Dict], sync: bool = False, full: bool = False,
+                    started: Optional[float] = None):
+    """
+    Upsert contact rows and bump the index version. Returns (rows, version).
+    Only a sync (sync=True) moves contacts_synced_at and the last_modified
+    watermark. A full sync then drops rows written before it started that
+    Zoho no longer lists; contacts add_contact() wrote meanwhile are newer
+    and stay.
+    """
+    now = time.time()
+    rows = [
+        (
+            c["contact_id"],
+            c.get("contact_name") or "",
+            normalize_name(c.get("contact_name")),
+            c.get("email"),
+            parse_zoho_time(c.get("last_modified_time")),
+            now,
+        )
+        for c in contacts
+        if c.get("contact_id")
+    ]
+
+    conn = get_conn()
+    with conn:
+        conn.executemany(UPSERT_CONTACT, rows)
+        if sync:
+            previous = 0.0 if full else float(_state(conn, "contacts_watermark", 0))
+            if full:
+                conn.execute("DELETE FROM zoho_contacts WHERE COALESCE(synced_at, 0) < ?", (started or now,))
+                _set_state(conn, "contacts_full_sync_at", now)
+            _set_state(conn, "contacts_watermark", max([previous] + [row[4] for row in rows]))
+            _set_state(conn, "contacts_synced_at", now)
+        version = conn.execute(
+            """
+            INSERT INTO zoho_sync_state (name, value) VALUES ('contacts_version', '1')
+            ON CONFLICT(name) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+            RETURNING value
+            """
+        ).fetchone()[0]
+    return rows, str(version)
+
+
+def upsert_contacts(contacts: Iterable[Dict], full: bool = False, started: Optional[float] = None) -> int:
+    """
+    Store the contacts a sync fetched from Zoho and rebuild the index. With
+    full=True, rows Zoho no longer lists (deleted there) are dropped, except
+    ones written after `started`. Returns the number written.
+    """
+    rows, _ = _write_contacts(contacts, sync=True, full=full, started=started)
+    _reload_index()
+    return len(rows)
+
+
+def sync_state() -> Dict[str, float]:
+    """last_modified watermark and sync times (0 when never synced)."""
+    conn = get_conn()
+    return {
+        "last_modified": float(_state(conn, "contacts_watermark", 0)),
+        "synced_at": float(_state(conn, "contacts_synced_at", 0)),
+        "full_sync_at": float(_state(conn, "contacts_full_sync_at", 0)),
+    }
+
+
+def needs_sync() -> bool:
+    return time.time() - sync_state()["synced_at"] > ZOHO_CONTACT_SYNC_INTERVAL
+
+
+# ---------------- SYNC LEASE ----------------
+def claim_sync(holder: Optional[str] = None) -> Optional[str]:
+    """
+    Take the sync lease for ZOHO_CONTACT_SYNC_LEASE seconds unless another
+    caller holds it; pass the returned holder id again to renew it. Returns
+    the holder id, or None if someone else is syncing.
+    """
+    holder = holder or uuid.uuid4().hex
+    now = time.time()
+    conn = get_conn()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        current = (_state(conn, "contacts_sync_lease") or "0 -").split()
+        claimed = float(current[0]) < now or current[1] == holder
+        if claimed:
+            _set_state(conn, "contacts_sync_lease", f"{now + ZOHO_CONTACT_SYNC_LEASE} {holder}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return holder if claimed else None
+
+
+def release_sync(holder: str):
+    conn = get_conn()
+    with conn:
+        conn.execute(
+            "UPDATE zoho_sync_state SET value = '0 -' WHERE name = 'contacts_sync_lease' AND value LIKE ?",
+            (f"% {holder}",)
+        )
+
+
+# ---------------- IN-MEMORY INDEX ----------------
+def _table_version():
+    # Every write to zoho_contacts bumps contacts_version, in whichever process it ran
+    return _state(get_conn(), "contacts_version", "")
+
+
+def _reload_index():
+    version = _table_version()
+    exact, grams, sizes = {}, {}, {}
+    for contact_id, normalized in get_conn().execute(
+        "SELECT contact_id, normalized_name FROM zoho_contacts ORDER BY last_modified"
+    ):
+        exact[normalized] = contact_id       # newest wins on duplicate names
+        contact_grams = trigrams(normalized)
+        sizes[contact_id] = len(contact_grams)
+        for gram in contact_grams:
+            grams.setdefault(gram, set()).add(contact_id)
+
+    with _lock:
+        _index.update(version=version, checked_at=time.monotonic(), exact=exact, trigrams=grams, sizes=sizes)
+    logging.info(f"Zoho contact index loaded: {len(sizes)} contacts")
+
+
+def _ensure_index():
+    """Reload if another process changed the table; checked at most every ZOHO_CONTACT_INDEX_CHECK seconds."""
+    with _lock:
+        if _index["version"] is not None and time.monotonic() - _index["checked_at"] < ZOHO_CONTACT_INDEX_CHECK:
+            return
+        _index["checked_at"] = time.monotonic()
+        loaded = _index["version"]
+    if loaded is None or loaded != _table_version():
+        _reload_index()
+
+
+def add_contact(contact: Dict):
+    """
+    Record a contact we just created in Zoho: one row + an in-place index
+    update, no API round trip. Sync time and watermark are left alone.
+    """
+    rows, version = _write_contacts([contact])
+    with _lock:
+        # Only skip the reload if nobody else wrote since our index was loaded
+        stale = _index["version"] is None or str(int(_index["version"] or 0) + 1) != version
+        for contact_id, _, normalized, _, _, _ in rows:
+            contact_grams = trigrams(normalized)
+            _index["exact"][normalized] = contact_id
+            _index["sizes"][contact_id] = len(contact_grams)
+            for gram in contact_grams:
+                _index["trigrams"].setdefault(gram, set()).add(contact_id)
+        if not stale:
+            _index["version"] = version
+
+
+def find_contact(customer_name: str) -> Optional[str]:
+    """Contact id for a customer name: exact normalized match, else best fuzzy match above the threshold."""
+    normalized = normalize_name(customer_name)
+    if not normalized:
+        return None
+
+    _ensure_index()
+    with _lock:
+        contact_id = _index["exact"].get(normalized)
+        if contact_id:
+            return contact_id
+
+        wanted = trigrams(normalized)
+        overlap = {}
+        for gram in wanted:
+            for candidate in _index["trigrams"].get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+
+        best, best_score = None, 0.0
+        for candidate, shared in overlap.items():
+            score = 2 * shared / (len(wanted) + _index["sizes"][candidate])
+            if score > best_score:
+                best, best_score = candidate, score
+
+    if best_score >= ZOHO_CONTACT_FUZZY_THRESHOLD:
+        logging.info(f"Fuzzy-matched customer {customer_name!r} to contact {best} (score {best_score:.2f})")
+        return best
+    return None
+
+
+def contact_count() -> int:
+    _ensure_index()
+    with _lock:
+        return len(_index["sizes"])
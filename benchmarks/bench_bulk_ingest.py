@@ -0,0 +1,60 @@
+# benchmarks/bench_bulk_ingest.py
+"""
+Rows/sec for the single-invoice save path vs. db.save_invoices_bulk.
+
+    python benchmarks/bench_bulk_ingest.py --invoices 20000 --items 3
+"""
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import argparse
+import tempfile
+import time
+
+os.environ["INVOICE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bench_bulk_"), "bulk.db")
+
+from backend import db  # noqa: E402  (must see INVOICE_DB_PATH first)
+
+
+def make_invoices(n, items):
+    return [
+        {
+            "invoice_number": f"INV-{i}",
+            "reference_number": f"REF-{i}",
+            "customer_name": f"Customer {i % 500}",
+            "email": "billing@example.com",
+            "invoice_date": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            "total": 100.0 * items,
+            "line_items": [
+                {"description": f"Item {j}", "quantity": 1, "rate": 100.0} for j in range(items)
+            ],
+        }
+        for i in range(n)
+    ]
+
+
+def report(label, n, items, seconds):
+    rows = n * (items + 1)
+    print(f"{label:<7} {n} invoices / {rows} rows in {seconds:.2f}s  "
+          f"-> {n / seconds:>10.0f} invoices/s {rows / seconds:>10.0f} rows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=20_000)
+    parser.add_argument("--items", type=int, default=3, help="line items per invoice")
+    parser.add_argument("--batch-size", type=int, default=db.BULK_BATCH_SIZE)
+    args = parser.parse_args()
+
+    db.init_db()
+    invoices = make_invoices(args.invoices, args.items)
+
+    t0 = time.perf_counter()
+    for invoice in invoices:
+        db.save_invoice_to_db(invoice, 1)
+    report("single", args.invoices, args.items, time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    db.save_invoices_bulk(invoices, 2, args.batch_size)
+    report("bulk", args.invoices, args.items, time.perf_counter() - t0)
@@ -0,0 +1,142 @@
+# benchmarks/bench_db_connections.py
+"""
+Mixed read/write SQLite throughput: connect-per-call (old db.py behaviour)
+vs. the pooled WAL connections in backend/db.py.
+
+Writers insert invoices the way the watchers do, readers run the chatbot's
+user-scoped join. Run from the project root:
+
+    python benchmarks/bench_db_connections.py --seconds 5 --writers 2 --readers 6
+"""
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import argparse
+import sqlite3
+import tempfile
+import threading
+import time
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_db_")
+os.environ["INVOICE_DB_PATH"] = os.path.join(TMP_DIR, "pooled.db")
+
+from backend import db  # noqa: E402  (must see INVOICE_DB_PATH first)
+
+READ_SQL = (
+    "SELECT invoices.customer_name, SUM(invoice_items.quantity * invoice_items.rate) "
+    "FROM invoices LEFT JOIN invoice_items ON invoices.id = invoice_items.invoice_id "
+    "WHERE invoices.user_id = ? GROUP BY invoices.customer_name LIMIT 1050"
+)
+
+SAMPLE_INVOICE = {
+    "invoice_number": "INV-1",
+    "reference_number": "REF-1",
+    "customer_name": "Alan Dominguez",
+    "email": "alan@example.com",
+    "invoice_date": "2025-01-15",
+    "total": 300.0,
+    "line_items": [
+        {"description": "Toner cartridge", "quantity": 2, "rate": 100.0},
+        {"description": "A4 paper", "quantity": 1, "rate": 100.0},
+    ],
+}
+
+
+# ---------------- OLD BEHAVIOUR (connect per call, rollback journal) ----------------
+def naive_write(path):
+    with sqlite3.connect(path, timeout=30) as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "INSERT INTO invoices (user_id, invoice_number, reference_number, customer_name, email, invoice_date, total) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (1, "INV-1", "REF-1", "Alan Dominguez", "alan@example.com", "2025-01-15", 300.0),
+        )
+        invoice_id = cur.lastrowid
+        for item in SAMPLE_INVOICE["line_items"]:
+            cur.execute(
+                "INSERT INTO invoice_items (invoice_id, description, quantity, rate) VALUES (?, ?, ?, ?)",
+                (invoice_id, item["description"], item["quantity"], item["rate"]),
+            )
+        conn.commit()
+
+
+def naive_read(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute(READ_SQL, (1,)).fetchall()
+    conn.close()
+
+
+# ---------------- NEW BEHAVIOUR (backend.db pool) ----------------
+def pooled_write(_path):
+    db.save_invoice_to_db(SAMPLE_INVOICE, 1)
+
+
+def pooled_read(_path):
+    cur = db.get_read_conn().cursor()
+    cur.execute(READ_SQL, (1,)).fetchall()
+    cur.close()
+
+
+def run_mix(label, path, write_fn, read_fn, seconds, writers, readers):
+    counts = {"write": 0, "read": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def loop(kind, fn):
+        done = 0
+        errors = 0
+        while time.perf_counter() < stop:
+            try:
+                fn(path)
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        with lock:
+            counts[kind] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=loop, args=("write", write_fn)) for _ in range(writers)]
+    threads += [threading.Thread(target=loop, args=("read", read_fn)) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    print(
+        f"{label:<8} writes/s={counts['write'] / seconds:>9.1f}  "
+        f"reads/s={counts['read'] / seconds:>9.1f}  errors={counts['errors']}"
+    )
+
+
+def seed(path, n):
+    with sqlite3.connect(path) as conn:
+        conn.execute(db.CREATE_TABLE_USERS)
+        conn.execute(db.CREATE_TABLE_INVOICES)
+        conn.execute(db.CREATE_TABLE_ITEMS)
+        for _ in range(n):
+            cur = conn.execute(
+                "INSERT INTO invoices (user_id, customer_name, invoice_date, total) VALUES (1, 'Seed Co', '2025-01-01', 10)"
+            )
+            conn.execute(
+                "INSERT INTO invoice_items (invoice_id, description, quantity, rate) VALUES (?, 'seed', 1, 10)",
+                (cur.lastrowid,),
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=2000, help="invoices preloaded before measuring")
+    args = parser.parse_args()
+
+    naive_path = os.path.join(TMP_DIR, "naive.db")
+    seed(naive_path, args.seed)
+    seed(db.DB_NAME, args.seed)
+    db.init_db()  # switches the pooled DB to WAL
+
+    print(f"{args.writers} writer(s), {args.readers} reader(s), {args.seconds}s each, DBs in {TMP_DIR}")
+    run_mix("before", naive_path, naive_write, naive_read, args.seconds, args.writers, args.readers)
+    run_mix("after", db.DB_NAME, pooled_write, pooled_read, args.seconds, args.writers, args.readers)
@@ -0,0 +1,131 @@
+# benchmarks/bench_email_watcher.py
+"""
+Email agent against benchmarks/mock_imap.py: backlog drain time and
+delivery-to-pipeline latency for mail arriving while it runs, and the IMAP
+bytes per message for each fetch strategy.
+
+--accounts mailboxes each start with --backlog messages; --slow of them
+answer every IMAP command after --slow-ms. The pipeline is stubbed with a
+--pipeline-ms sleep so only the mail path is measured. With --no-idle the
+server does not advertise IDLE and the agent falls back to polling.
+
+    python benchmarks/bench_email_watcher.py --accounts 200 --slow 5 --slow-ms 2000
+    python benchmarks/bench_email_watcher.py --accounts 200 --no-idle --poll-interval 10
+    python benchmarks/bench_email_watcher.py --strategy full   # whole messages, for comparison
+"""
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_email_")
+os.environ["INVOICE_DB_PATH"] = os.path.join(TMP_DIR, "email.db")
+
+from benchmarks.mock_imap import MockIMAP, make_invoice_email  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+async def main(args):
+    from backend import db
+    from agents import email_watcher
+
+    processed = {}       # attachment filename -> time it reached the pipeline
+
+    def fake_pipeline(document, on_stage=None):
+        processed[document.filename] = time.perf_counter()
+        time.sleep(args.pipeline_ms / 1000)
+        return {"status": "success", "invoice_id": 0}
+
+    email_watcher.process_document = fake_pipeline
+    email_watcher.EMAIL_POLL_INTERVAL = args.poll_interval
+    email_watcher.EMAIL_FETCH_STRATEGY = args.strategy
+
+    def invoice_email(i, name):
+        return make_invoice_email(f"user{i}@example.com", name, b"%PDF-1.4 " + name.encode() + b" " * args.attachment_kb * 1024,
+                                  html_padding=args.html_kb * 1024)
+
+    mock = MockIMAP(latency_ms=args.latency_ms, idle=not args.no_idle)
+    port = await mock.start()
+
+    db.init_db()
+    sent = {}            # filename -> time it was appended
+    for i in range(args.accounts):
+        user_id = db.create_user(f"bench{i}", "x")
+        db.update_user(user_id, imap_host=f"imap://127.0.0.1:{port}", imap_user=f"user{i}", imap_pass="secret")
+        mock.add_account(f"user{i}", "secret", latency_ms=args.slow_ms if i < args.slow else None)
+        for n in range(args.backlog):
+            name = f"backlog-{i}-{n}.pdf"
+            mock.append(f"user{i}", invoice_email(i, name))
+            sent[name] = time.perf_counter()
+
+    agent = email_watcher.EmailAgent(max_concurrency=args.concurrency, pipeline_workers=args.pipeline_workers)
+    stop = asyncio.Event()
+    t0 = time.perf_counter()
+    runner = asyncio.create_task(agent.run(stop))
+
+    backlog = args.accounts * args.backlog
+    fast_backlog = (args.accounts - args.slow) * args.backlog
+    fast_done = None
+    while len(processed) < backlog and time.perf_counter() - t0 < args.timeout:
+        if fast_done is None and sum(1 for k in processed if int(k.split("-")[1]) >= args.slow) >= fast_backlog:
+            fast_done = time.perf_counter() - t0
+        await asyncio.sleep(0.01)
+    drain = time.perf_counter() - t0
+
+    # Mail arriving while the agent runs
+    for n in range(args.live):
+        i = random.randrange(args.slow, args.accounts) if args.accounts > args.slow else 0
+        name = f"live-{i}-{n}.pdf"
+        sent[name] = time.perf_counter()
+        mock.append(f"user{i}", invoice_email(i, name))
+        await asyncio.sleep(args.live_gap_ms / 1000)
+    deadline = time.perf_counter() + args.timeout
+    while len(processed) < backlog + args.live and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+    stop.set()
+    await runner
+    await mock.stop()
+
+    latencies = [processed[k] - sent[k] for k in processed if k.startswith("live-")]
+    print(f"{args.accounts} account(s) ({args.slow} slow at {args.slow_ms}ms/command), "
+          f"IDLE {'off' if args.no_idle else 'on'}, concurrency {args.concurrency}, fetch strategy {args.strategy}")
+    print(f"backlog   {len(processed) - len(latencies)}/{backlog} message(s) in {drain:.2f}s"
+          + (f" (fast accounts done after {fast_done:.2f}s)" if fast_done is not None and args.slow else ""))
+    if latencies:
+        print(f"live      {len(latencies)}/{args.live} message(s), latency p50 {statistics.median(latencies) * 1000:.0f}ms "
+              f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms max {max(latencies) * 1000:.0f}ms")
+    messages = backlog + args.live
+    total = sum(b.bytes_sent for b in mock.accounts.values())
+    print(f"imap      {total / 1024:.0f} KiB sent by the server ({total / max(messages, 1) / 1024:.1f} KiB/message)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--backlog", type=int, default=2, help="messages waiting per account at start")
+    parser.add_argument("--live", type=int, default=50, help="messages delivered while the agent runs")
+    parser.add_argument("--live-gap-ms", type=float, default=20)
+    parser.add_argument("--slow", type=int, default=3, help="accounts on a slow server")
+    parser.add_argument("--slow-ms", type=float, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=5, help="per-command latency of the others")
+    parser.add_argument("--no-idle", action="store_true")
+    parser.add_argument("--poll-interval", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=20, help="EMAIL_MAX_CONCURRENCY")
+    parser.add_argument("--pipeline-workers", type=int, default=8)
+    parser.add_argument("--pipeline-ms", type=float, default=20)
+    parser.add_argument("--strategy", choices=["parts", "full"], default="parts", help="EMAIL_FETCH_STRATEGY")
+    parser.add_argument("--html-kb", type=int, default=200, help="HTML alternative body per message")
+    parser.add_argument("--attachment-kb", type=int, default=100)
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(main(parser.parse_args()))
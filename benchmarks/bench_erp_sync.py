@@ -0,0 +1,115 @@
+# benchmarks/bench_erp_sync.py
+"""
+ERP push throughput and retry behaviour against benchmarks/mock_zoho.py.
+
+Invoices are saved with erp_sync=True (so they land in the outbox the way the
+pipeline writes them), then the outbox dispatcher pushes them to an in-process
+mock Zoho until every row is synced or dead. Reports invoices/s, Zoho calls per
+endpoint, 429s/5xx seen, retries and the governor's view of the limits.
+
+    # Zoho throttles at 300/min, governor off: expect 429s and Retry-After waits
+    python benchmarks/bench_erp_sync.py --invoices 500 --customers 40 --rate-per-minute 300
+
+    # governor below Zoho's limit: no 429s
+    python benchmarks/bench_erp_sync.py --invoices 500 --customers 40 --rate-per-minute 300 --governor-per-minute 290
+"""
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import argparse
+import tempfile
+import time
+
+from benchmarks.mock_zoho import start_mock, add_arguments, mock_options
+
+
+def make_invoices(n, customers):
+    return [
+        {
+            "invoice_number": f"INV-{i}",
+            "reference_number": f"REF-{i}",
+            "customer_name": f"Customer {i % customers}",
+            "email": f"billing{i % customers}@example.com",
+            "invoice_date": "2025-01-15",
+            "total": 200.0,
+            "line_items": [
+                {"description": "Toner cartridge", "quantity": 1, "rate": 150.0},
+                {"description": "A4 paper", "quantity": 1, "rate": 50.0},
+            ],
+        }
+        for i in range(n)
+    ]
+
+
+def configure(args, base_url):
+    """Environment for the backend modules; must run before they are imported."""
+    os.environ.update({
+        "INVOICE_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="bench_erp_"), "erp.db"),
+        "ZOHO_BASE_URL": f"{base_url}/books/v3",
+        "ZOHO_TOKEN_URL": f"{base_url}/oauth/v2/token",
+        "ZOHO_CLIENT_ID": "bench",
+        "ZOHO_CLIENT_SECRET": "bench",
+        "ZOHO_REFRESH_TOKEN": "bench",
+        "ZOHO_ORG_ID": "bench",
+        "ZOHO_RATE_PER_MINUTE": str(args.governor_per_minute),
+        "ZOHO_RATE_PER_DAY": str(10 ** 9),
+        "ZOHO_RATE_WAIT_SECONDS": str(args.governor_wait),
+        "ERP_OUTBOX_WORKERS": str(args.workers),
+        "ERP_OUTBOX_BATCH": str(args.batch),
+        "ERP_OUTBOX_POLL_INTERVAL": "0.2",
+        "ERP_BACKOFF_BASE": str(args.backoff_base),
+        "ERP_MAX_ATTEMPTS": str(args.max_attempts),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=300)
+    parser.add_argument("--customers", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=4, help="ERP_OUTBOX_WORKERS")
+    parser.add_argument("--batch", type=int, default=50, help="ERP_OUTBOX_BATCH")
+    parser.add_argument("--governor-per-minute", type=float, default=10 ** 6, help="ZOHO_RATE_PER_MINUTE (default: off)")
+    parser.add_argument("--governor-wait", type=float, default=5, help="ZOHO_RATE_WAIT_SECONDS")
+    parser.add_argument("--backoff-base", type=float, default=1, help="ERP_BACKOFF_BASE seconds")
+    parser.add_argument("--max-attempts", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=300, help="give up after this many seconds")
+    add_arguments(parser)
+    parser.set_defaults(retry_after=2)
+    args = parser.parse_args()
+
+    server, base_url = start_mock(**mock_options(args))
+    configure(args, base_url)
+
+    from backend import db, erp_outbox, erp_governor  # noqa: E402  (must see the env first)
+
+    db.init_db()
+    for invoice in make_invoices(args.invoices, args.customers):
+        db.save_invoice_to_db(invoice, 1, erp_sync=True)
+
+    print(f"{args.invoices} invoice(s) for {args.customers} customer(s), {args.workers} worker(s), "
+          f"mock latency {args.latency_ms}ms, Zoho limit {args.rate_per_minute or 'off'}/min, "
+          f"fail rate {args.fail_rate:.0%}")
+
+    t0 = time.perf_counter()
+    erp_outbox.start_outbox_dispatcher()
+    while time.perf_counter() - t0 < args.timeout:
+        counts = erp_outbox.outbox_counts()
+        if not counts.get("pending") and not counts.get("in_flight"):
+            break
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - t0
+    erp_outbox.stop_outbox_dispatcher()
+
+    counts = erp_outbox.outbox_counts()
+    attempts = db.get_conn().execute("SELECT COALESCE(SUM(attempts), 0) FROM erp_outbox").fetchone()[0]
+    synced = counts.get("synced", 0)
+    zoho = server.zoho.stats()
+    server.shutdown()
+
+    print(f"outbox    {counts}")
+    print(f"elapsed   {elapsed:.2f}s -> {synced / elapsed:.1f} invoices/s ({synced / elapsed * 60:.0f}/min)")
+    print(f"attempts  {attempts} for {args.invoices} invoice(s) ({attempts - args.invoices} retries)")
+    print(f"zoho      {zoho['requests']}")
+    print(f"          {zoho['contacts']} contact(s) created, {zoho['invoices']} invoice(s) created")
+    print(f"governor  {erp_governor.headroom()}")
@@ -0,0 +1,77 @@
+# benchmarks/bench_folder_backlog.py
+"""
+Time the folder watcher's startup catch-up scan (agents/folder_watcher.py).
+
+WATCH_DIR gets --files invoices dropped while the agent was "down"; the
+ledger already holds --history rows for files processed earlier (moved to
+done/) plus --unchanged files still in the folder that it finished before a
+crash. Only the new files should be queued.
+
+    python benchmarks/bench_folder_backlog.py --files 5000 --history 100000
+"""
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import argparse
+import tempfile
+import time
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_folder_")
+WATCH_DIR = os.path.join(TMP_DIR, "incoming")
+os.environ["INVOICE_DB_PATH"] = os.path.join(TMP_DIR, "folder.db")
+os.environ["FOLDER_WATCH_DIR"] = WATCH_DIR
+
+from backend import db  # noqa: E402  (must see INVOICE_DB_PATH first)
+from agents import folder_watcher  # noqa: E402
+
+
+class CollectingPool:
+    """Stands in for FolderWorkerPool: records what would be queued."""
+
+    def __init__(self):
+        self.queued = []
+
+    def submit(self, path, closed=False):
+        self.queued.append(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000, help="new files in the folder")
+    parser.add_argument("--unchanged", type=int, default=500, help="finished files never moved out")
+    parser.add_argument("--history", type=int, default=100_000, help="ledger rows for earlier files")
+    args = parser.parse_args()
+
+    db.init_db()
+    os.makedirs(WATCH_DIR)
+    for i in range(args.files + args.unchanged):
+        with open(os.path.join(WATCH_DIR, f"invoice_{i}.pdf"), "wb") as f:
+            f.write(b"%PDF-1.4 " + str(i).encode())
+
+    now = time.time()
+    rows = [
+        (os.path.join(WATCH_DIR, f"old_{i}.pdf"), 100, 0, None, "done", i, None, now)
+        for i in range(args.history)
+    ]
+    for i in range(args.files, args.files + args.unchanged):
+        path = os.path.join(WATCH_DIR, f"invoice_{i}.pdf")
+        st = os.stat(path)
+        rows.append((path, st.st_size, st.st_mtime_ns, None, "done", i, None, now))
+    conn = db.get_conn()
+    with conn:
+        conn.executemany("INSERT INTO folder_ledger VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    t0 = time.perf_counter()
+    to_process, to_file = folder_watcher.scan_backlog()
+    scan = time.perf_counter() - t0
+
+    pool = CollectingPool()
+    t0 = time.perf_counter()
+    queued = folder_watcher.reconcile(pool)
+    total = time.perf_counter() - t0
+
+    entries = args.files + args.unchanged
+    print(f"{entries} file(s) in folder, {len(rows)} ledger row(s)")
+    print(f"scan       {scan:.3f}s  ({entries / scan:,.0f} entries/s) -> {len(to_process)} new, {len(to_file)} finished")
+    print(f"reconcile  {total:.3f}s  queued {queued}, moved {len(to_file)} to done/")
@@ -0,0 +1,116 @@
+# benchmarks/bench_indexes.py
+"""
+Chatbot query latency with and without the migration-1 indexes.
+
+For each size a fresh DB is filled with synthetic invoices (2 line items each,
+spread over 50 users), the hot queries are timed on the bare tables, then
+only the indexes of migration 1 (db.MIGRATIONS[0]) are created and the same
+queries are timed again. Later migrations (FTS triggers, fingerprints, ...)
+are left out so the numbers isolate those indexes.
+
+    python benchmarks/bench_indexes.py --sizes 10000 100000 1000000
+"""
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from backend import db
+
+USERS = 50
+CUSTOMERS = [f"Customer {i:04d}" for i in range(2000)]
+
+QUERIES = {
+    "user join": (
+        "SELECT invoices.invoice_number, invoice_items.description, invoice_items.quantity, invoice_items.rate "
+        "FROM invoices LEFT JOIN invoice_items ON invoices.id = invoice_items.invoice_id "
+        "WHERE invoices.user_id = ? LIMIT 1050",
+        lambda rnd: (rnd.randint(1, USERS),),
+    ),
+    "user + date": (
+        "SELECT SUM(invoices.total) FROM invoices WHERE invoices.user_id = ? AND invoices.invoice_date = ?",
+        lambda rnd: (rnd.randint(1, USERS), f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"),
+    ),
+    "user + date range": (
+        "SELECT SUM(invoice_items.quantity * invoice_items.rate) FROM invoices "
+        "LEFT JOIN invoice_items ON invoices.id = invoice_items.invoice_id "
+        "WHERE invoices.user_id = ? AND invoices.invoice_date BETWEEN '2025-03-01' AND '2025-03-07'",
+        lambda rnd: (rnd.randint(1, USERS),),
+    ),
+    "user + customer": (
+        "SELECT COUNT(*), SUM(invoices.total) FROM invoices WHERE invoices.user_id = ? AND invoices.customer_name = ?",
+        lambda rnd: (rnd.randint(1, USERS), rnd.choice(CUSTOMERS)),
+    ),
+}
+
+
+def build(path, n, rnd):
+    conn = sqlite3.connect(path)
+    conn.execute(db.CREATE_TABLE_USERS)
+    conn.execute(db.CREATE_TABLE_INVOICES)
+    conn.execute(db.CREATE_TABLE_ITEMS)
+
+    batch = 50_000
+    for start in range(1, n + 1, batch):
+        ids = range(start, min(start + batch, n + 1))
+        conn.executemany(
+            "INSERT INTO invoices (id, user_id, invoice_number, reference_number, customer_name, invoice_date, total) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (i, rnd.randint(1, USERS), f"INV-{i}", f"REF-{i}", rnd.choice(CUSTOMERS),
+                 f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}", round(rnd.uniform(10, 5000), 2))
+                for i in ids
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO invoice_items (invoice_id, description, quantity, rate) VALUES (?, ?, ?, ?)",
+            ((i, f"Item {i % 997}", rnd.randint(1, 10), round(rnd.uniform(1, 500), 2)) for i in ids for _ in range(2)),
+        )
+        conn.commit()
+    return conn
+
+
+def time_queries(conn, repeat, seed):
+    rnd = random.Random(seed)
+    out = {}
+    for name, (sql, params) in QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            args = params(rnd)
+            t0 = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            samples.append((time.perf_counter() - t0) * 1000)
+        out[name] = statistics.median(samples)
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20, help="runs per query (median reported)")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_idx_")
+    print(f"{'invoices':>10}  {'query':<18} {'no index ms':>12} {'indexed ms':>11} {'speedup':>8}")
+
+    for n in args.sizes:
+        path = os.path.join(tmp_dir, f"invoices_{n}.db")
+        conn = build(path, n, random.Random(n))
+
+        before = time_queries(conn, args.repeat, seed=1)
+        for statement in db.MIGRATIONS[0]:
+            conn.execute(statement)
+        conn.execute("ANALYZE")
+        after = time_queries(conn, args.repeat, seed=1)
+
+        for name in QUERIES:
+            speedup = before[name] / after[name] if after[name] else float("inf")
+            print(f"{n:>10}  {name:<18} {before[name]:>12.3f} {after[name]:>11.3f} {speedup:>7.1f}x")
+        conn.close()
+        os.remove(path)
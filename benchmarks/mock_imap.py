@@ -0,0 +1,333 @@
+# benchmarks/mock_imap.py
+"""
+Local IMAP stand-in for the email agent (agents/email_watcher.py).
+
+An asyncio server that speaks the part of IMAP4rev1 the agent uses: LOGIN,
+CAPABILITY, SELECT, UID SEARCH, UID FETCH (RFC822, BODY[section],
+BODYSTRUCTURE, FLAGS), UID STORE, NOOP, IDLE and LOGOUT. Each account has one
+INBOX; append() delivers a message and wakes any IDLE connection with
+"* n EXISTS". Per-command latency (globally or per account, to simulate one
+slow server) and IDLE support are configurable, and bytes sent are counted
+per account.
+
+Accounts are reached as imap://127.0.0.1:<port> (plain text, no TLS):
+
+    python benchmarks/mock_imap.py --port 1143 --accounts 5
+"""
+import argparse
+import asyncio
+import email
+import re
+import time
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+_COMMAND = re.compile(rb"^(\S+) (?:UID )?(\S+) ?(.*)$", re.I)
+_SECTION = re.compile(r"BODY(\.PEEK)?\[([\d.]*)\]")
+
+
+def make_invoice_email(to: str, filename: str = "invoice.pdf", attachment: bytes = b"%PDF-1.4 mock invoice",
+                       html_padding: int = 0) -> bytes:
+    """A message with a short body, optional HTML bulk, and one attachment."""
+    msg = EmailMessage()
+    msg["From"] = "billing@vendor.example"
+    msg["To"] = to
+    msg["Subject"] = f"Invoice {filename}"
+    msg.set_content("Please find the invoice attached.")
+    if html_padding:
+        msg.add_alternative("<html><body>" + "<p>invoice</p>" * (html_padding // 15) + "</body></html>", subtype="html")
+    maintype, subtype = ("application", "pdf") if filename.lower().endswith(".pdf") else ("image", "png")
+    msg.add_attachment(attachment, maintype=maintype, subtype=subtype, filename=filename)
+    return msg.as_bytes()
+
+
+def _quoted(value) -> str:
+    if value is None:
+        return "NIL"
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _param_list(pairs) -> str:
+    return "(" + " ".join(f"{_quoted(k)} {_quoted(v)}" for k, v in pairs) + ")" if pairs else "NIL"
+
+
+def _payload(part) -> bytes:
+    return part.get_payload(decode=False).encode("utf-8", "surrogateescape")
+
+
+def bodystructure(part) -> str:
+    """RFC 3501 BODYSTRUCTURE (with disposition extension data) of an email.message.Message."""
+    if part.is_multipart():
+        children = "".join(bodystructure(child) for child in part.get_payload())
+        return f"({children} {_quoted(part.get_content_subtype())} {_param_list([('boundary', part.get_boundary())])} NIL NIL NIL)"
+
+    payload = _payload(part)
+    params = (part.get_params() or [])[1:]
+    fields = (
+        f"{_quoted(part.get_content_maintype())} {_quoted(part.get_content_subtype())} {_param_list(params)} "
+        f"NIL NIL {_quoted(part.get('Content-Transfer-Encoding', '7bit'))} {len(payload)}"
+    )
+    if part.get_content_maintype() == "text":
+        fields += " " + str(payload.count(b"\n"))
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_param("filename", header="content-disposition")
+        if isinstance(filename, tuple):   # RFC 2231 value, sent on as filename*=charset'lang'%XX
+            charset, language, value = filename
+            params = [("filename*", f"{charset}'{language or ''}'{quote(value.encode('latin-1'))}")]
+        else:
+            params = [("filename", filename)] if filename else []
+        disposition = f"({_quoted(disposition)} {_param_list(params)})"
+    return f"({fields} NIL {disposition or 'NIL'} NIL NIL)"
+
+
+def section_bytes(message, section: str) -> bytes:
+    """Encoded body of part "2.1" etc. (what BODY[2.1] returns)."""
+    node = message
+    for number in section.split("."):
+        if node.is_multipart():
+            node = node.get_payload()[int(number) - 1]
+    return _payload(node)
+
+
+def parse_set(spec: str, largest: int) -> List[int]:
+    """IMAP sequence set ("1,4:6,9:*") → sorted numbers, with * = largest."""
+    numbers = set()
+    for piece in spec.split(","):
+        if ":" in piece:
+            a, b = piece.split(":")
+            a = largest if a == "*" else int(a)
+            b = largest if b == "*" else int(b)
+            numbers.update(range(min(a, b), max(a, b) + 1))
+        else:
+            numbers.add(largest if piece == "*" else int(piece))
+    return sorted(numbers)
+
+
+class Mailbox:
+    def __init__(self, password: str, latency_ms: Optional[float] = None):
+        self.password = password
+        self.latency_ms = latency_ms
+        self.uidvalidity = int(time.time())
+        self.uidnext = 1
+        self.messages: Dict[int, Dict] = {}   # uid -> {"raw", "flags"}
+        self.idlers = set()                    # writers currently in IDLE
+        self.bytes_sent = 0
+
+
+class MockIMAP:
+    def __init__(self, latency_ms: float = 0.0, idle: bool = True):
+        self.latency_ms = latency_ms
+        self.idle = idle
+        self.accounts: Dict[str, Mailbox] = {}
+        self.server = None
+        self.sessions = set()
+
+    def add_account(self, user: str, password: str, latency_ms: Optional[float] = None) -> Mailbox:
+        self.accounts[user] = Mailbox(password, latency_ms)
+        return self.accounts[user]
+
+    def append(self, user: str, raw: bytes) -> int:
+        """Deliver a message; IDLE connections for the account are notified."""
+        box = self.accounts[user]
+        uid = box.uidnext
+        box.uidnext += 1
+        box.messages[uid] = {"raw": raw, "flags": set()}
+        for writer in list(box.idlers):
+            writer.write(f"* {len(box.messages)} EXISTS\r\n".encode())
+        return uid
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.start_server(self._session, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for task in self.sessions:
+            task.cancel()
+        await asyncio.gather(*self.sessions, return_exceptions=True)
+        await self.server.wait_closed()
+
+    # ---------------- SESSION ----------------
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        state = {"user": None, "exists": 0}   # exists: message count this client has been told about
+        task = asyncio.current_task()
+        self.sessions.add(task)
+
+        def send(data: bytes):
+            if state["user"]:
+                self.accounts[state["user"]].bytes_sent += len(data)
+            writer.write(data)
+
+        send(b"* OK mock IMAP4rev1 ready\r\n")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                m = _COMMAND.match(line.rstrip(b"\r\n"))
+                if not m:
+                    send(b"* BAD unparsable command\r\n")
+                    continue
+                tag, command, args = m.group(1).decode(), m.group(2).decode().upper(), m.group(3).decode()
+
+                box = self.accounts.get(state["user"])
+                latency = box.latency_ms if box and box.latency_ms is not None else self.latency_ms
+                if latency:
+                    await asyncio.sleep(latency / 1000)
+
+                if command == "LOGOUT":
+                    send(f"* BYE\r\n{tag} OK LOGOUT completed\r\n".encode())
+                    break
+                if command == "IDLE" and box:
+                    await self._idle(reader, writer, box, tag, send, state)
+                    continue
+                try:
+                    reply = self._handle(state, tag, command, args)
+                    # Like real servers, report mail that arrived since the last response
+                    box = self.accounts.get(state["user"])
+                    if box and command != "SELECT" and len(box.messages) != state["exists"]:
+                        send(f"* {len(box.messages)} EXISTS\r\n".encode())
+                    if box:
+                        state["exists"] = len(box.messages)
+                    send(reply)
+                except Exception as e:
+                    send(f"{tag} BAD {e}\r\n".encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.sessions.discard(task)
+            for box in self.accounts.values():
+                box.idlers.discard(writer)
+            writer.close()
+
+    async def _idle(self, reader, writer, box: Mailbox, tag: str, send, state: Dict):
+        send(b"+ idling\r\n")
+        if len(box.messages) != state["exists"]:
+            send(f"* {len(box.messages)} EXISTS\r\n".encode())
+        box.idlers.add(writer)
+        try:
+            await writer.drain()
+            line = await reader.readline()
+        finally:
+            box.idlers.discard(writer)
+            state["exists"] = len(box.messages)
+        if line.strip().upper() == b"DONE":
+            send(f"{tag} OK IDLE terminated\r\n".encode())
+        else:
+            send(f"{tag} BAD expected DONE\r\n".encode())
+        await writer.drain()
+
+    def _handle(self, state: Dict, tag: str, command: str, args: str) -> bytes:
+        if command == "CAPABILITY":
+            caps = "IMAP4rev1" + (" IDLE" if self.idle else "")
+            return f"* CAPABILITY {caps}\r\n{tag} OK CAPABILITY completed\r\n".encode()
+        if command == "NOOP":
+            return f"{tag} OK NOOP completed\r\n".encode()
+        if command == "LOGIN":
+            user, password = [re.sub(r'\\(.)', r'\1', v) for v in re.findall(r'"((?:[^"\\]|\\.)*)"', args)]
+            box = self.accounts.get(user)
+            if not box or box.password != password:
+                return f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials\r\n".encode()
+            state["user"] = user
+            return f"{tag} OK LOGIN completed\r\n".encode()
+
+        box = self.accounts.get(state["user"])
+        if box is None:
+            return f"{tag} NO not authenticated\r\n".encode()
+
+        if command == "SELECT":
+            return (
+                f"* {len(box.messages)} EXISTS\r\n* 0 RECENT\r\n"
+                f"* OK [UIDVALIDITY {box.uidvalidity}] UIDs valid\r\n"
+                f"* OK [UIDNEXT {box.uidnext}] Predicted next UID\r\n"
+                f"{tag} OK [READ-WRITE] SELECT completed\r\n"
+            ).encode()
+
+        if command == "SEARCH":
+            criteria = args.upper().split()
+            uids = sorted(box.messages)
+            if "UNSEEN" in criteria:
+                uids = [u for u in uids if "\\Seen" not in box.messages[u]["flags"]]
+            if "UID" in criteria:
+                wanted = set(parse_set(criteria[criteria.index("UID") + 1], max(uids or [0])))
+                uids = [u for u in uids if u in wanted]
+            return f"* SEARCH {' '.join(map(str, uids))}\r\n{tag} OK SEARCH completed\r\n".encode()
+
+        if command == "FETCH":
+            spec, items = args.split(" ", 1)
+            return self._fetch(box, spec, items.upper()) + f"{tag} OK FETCH completed\r\n".encode()
+
+        if command == "STORE":
+            spec, op, flags = args.split(" ", 2)
+            flags = set(flags.strip("()").split())
+            for uid in parse_set(spec, max(box.messages or [0])):
+                if uid in box.messages:
+                    if op.upper().startswith("+"):
+                        box.messages[uid]["flags"] |= flags
+                    else:
+                        box.messages[uid]["flags"] -= flags
+            return f"{tag} OK STORE completed\r\n".encode()
+
+        return f"{tag} BAD unsupported command {command}\r\n".encode()
+
+    @staticmethod
+    def _parsed(message: Dict):
+        if "parsed" not in message:
+            message["parsed"] = email.message_from_bytes(message["raw"])
+        return message["parsed"]
+
+    def _fetch(self, box: Mailbox, spec: str, items: str) -> bytes:
+        out = b""
+        uids = sorted(box.messages)
+        for uid in parse_set(spec, max(uids or [0])):
+            message = box.messages.get(uid)
+            if message is None:
+                continue
+            seq = uids.index(uid) + 1
+            parts = [f"UID {uid}".encode()]
+            if "FLAGS" in items:
+                parts.append(f"FLAGS ({' '.join(sorted(message['flags']))})".encode())
+            raw = message["raw"]
+            if "BODYSTRUCTURE" in items:
+                parts.append(f"BODYSTRUCTURE {bodystructure(self._parsed(message))}".encode())
+            if "RFC822" in items:
+                parts.append(f"RFC822 {{{len(raw)}}}\r\n".encode() + raw)
+                message["flags"].add("\\Seen")
+            for peek, section in _SECTION.findall(items):
+                data = raw if not section else section_bytes(self._parsed(message), section)
+                parts.append(f"BODY[{section}] {{{len(data)}}}\r\n".encode() + data)
+                if not peek:
+                    message["flags"].add("\\Seen")
+            out += f"* {seq} FETCH (".encode() + b" ".join(parts) + b")\r\n"
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--accounts", type=int, default=3, help="user0..userN-1, password 'secret'")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--no-idle", action="store_true", help="do not advertise IDLE")
+    args = parser.parse_args()
+
+    async def serve():
+        mock = MockIMAP(args.latency_ms, idle=not args.no_idle)
+        for i in range(args.accounts):
+            mock.add_account(f"user{i}", "secret")
+            mock.append(f"user{i}", make_invoice_email(f"user{i}@example.com"))
+        port = await mock.start(args.host, args.port)
+        print(f"Mock IMAP on imap://{args.host}:{port}, accounts user0..user{args.accounts - 1} / secret")
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+# benchmarks/mock_zoho.py
+"""
+Local stand-in for the Zoho Books endpoints backend/erp_integration.py and
+backend/zoho_auth.py use, so the ERP path can be run and benchmarked without
+real org credentials:
+
+    POST /oauth/v2/token          refresh-token exchange
+    GET  /books/v3/contacts       paginated (page, per_page, sort_column, sort_order)
+    POST /books/v3/contacts       create a contact
+    POST /books/v3/invoices       create an invoice
+    GET  /stats                   request counters (not a Zoho endpoint)
+
+Latency, a per-minute rate limit (429 + Retry-After), random 5xx failures and
+token expiry are configurable. Point the app at it with:
+
+    python benchmarks/mock_zoho.py --port 8765 --latency-ms 80 --rate-per-minute 100
+    ZOHO_BASE_URL=http://127.0.0.1:8765/books/v3 \
+    ZOHO_TOKEN_URL=http://127.0.0.1:8765/oauth/v2/token \
+    ZOHO_CLIENT_ID=x ZOHO_CLIENT_SECRET=x ZOHO_REFRESH_TOKEN=x uvicorn backend.main:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def zoho_time(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone(timedelta(hours=5, minutes=30))).strftime("%Y-%m-%dT%H:%M:%S%z")
+
+
+class MockZoho:
+    """State shared by all request threads."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, rate_per_minute=0, retry_after=60,
+                 fail_rate=0.0, token_ttl=3600, contacts=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_per_minute = rate_per_minute
+        self.retry_after = retry_after
+        self.fail_rate = fail_rate
+        self.token_ttl = token_ttl
+
+        self.lock = threading.Lock()
+        self.window = []            # timestamps of accepted API calls in the last minute
+        self.tokens = {}            # access_token -> expires_at
+        self.contacts = []
+        self.invoices = []
+        self.counts = {}
+        for i in range(contacts):
+            self.add_contact(f"Seed Customer {i}", f"seed{i}@example.com")
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def add_contact(self, name, email):
+        contact = {
+            "contact_id": uuid.uuid4().hex[:18],
+            "contact_name": name,
+            "email": email,
+            "last_modified_time": zoho_time(time.time()),
+        }
+        with self.lock:
+            self.contacts.append(contact)
+        return contact
+
+    def throttled(self) -> bool:
+        """Sliding one-minute window; True when this call is over the limit."""
+        if not self.rate_per_minute:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            self.window = [t for t in self.window if now - t < 60]
+            if len(self.window) >= self.rate_per_minute:
+                return True
+            self.window.append(now)
+        return False
+
+    def issue_token(self):
+        token = f"1000.{uuid.uuid4().hex}"
+        with self.lock:
+            self.tokens[token] = time.time() + self.token_ttl
+        return token
+
+    def token_valid(self, header: str) -> bool:
+        token = (header or "").replace("Zoho-oauthtoken", "").strip()
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.counts), "contacts": len(self.contacts), "invoices": len(self.invoices)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    zoho: MockZoho = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def simulate(self, name) -> bool:
+        """Latency, auth, rate limit and failure injection. False if a response was already sent."""
+        zoho = self.zoho
+        zoho.count(name)
+        delay = zoho.latency_ms + random.uniform(-zoho.jitter_ms, zoho.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        if not zoho.token_valid(self.headers.get("Authorization")):
+            zoho.count("401")
+            self.reply(401, {"code": 57, "message": "You are not authorized to perform this operation"})
+            return False
+        if zoho.throttled():
+            zoho.count("429")
+            self.reply(429, {"code": 44, "message": "API call limit exceeded"},
+                       {"Retry-After": str(zoho.retry_after)})
+            return False
+        if zoho.fail_rate and random.random() < zoho.fail_rate:
+            zoho.count("500")
+            self.reply(500, {"code": 1, "message": "Injected failure"})
+            return False
+        return True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        if url.path == "/stats":
+            return self.reply(200, self.zoho.stats())
+        if url.path != "/books/v3/contacts":
+            return self.reply(404, {"code": 5, "message": "Invalid URL"})
+        if not self.simulate("contacts.list"):
+            return
+
+        page = int(query.get("page", 1))
+        per_page = min(int(query.get("per_page", 200)), 200)
+        with self.zoho.lock:
+            contacts = list(self.zoho.contacts)
+        if query.get("sort_column") == "last_modified_time":
+            contacts.sort(key=lambda c: c["last_modified_time"], reverse=query.get("sort_order") == "D")
+        chunk = contacts[(page - 1) * per_page: page * per_page]
+        self.reply(200, {
+            "code": 0,
+            "contacts": chunk,
+            "page_context": {"page": page, "per_page": per_page, "has_more_page": page * per_page < len(contacts)},
+        })
+
+    def do_POST(self):
+        url = urlparse(self.path)
+
+        if url.path == "/oauth/v2/token":
+            self.zoho.count("oauth.token")
+            query = parse_qs(url.query)
+            if not query.get("refresh_token"):
+                return self.reply(200, {"error": "invalid_code"})
+            return self.reply(200, {
+                "access_token": self.zoho.issue_token(),
+                "expires_in": self.zoho.token_ttl,
+                "token_type": "Bearer",
+            })
+
+        if url.path == "/books/v3/contacts":
+            if not self.simulate("contacts.create"):
+                return
+            body = self.read_json()
+            contact = self.zoho.add_contact(body.get("contact_name", ""), body.get("email"))
+            return self.reply(201, {"code": 0, "message": "The contact has been added.", "contact": contact})
+
+        if url.path == "/books/v3/invoices":
+            if not self.simulate("invoices.create"):
+                return
+            body = self.read_json()
+            if not body.get("customer_id") or not body.get("line_items"):
+                return self.reply(400, {"code": 4, "message": "Invalid value passed for customer_id or line_items"})
+            with self.zoho.lock:
+                number = f"INV-{len(self.zoho.invoices) + 1:06d}"
+                invoice = {"invoice_id": uuid.uuid4().hex[:18], "invoice_number": number, **body}
+                self.zoho.invoices.append(invoice)
+            return self.reply(201, {"code": 0, "message": "The invoice has been created.", "invoice": invoice})
+
+        self.reply(404, {"code": 5, "message": "Invalid URL"})
+
+
+def start_mock(host="127.0.0.1", port=0, **options):
+    """Run the mock in a background thread. Returns (server, base_url); stop with server.shutdown()."""
+    zoho = MockZoho(**options)
+    handler = type("BoundHandler", (Handler,), {"zoho": zoho})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.zoho = zoho
+    threading.Thread(target=server.serve_forever, name="mock-zoho", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--rate-per-minute", type=int, default=0, help="429 above this many calls/min (0 = off)")
+    parser.add_argument("--retry-after", type=int, default=60, help="Retry-After seconds sent with 429")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--token-ttl", type=int, default=3600)
+    parser.add_argument("--contacts", type=int, default=0, help="pre-seeded contacts")
+
+
+def mock_options(args):
+    return dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_per_minute=args.rate_per_minute,
+                retry_after=args.retry_after, fail_rate=args.fail_rate, token_ttl=args.token_ttl,
+                contacts=args.contacts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server, base = start_mock(args.host, args.port, **mock_options(args))
+    print(f"Mock Zoho listening on {base}")
+    print(f"  ZOHO_BASE_URL={base}/books/v3")
+    print(f"  ZOHO_TOKEN_URL={base}/oauth/v2/token")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,11 +1,14 @@
 
 import streamlit as st
 import requests
+import json
 import time
 
 BACKEND_BASE = "http://127.0.0.1:8000"
 UPLOAD_URL = f"{BACKEND_BASE}/process-invoice/"
+JOBS_URL = f"{BACKEND_BASE}/jobs"
 CHAT_URL = f"{BACKEND_BASE}/chatbot/query/"
+CHAT_STREAM_URL = f"{BACKEND_BASE}/chatbot/query/stream"
 REGISTER_URL = f"{BACKEND_BASE}/auth/register"
 LOGIN_URL = f"{BACKEND_BASE}/auth/login"
 
@@ -108,7 +111,7 @@ if uploaded:
     if st.session_state["last_uploaded_file_hash"] == file_hash:
         st.info("This invoice was already processed. Not sending again.")
     else:
-        with st.spinner("Processing your invoice..."):
+        with st.spinner("Uploading your invoice..."):
             files = {"file": (uploaded.name, file_bytes, uploaded.type)}
 
             try:
@@ -118,14 +121,33 @@ if uploaded:
                 st.error(f"Request failed: {e}")
                 st.stop()
 
-        if res.status_code == 200:
+        if res.status_code != 200:
+            st.error(data.get("detail", res.text))
+            st.stop()
+
+        # Upload only queues a job → poll until the pipeline finishes
+        progress = st.empty()
+        job = data
+        while job.get("status") in ("queued", "running"):
+            progress.info(f"Processing your invoice... ({job.get('stage') or job.get('status')})")
+            time.sleep(1)
+            try:
+                job = requests.get(f"{JOBS_URL}/{data['job_id']}", headers=headers_auth()).json()
+            except Exception as e:
+                st.error(f"Request failed: {e}")
+                st.stop()
+        progress.empty()
+
+        if job.get("status") == "done":
             st.success("Invoice Processed Successfully!")
-            st.json(data)
+            st.json(job.get("result"))
 
             # Save hash so we never reprocess same invoice again
             st.session_state["last_uploaded_file_hash"] = file_hash
         else:
-            st.error(data.get("detail", res.text))
+            st.error(job.get("error") or job.get("detail") or "Processing failed")
+            if job.get("result"):
+                st.json(job["result"])
 
 
 # --------------------------------------------------------------------
@@ -147,14 +169,57 @@ for msg in st.session_state.messages:
 
 query = st.chat_input("Ask anything about your invoices...")
 
-def typing_effect(text):
+def iter_sse(res):
+    """Parse a text/event-stream response into (event, data) pairs."""
+    event, data_lines = "message", []
+    for line in res.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def stream_answer(question):
+    status = st.empty()
     placeholder = st.empty()
     typed = ""
-    for ch in text:
-        typed += ch
-        placeholder.markdown(f"**Bot:** {typed}")
-        time.sleep(0.004)
-    placeholder.markdown(f"**Bot:** {text}")
+
+    status.caption("Thinking...")
+    with requests.post(
+        CHAT_STREAM_URL,
+        json={"question": question},
+        headers=headers_auth(),
+        stream=True
+    ) as res:
+        if res.status_code != 200:
+            status.empty()
+            return f"Server returned: {res.text}"
+
+        for event, data in iter_sse(res):
+            if event == "sql":
+                status.caption("Generated SQL, fetching rows...")
+            elif event == "rows":
+                if data.get("fallback"):
+                    status.caption("SQL failed, reasoning over raw invoice data...")
+                else:
+                    status.caption(f"Fetched {data.get('row_count', 0)} row(s), writing answer...")
+            elif event == "token":
+                typed += data.get("text", "")
+                placeholder.markdown(f"**Bot:** {typed}")
+            elif event == "done":
+                typed = data.get("answer") or typed
+            elif event == "error":
+                typed = f"Error: {data.get('error')}"
+
+    status.empty()
+    placeholder.markdown(f"**Bot:** {typed}")
+    return typed or "No response from server"
 
 
 if query:
@@ -162,22 +227,9 @@ if query:
     st.markdown(f"**You:** {query}")
 
     try:
-        with st.spinner("Thinking..."):
-            res = requests.post(
-                CHAT_URL,
-                json={"question": query},
-                headers=headers_auth()
-            )
-
-            try:
-                data = res.json()
-                bot_reply = data.get("answer", "No response from server")
-            except:
-                bot_reply = f"Server returned: {res.text}"
-
+        bot_reply = stream_answer(query)
     except Exception as e:
         bot_reply = f"Error: {e}"
+        st.markdown(f"**Bot:** {bot_reply}")
 
-    typing_effect(bot_reply)
     st.session_state.messages.append({"role": "assistant", "content": bot_reply})
-
@@ -0,0 +1,41 @@
+# tests/conftest.py
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import tempfile
+
+# Before anything from backend/ reads its settings at import time
+_SCRATCH = tempfile.mkdtemp(prefix="invoice-tests-")
+os.environ.setdefault("GROQ_API_KEY", "test")
+os.environ["INVOICE_DB_PATH"] = os.path.join(_SCRATCH, "import.db")
+os.environ["ARTIFACT_DIR"] = os.path.join(_SCRATCH, "artifacts")
+os.environ["JOB_SPOOL_DIR"] = os.path.join(_SCRATCH, "jobs")
+
+import pytest
+
+from backend import artifact_store, db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh, migrated database per test (connections are keyed by DB_NAME)."""
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "invoices.db"))
+    monkeypatch.setattr(artifact_store, "ARTIFACT_DIR", str(tmp_path / "artifacts"))
+    db.init_db()
+    yield db.get_conn()
+    db.close_thread_connections()
+
+
+def make_invoice(customer="Acme Corp", reference="INV-1", items=(("Blue widget", 2, 5.0),), date="2024-03-01"):
+    """Validated invoice data, the shape save_invoice_to_db expects."""
+    line_items = [{"description": d, "quantity": q, "rate": r} for d, q, r in items]
+    return {
+        "invoice_number": reference,
+        "reference_number": reference,
+        "customer_name": customer,
+        "email": "billing@example.com",
+        "invoice_date": date,
+        "total": sum(q * r for _, q, r in items),
+        "line_items": line_items,
+    }
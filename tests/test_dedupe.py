@@ -0,0 +1,85 @@
+# tests/test_dedupe.py
+"""Uploading the same invoice twice stores it once (document fingerprints)."""
+import sqlite3
+
+import pytest
+
+from backend import pipeline
+from backend.db import save_invoice_to_db
+from backend.document import Document
+from backend.pipeline import process_document
+
+from conftest import make_invoice
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    """OCR returns the file's text; the LLM 'extracts' the invoice named in it."""
+    calls = {"ocr": 0}
+
+    def ocr(content, word_boxes=None, path=None):
+        calls["ocr"] += 1
+        return bytes(content).decode()
+
+    def extract(raw_text):
+        customer, reference = raw_text.split("|")[:2]
+        data = make_invoice(customer=customer, reference=reference)
+        data["items"] = data.pop("line_items")
+        return data, "{}"
+
+    monkeypatch.setattr(pipeline, "extract_text_from_image", ocr)
+    monkeypatch.setattr(pipeline, "classify_document_llm", lambda raw_text: "invoice")
+    monkeypatch.setattr(pipeline, "extract_fields_raw", extract)
+    return calls
+
+
+def _invoice_count(conn):
+    return conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+
+def test_same_file_twice_is_stored_once(database, fake_models):
+    first = process_document(Document.from_bytes(b"Acme Corp|INV-1", 1, "api", "a.pdf"))
+    second = process_document(Document.from_bytes(b"Acme Corp|INV-1", 1, "email", "a.pdf"))
+
+    assert first["status"] == second["status"] == "success"
+    assert "duplicate" not in first
+    assert second["duplicate"] is True
+    assert second["invoice_id"] == first["invoice_id"]
+    assert fake_models["ocr"] == 1          # the content hash short-circuits before OCR
+    assert _invoice_count(database) == 1
+
+
+def test_same_invoice_from_another_file_is_stored_once(database, fake_models):
+    first = process_document(Document.from_bytes(b"Acme Corp|INV-1", 1, "folder", "scan.pdf"))
+    # Different bytes, same customer / reference / date / total
+    second = process_document(Document.from_bytes(b"Acme Corp|INV-1|rescanned", 1, "email", "mail.pdf"))
+    third = process_document(Document.from_bytes(b"Acme Corp|INV-1|rescanned", 1, "api", "mail.pdf"))
+
+    assert second["duplicate"] is True and second["invoice_id"] == first["invoice_id"]
+    assert third["duplicate"] is True and third["invoice_id"] == first["invoice_id"]
+    assert fake_models["ocr"] == 2          # the alias row short-circuits the third copy
+    assert _invoice_count(database) == 1
+
+
+def test_duplicates_are_per_user(database, fake_models):
+    first = process_document(Document.from_bytes(b"Acme Corp|INV-1", 1, "api"))
+    other = process_document(Document.from_bytes(b"Acme Corp|INV-1", 2, "api"))
+
+    assert "duplicate" not in other
+    assert other["invoice_id"] != first["invoice_id"]
+    assert _invoice_count(database) == 2
+
+
+def test_documents_without_a_user_are_deduplicated(database, fake_models):
+    first = process_document(Document.from_bytes(b"Acme Corp|INV-1", None, "cli"))
+    second = process_document(Document.from_bytes(b"Acme Corp|INV-1", None, "cli"))
+
+    assert second["duplicate"] is True and second["invoice_id"] == first["invoice_id"]
+    assert _invoice_count(database) == 1
+
+
+def test_fingerprint_index_rejects_a_second_row_without_a_user(database):
+    save_invoice_to_db(make_invoice(), None, content_hash="h", invoice_key="k1")
+    with pytest.raises(sqlite3.IntegrityError):
+        save_invoice_to_db(make_invoice(reference="INV-2"), None, content_hash="h", invoice_key="k2")
+    assert _invoice_count(database) == 1
@@ -0,0 +1,78 @@
+# tests/test_erp_governor.py
+"""Zoho rate governor, throttled outbox pushes and the admin-only /erp/stats."""
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import erp_governor, erp_outbox
+from backend.db import save_invoice_to_db
+from backend.erp_governor import RateLimited
+
+from conftest import make_invoice
+
+
+def test_minute_budget_is_spent_then_rate_limited(database, monkeypatch):
+    monkeypatch.setattr(erp_governor, "ZOHO_RATE_PER_MINUTE", 2)
+    erp_governor.acquire(timeout=0)
+    erp_governor.acquire(timeout=0)
+
+    with pytest.raises(RateLimited) as e:
+        erp_governor.acquire(timeout=0)
+    assert 25 < e.value.retry_after <= 30                # one token refills in 60 / 2 seconds
+    assert erp_governor.headroom()["day_used"] == 2
+
+
+def test_zoho_429_blocks_every_caller(database):
+    erp_governor.acquire(timeout=0)
+    erp_governor.penalize(90)
+
+    with pytest.raises(RateLimited) as e:
+        erp_governor.acquire(timeout=0)
+    assert e.value.retry_after > 85
+    assert erp_governor.headroom()["blocked_for_seconds"] > 85
+
+
+def test_throttled_group_waits_without_using_attempts(database, monkeypatch):
+    invoice_ids = [save_invoice_to_db(make_invoice(reference=f"INV-{i}"), 1, erp_sync=True) for i in range(3)]
+    pushes = []
+
+    def push(data, customer_id):
+        pushes.append(data["reference_number"])
+        raise RateLimited("Zoho rate limit", 45)
+
+    monkeypatch.setattr(erp_outbox, "resolve_customer", lambda name, email: "c-1")
+    monkeypatch.setattr(erp_outbox, "push_invoice", push)
+    monkeypatch.setattr(erp_outbox, "ERP_MAX_ATTEMPTS", 2)
+
+    for _ in range(4):                                   # more throttles than ERP_MAX_ATTEMPTS
+        database.execute("UPDATE erp_outbox SET next_attempt_at = 0")
+        database.commit()
+        before = time.time()
+        assert erp_outbox.push_group(erp_outbox.claim_due()) == ["pending"] * 3
+
+    assert len(pushes) == 4                              # the rest of each group was not sent
+    for invoice_id in invoice_ids:
+        status = erp_outbox.get_sync_status(invoice_id)
+        assert status["status"] == "pending" and status["attempts"] == 0
+        assert status["next_attempt_at"] >= before + 45
+
+
+@pytest.fixture
+def client(database):
+    from backend import main
+
+    user = {"id": 1, "is_admin": False}
+    main.app.dependency_overrides[main.get_current_user] = lambda: user
+    yield TestClient(main.app), user
+    main.app.dependency_overrides.clear()
+
+
+def test_erp_stats_is_admin_only(client):
+    client, user = client
+    assert client.get("/erp/stats").status_code == 403
+
+    user["is_admin"] = True
+    response = client.get("/erp/stats")
+    assert response.status_code == 200
+    assert set(response.json()) >= {"outbox", "throughput", "rate_limit"}
@@ -0,0 +1,108 @@
+# tests/test_erp_outbox.py
+"""The ERP outbox: leases, retries with backoff and the dispatcher, with Zoho faked."""
+import time
+
+import pytest
+
+from backend import erp_outbox
+from backend.db import save_invoice_to_db
+
+from conftest import make_invoice
+
+
+@pytest.fixture
+def zoho(monkeypatch):
+    """push_invoice/resolve_customer as seen by the outbox; `delay` slows every push."""
+    state = {"pushes": [], "delay": 0.0, "fail": None}
+
+    def push(data, customer_id):
+        time.sleep(state["delay"])
+        state["pushes"].append(data["reference_number"])
+        if state["fail"]:
+            return {"status": "error", "message": state["fail"]}
+        return {"status": "success", "data": {"invoice_id": "z-" + data["reference_number"], "invoice_number": "Z1"}}
+
+    monkeypatch.setattr(erp_outbox, "resolve_customer", lambda name, email: "c-1")
+    monkeypatch.setattr(erp_outbox, "push_invoice", push)
+    return state
+
+
+def _queued(reference="INV-1"):
+    return save_invoice_to_db(make_invoice(reference=reference), 1, erp_sync=True)
+
+
+def test_claimed_rows_are_not_claimed_again_while_leased(database):
+    invoice_id = _queued()
+
+    assert [e["invoice_id"] for e in erp_outbox.claim_due()] == [invoice_id]
+    assert erp_outbox.claim_due() == []
+
+
+def test_expired_lease_is_claimed_again_unless_renewed(database, monkeypatch):
+    invoice_id = _queued()
+    monkeypatch.setattr(erp_outbox, "ERP_OUTBOX_LEASE_SECONDS", 0.2)
+    erp_outbox.claim_due()
+
+    time.sleep(0.1)
+    assert erp_outbox.renew_leases([invoice_id]) == 1
+    time.sleep(0.15)
+    assert erp_outbox.claim_due() == []                  # renewed lease still held
+
+    time.sleep(0.1)
+    assert erp_outbox.claim_due()[0]["attempts"] == 2    # a crashed holder's row comes back
+
+
+def test_failures_back_off_then_go_dead(database, zoho, monkeypatch):
+    invoice_id = _queued()
+    zoho["fail"] = "Zoho is down"
+    monkeypatch.setattr(erp_outbox, "ERP_MAX_ATTEMPTS", 3)
+
+    for attempt in range(1, 4):
+        database.execute("UPDATE erp_outbox SET next_attempt_at = 0 WHERE invoice_id = ?", (invoice_id,))
+        database.commit()
+        before = time.time()
+        assert erp_outbox.push_group(erp_outbox.claim_due()) == ["dead" if attempt == 3 else "pending"]
+        status = erp_outbox.get_sync_status(invoice_id)
+        assert status["attempts"] == attempt and status["last_error"] == "Zoho is down"
+        if attempt < 3:
+            assert status["next_attempt_at"] >= before + erp_outbox.ERP_BACKOFF_BASE * 2 ** (attempt - 1) * 0.8
+
+    assert erp_outbox.claim_due() == []
+    assert erp_outbox.requeue(invoice_id)
+    assert erp_outbox.claim_due()[0]["attempts"] == 1
+
+
+def test_late_result_does_not_overwrite_a_row_that_moved_on(database):
+    invoice_id = _queued()
+    entry = erp_outbox.claim_due()[0]
+    erp_outbox.mark_synced(invoice_id, {"invoice_id": "z-1", "invoice_number": "Z1"})
+
+    # A push whose lease ran out reports back after the row was synced elsewhere
+    erp_outbox.mark_failed(invoice_id, entry["attempts"], "timeout")
+    erp_outbox.mark_throttled(invoice_id, 60, "429")
+
+    status = erp_outbox.get_sync_status(invoice_id)
+    assert status["status"] == "synced" and status["zoho_invoice_id"] == "z-1"
+
+
+def test_dispatcher_renews_leases_of_a_slow_batch(database, zoho, monkeypatch):
+    monkeypatch.setattr(erp_outbox, "ERP_OUTBOX_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(erp_outbox, "ERP_OUTBOX_POLL_INTERVAL", 0.05)
+    invoice_ids = [_queued(f"INV-{i}") for i in range(2)]
+    zoho["delay"] = 0.5                                  # the batch outlives the lease several times
+
+    stolen = []
+    erp_outbox.start_outbox_dispatcher()
+    try:
+        deadline = time.time() + 5
+        while time.time() < deadline and erp_outbox.outbox_counts().get("in_flight", 0) < 2:
+            time.sleep(0.01)
+        while time.time() < deadline and len(zoho["pushes"]) < 2:
+            stolen += erp_outbox.claim_due()             # another dispatcher polling
+            time.sleep(0.05)
+    finally:
+        erp_outbox.stop_outbox_dispatcher()
+
+    assert stolen == []
+    assert sorted(zoho["pushes"]) == ["INV-0", "INV-1"]
+    assert all(erp_outbox.get_sync_status(i)["status"] == "synced" for i in invoice_ids)
@@ -0,0 +1,110 @@
+# tests/test_folder_watcher.py
+"""Folder watcher catch-up: the ledger decides what a restart processes, moves or skips."""
+import os
+import time
+
+import pytest
+
+from agents import folder_watcher
+
+
+@pytest.fixture
+def folder(database, tmp_path, monkeypatch):
+    """WATCH_DIR under tmp_path; the pipeline is faked and fails files named fail-*."""
+    watch = tmp_path / "incoming"
+    watch.mkdir()
+    monkeypatch.setattr(folder_watcher, "WATCH_DIR", str(watch))
+    monkeypatch.setattr(folder_watcher, "DONE_DIR", str(watch / "done"))
+    monkeypatch.setattr(folder_watcher, "FAILED_DIR", str(watch / "failed"))
+
+    processed = []
+
+    def process(document):
+        processed.append(document.filename)
+        if document.filename.startswith("fail-"):
+            return {"status": "failed", "error": "not an invoice"}
+        return {"status": "success", "invoice_id": len(processed)}
+
+    monkeypatch.setattr(folder_watcher, "process_document", process)
+    return watch, processed
+
+
+def _drop(watch, name, content=b"%PDF-1.4 invoice", age=60):
+    """A file written `age` seconds ago (older than the settle window, so it is not polled)."""
+    path = watch / name
+    path.write_bytes(content)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _catch_up():
+    pool = folder_watcher.FolderWorkerPool(workers=2, queue_size=10, user_id=1)
+    pool.start()
+    queued = folder_watcher.reconcile(pool)
+    pool.stop()                                        # drains the queue first
+    return queued
+
+
+def _ledger(database):
+    return {os.path.basename(path): status
+            for path, status in database.execute("SELECT path, status FROM folder_ledger")}
+
+
+def test_files_dropped_while_down_are_processed_and_filed(folder, database):
+    watch, processed = folder
+    _drop(watch, "a.pdf")
+    _drop(watch, "fail-b.pdf")
+    _drop(watch, "notes.txt")
+
+    assert _catch_up() == 2
+
+    assert sorted(processed) == ["a.pdf", "fail-b.pdf"]
+    assert sorted(os.listdir(watch / "done")) == ["a.pdf"]
+    assert sorted(os.listdir(watch / "failed")) == ["fail-b.pdf", "fail-b.pdf.error.txt"]
+    assert _ledger(database) == {"a.pdf": "done", "fail-b.pdf": "failed"}
+
+
+def test_finished_file_left_behind_by_a_crash_is_moved_not_reprocessed(folder, database):
+    watch, processed = folder
+    path = _drop(watch, "a.pdf")
+    # Crash after the ledger said done, before the move
+    folder_watcher.ledger_record(str(path), os.stat(path), "done", invoice_id=1)
+
+    assert _catch_up() == 0
+
+    assert processed == []
+    assert os.listdir(watch / "done") == ["a.pdf"]
+
+
+def test_file_changed_since_it_was_recorded_is_processed_again(folder, database):
+    watch, processed = folder
+    path = _drop(watch, "a.pdf")
+    folder_watcher.ledger_record(str(path), os.stat(path), "done", invoice_id=1)
+    _drop(watch, "a.pdf", content=b"%PDF-1.4 corrected invoice", age=30)
+
+    assert _catch_up() == 1
+    assert processed == ["a.pdf"]
+
+
+def test_file_interrupted_mid_processing_is_retried(folder, database):
+    watch, processed = folder
+    path = _drop(watch, "a.pdf")
+    folder_watcher.ledger_record(str(path), os.stat(path), "processing", content_hash="h")
+
+    assert _catch_up() == 1
+    assert processed == ["a.pdf"]
+    assert _ledger(database) == {"a.pdf": "done"}
+
+
+def test_created_and_closed_events_queue_a_file_once(folder):
+    watch, processed = folder
+    path = _drop(watch, "a.pdf")
+    pool = folder_watcher.FolderWorkerPool(workers=1, queue_size=10, user_id=1)
+
+    pool.submit(str(path))                             # on_created
+    pool.submit(str(path), closed=True)                # on_closed, before a worker picked it up
+    pool.start()
+    pool.stop()
+
+    assert processed == ["a.pdf"]
@@ -0,0 +1,103 @@
+# tests/test_job_queue.py
+"""Durable job queue: leases, renewal while a job waits in the pipeline, retries and backpressure."""
+import os
+import queue
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from backend import job_queue
+
+
+@pytest.fixture
+def jobs(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_SPOOL_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(job_queue, "JOB_POLL_INTERVAL", 0.05)
+    yield job_queue
+    job_queue.stop_job_dispatcher()
+
+
+class FakePipeline:
+    """submit() like StagedPipeline's: reports stages, returns a Future the test completes."""
+
+    def __init__(self, full=False):
+        self.full = full
+        self.futures = []
+
+    def submit(self, document, on_stage=None, timeout=None):
+        if self.full:
+            time.sleep(timeout)
+            raise queue.Full
+        on_stage("ocr")
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    assert condition()
+
+
+def test_job_runs_through_the_pipeline(jobs):
+    job_id = jobs.enqueue_job(1, "a.pdf", b"%PDF-1.4")
+    pipeline = FakePipeline()
+    jobs.start_job_dispatcher(pipeline.submit)
+
+    _wait_for(lambda: pipeline.futures)
+    assert jobs.get_job(job_id)["stage"] == "ocr"
+    pipeline.futures[0].set_result({"status": "success", "invoice_id": 7})
+
+    _wait_for(lambda: jobs.get_job(job_id)["status"] == "done")
+    job = jobs.get_job(job_id)
+    assert job["result"]["invoice_id"] == 7 and "finished_at" in job["stages"]["ocr"]
+    assert os.listdir(jobs.JOB_SPOOL_DIR) == []           # spool removed once the job is done
+
+
+def test_queued_job_keeps_its_lease_until_it_finishes(jobs, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", 0.3)
+    job_id = jobs.enqueue_job(1, "a.pdf", b"%PDF-1.4")
+    pipeline = FakePipeline()
+    jobs.start_job_dispatcher(pipeline.submit)
+    _wait_for(lambda: pipeline.futures)
+
+    # Several lease lengths pass while the job sits in the pipeline
+    deadline = time.time() + 1.0
+    while time.time() < deadline:
+        assert jobs.claim_job() is None                    # another dispatcher polling
+        time.sleep(0.05)
+
+    pipeline.futures[0].set_result({"status": "success"})
+    _wait_for(lambda: jobs.get_job(job_id)["status"] == "done")
+    assert jobs.get_job(job_id)["attempts"] == 1
+
+
+def test_expired_job_is_retried_then_given_up(jobs, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", 0)
+    job_id = jobs.enqueue_job(1, "a.pdf", b"%PDF-1.4")
+
+    for attempt in range(1, jobs.JOB_MAX_ATTEMPTS + 2):
+        job = jobs.claim_job()                             # the previous holder "crashed"
+        assert job["id"] == job_id and job["attempts"] == attempt
+        time.sleep(0.01)
+
+    jobs._dispatch_one(job, FakePipeline().submit)
+    failed = jobs.get_job(job_id)
+    assert failed["status"] == "failed" and "Gave up" in failed["error"]
+    assert jobs.claim_job() is None
+
+
+def test_full_pipeline_leaves_the_job_leased_on_stop(jobs):
+    job_id = jobs.enqueue_job(1, "a.pdf", b"%PDF-1.4")
+    jobs.start_job_dispatcher(FakePipeline(full=True).submit)
+    _wait_for(lambda: jobs.get_job(job_id)["status"] == "running")
+
+    jobs.stop_job_dispatcher()
+
+    job = jobs.get_job(job_id)
+    assert job["status"] == "running" and job["lease_until"] > time.time()   # taken over after the lease
+    assert os.listdir(jobs.JOB_SPOOL_DIR) == [job_id]
+    assert not jobs._in_flight
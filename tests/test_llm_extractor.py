@@ -0,0 +1,84 @@
+# tests/test_llm_extractor.py
+"""The real Groq callers (classifier + extractor) with only the HTTP call faked."""
+import json
+
+import pytest
+import requests
+
+from backend import metrics, pipeline
+from backend.document import Document
+from backend.llm_extractor import extract_fields_raw
+
+INVOICE_JSON = {
+    "customer_name": "Acme Corp",
+    "email": "billing@acme.example",
+    "invoice_date": "2024-03-01",
+    "reference_number": "INV-77",
+    "items": [{"description": "Blue widget", "quantity": 2, "rate": 5}],
+}
+INVOICE_REPLY = "```json\n" + json.dumps(INVOICE_JSON) + "\n```"
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200):
+        self.status_code = status_code
+        self._body = {
+            "choices": [{"message": {"content": content}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20},
+        }
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def groq(monkeypatch):
+    """Answers like Groq: a label for the classifier, fenced JSON for the extractor."""
+    calls = []
+
+    def post(url, headers=None, json=None, timeout=None):
+        prompt = json["messages"][-1]["content"]
+        calls.append(prompt)
+        if "document classifier" in prompt:
+            return FakeResponse("invoice")
+        return FakeResponse(INVOICE_REPLY)
+
+    monkeypatch.setattr(requests, "post", post)
+    return calls
+
+
+def _tokens(kind):
+    return metrics.LLM_TOKENS._values.get(("extract", kind), 0)
+
+
+def test_extract_fields_raw_parses_the_response(groq):
+    prompt_tokens = _tokens("prompt")
+
+    fields, raw = extract_fields_raw("ACME CORP  INVOICE INV-77\x00 Blue widget 2 x 5")
+
+    assert fields == INVOICE_JSON
+    assert raw.startswith("```json")
+    assert "\x00" not in groq[0]             # OCR text is sanitized before it is sent
+    assert _tokens("prompt") == prompt_tokens + 100
+
+
+def test_extract_fields_raw_falls_back_when_the_call_fails(monkeypatch):
+    def post(*args, **kwargs):
+        raise requests.ConnectionError("groq unreachable")
+
+    monkeypatch.setattr(requests, "post", post)
+    fields, raw = extract_fields_raw("anything")
+
+    assert raw is None
+    assert fields["customer_name"] is None and fields["items"] == []
+
+
+def test_pipeline_runs_the_real_llm_stage(database, groq, monkeypatch):
+    monkeypatch.setattr(pipeline, "extract_text_from_image", lambda content, word_boxes=None, path=None: "ACME INV-77")
+
+    result = pipeline.process_document(Document.from_bytes(b"scan", 1, "cli", "scan.pdf"))
+
+    assert result["status"] == "success", result
+    assert result["data"]["customer_name"] == "Acme Corp"
+    assert result["data"]["total"] == 10.0
+    assert len(groq) == 2                    # classify + extract
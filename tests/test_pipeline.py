@@ -0,0 +1,61 @@
+# tests/test_pipeline.py
+"""A file OCR cannot read fails with a 400 and leaves the StagedPipeline usable."""
+import pytest
+from fastapi import HTTPException
+
+from backend.db import add_fingerprint_alias, save_invoice_to_db
+from backend.document import Document
+from backend.pipeline import StagedPipeline
+
+from conftest import make_invoice
+
+
+@pytest.fixture
+def staged(database):
+    pipeline = StagedPipeline(workers={"ocr": 1, "llm": 1, "store": 1}).start()
+    yield pipeline
+    pipeline.shutdown()
+
+
+def _rejected(future):
+    with pytest.raises(HTTPException) as e:
+        future.result(timeout=60)
+    return e.value
+
+
+def test_unreadable_bytes_fail_with_400(staged):
+    error = _rejected(staged.submit(Document.from_bytes(b"not an invoice", 1, "api", "junk.pdf")))
+    assert error.status_code == 400
+    assert "neither a valid PDF nor an image" in error.detail
+
+
+def test_unreadable_file_fail_with_400(staged, tmp_path):
+    path = tmp_path / "junk.pdf"
+    path.write_bytes(b"%PDF-1.4 truncated")
+    with Document.from_path(str(path), 1, "folder") as document:
+        error = _rejected(staged.submit(document))
+    assert error.status_code == 400
+
+
+def test_later_submissions_still_work(staged, tmp_path):
+    for i in range(3):
+        # Alternate in-memory and path-backed documents through the same OCR process pool
+        if i % 2:
+            path = tmp_path / f"junk-{i}.png"
+            path.write_bytes(b"garbage %d" % i)
+            document = Document.from_path(str(path), 1, "folder")
+        else:
+            document = Document.from_bytes(b"garbage %d" % i, 1, "api")
+        assert _rejected(staged.submit(document)).status_code == 400
+        document.close()
+
+    # A known document still completes after the failures
+    data = make_invoice()
+    invoice_id = save_invoice_to_db(data, 1)
+    known = Document.from_bytes(b"known invoice", 1, "api")
+    add_fingerprint_alias(1, known.content_hash, invoice_id, data)
+    result = staged.submit(known).result(timeout=60)
+    assert result["status"] == "success" and result["invoice_id"] == invoice_id
+
+    stats = staged.stats()["ocr"]
+    assert stats["failed"] == 3 and stats["processed"] == 4
@@ -0,0 +1,66 @@
+# tests/test_query_engine.py
+"""Streaming chatbot answers: the sql event goes out before the SQL runs."""
+import pytest
+
+from backend import query_engine
+from backend.db import save_invoice_to_db
+
+from conftest import make_invoice
+
+
+@pytest.fixture
+def timeline(monkeypatch):
+    """Records stream events and SQL executions in the order they happen; LLM calls are faked."""
+    log = []
+    run_sql = query_engine.run_sql
+
+    def traced_run_sql(query, sql, params=()):
+        log.append(("executed", query))
+        return run_sql(query, sql, params)
+
+    monkeypatch.setattr(query_engine, "run_sql", traced_run_sql)
+    monkeypatch.setattr(query_engine, "generate_user_sql",
+                        lambda question: "SELECT customer_name, total FROM invoices")
+    monkeypatch.setattr(query_engine, "call_groq_stream", lambda messages: iter(["Acme ", "owes 10."]))
+    monkeypatch.setattr(query_engine, "call_groq", lambda messages, **kwargs: "Acme owes 10.")
+    return log
+
+
+def _stream(question, log):
+    for event, data in query_engine.question_to_answer_stream(question, 1):
+        log.append((event, data))
+    return log
+
+
+def _order(log):
+    return [entry[0] if entry[0] != "executed" else f"executed:{entry[1]}" for entry in log]
+
+
+def test_generated_sql_is_announced_before_it_runs(database, timeline):
+    save_invoice_to_db(make_invoice(), 1)
+
+    log = _stream("What does Acme owe?", timeline)
+
+    assert _order(log) == ["sql", "executed:generated", "rows", "token", "token", "done"]
+    assert log[0][1]["sql"] == "SELECT customer_name, total FROM invoices"
+    assert log[-1][1]["answer"] == "Acme owes 10."
+
+
+def test_search_sql_is_announced_before_it_runs(database, timeline):
+    save_invoice_to_db(make_invoice(items=[("Toner cartridge", 1, 10.0)]), 1)
+
+    log = _stream("Invoices mentioning toner", timeline)
+
+    assert _order(log)[:3] == ["sql", "executed:search", "rows"]
+    assert log[0][1]["sql"].startswith("-- full-text search")
+
+
+def test_empty_search_announces_the_generated_sql_next(database, timeline):
+    save_invoice_to_db(make_invoice(), 1)
+
+    log = _stream("Invoices mentioning toner", timeline)
+
+    assert _order(log)[:5] == ["sql", "executed:search", "sql", "executed:generated", "rows"]
+
+    answer = query_engine.question_to_answer("Invoices mentioning toner", 1)
+    assert answer["ok"] and answer["sql"].startswith("SELECT customer_name")
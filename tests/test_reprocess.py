@@ -0,0 +1,75 @@
+# tests/test_reprocess.py
+"""Reprocessing from stored artifacts: failed LLM calls and fingerprint keys."""
+import json
+
+from backend import artifact_store, reprocess
+from backend.db import find_fingerprint_by_key, save_invoice_to_db, update_invoice
+from backend.fingerprint import invoice_key
+
+from conftest import make_invoice
+
+
+def _extracted(customer="Acme Corp", reference="INV-1"):
+    data = make_invoice(customer=customer, reference=reference)
+    data["items"] = data.pop("line_items")
+    return data
+
+
+def _stored_invoice(data=None):
+    data = data or make_invoice()
+    invoice_id = save_invoice_to_db(data, 1, content_hash=f"hash-{data['reference_number']}",
+                                    invoice_key=invoice_key(data))
+    artifact_store.save_artifacts(invoice_id, {
+        artifact_store.OCR_TEXT: "ACME INV-1",
+        artifact_store.EXTRACTED: json.dumps(_extracted()),
+    })
+    return invoice_id
+
+
+def test_failed_llm_call_keeps_the_archived_extraction(database, monkeypatch):
+    invoice_id = _stored_invoice()
+    fallback = {"customer_name": None, "email": None, "invoice_date": None, "reference_number": None, "items": []}
+    monkeypatch.setattr(reprocess, "extract_fields_raw", lambda text: (fallback, None))
+
+    result = reprocess.reprocess_invoice(invoice_id)
+
+    assert result["status"] == "failed"
+    assert artifact_store.load_artifact(invoice_id, artifact_store.EXTRACTED, as_json=True) == _extracted()
+    assert reprocess.reprocess_invoice(invoice_id, skip_llm=True)["status"] == "success"
+
+
+def test_reprocessing_rewrites_the_invoice_and_its_artifacts(database, monkeypatch):
+    invoice_id = _stored_invoice()
+    fixed = _extracted(customer="Acme Corporation")
+    monkeypatch.setattr(reprocess, "extract_fields_raw", lambda text: (dict(fixed), json.dumps(fixed)))
+
+    result = reprocess.reprocess_invoice(invoice_id)
+
+    assert result["status"] == "success"
+    assert artifact_store.load_artifact(invoice_id, artifact_store.EXTRACTED, as_json=True) == fixed
+    row = database.execute("SELECT customer_name FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+    assert row[0] == "Acme Corporation"
+
+
+def test_update_invoice_recomputes_the_fingerprint_key(database):
+    old = make_invoice(customer="Acme Corp")
+    invoice_id = save_invoice_to_db(old, 1, content_hash="h1", invoice_key=invoice_key(old))
+
+    new = make_invoice(customer="Globex")
+    update_invoice(invoice_id, new)
+
+    assert find_fingerprint_by_key(1, invoice_key(new))["invoice_id"] == invoice_id
+    assert find_fingerprint_by_key(1, invoice_key(old)) is None
+
+
+def test_update_invoice_clears_a_key_another_invoice_holds(database):
+    first = make_invoice(customer="Acme Corp")
+    first_id = save_invoice_to_db(first, 1, content_hash="h1", invoice_key=invoice_key(first))
+    second = make_invoice(customer="Globex")
+    second_id = save_invoice_to_db(second, 1, content_hash="h2", invoice_key=invoice_key(second))
+
+    # Reprocessing shows the second file is the same invoice as the first
+    update_invoice(second_id, make_invoice(customer="Acme Corp"))
+
+    assert find_fingerprint_by_key(1, invoice_key(first))["invoice_id"] == first_id
+    assert find_fingerprint_by_key(1, invoice_key(second)) is None
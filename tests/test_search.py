@@ -0,0 +1,55 @@
+# tests/test_search.py
+"""Full-text search stays in sync with invoices through insert, update and delete."""
+from backend.db import save_invoice_to_db, update_invoice
+from backend.query_engine import fts_query, search_invoices
+
+from conftest import make_invoice
+
+
+def _matches(text, user_id=1):
+    result = search_invoices(text, user_id)
+    assert "error" not in result, result
+    return [dict(zip(result["columns"], row)) for row in result["rows"]]
+
+
+def test_fts_query_quotes_every_word_as_prefix():
+    assert fts_query("Blue widgets!") == '"blue"* "widgets"*'
+    assert fts_query('a" OR 1=1 --') == '"a"* "or"* "1"* "1"*'
+    assert fts_query("  ?! ") is None
+
+
+def test_search_finds_inserted_items_and_customers(database):
+    save_invoice_to_db(make_invoice(customer="Acme Corp", items=[("Blue widget", 2, 5.0)]), 1)
+    save_invoice_to_db(make_invoice(customer="Globex", reference="INV-2", items=[("Steel bolts", 10, 0.5)]), 1)
+
+    items = _matches("widgets")    # porter stemming + prefix
+    assert [(m["matched_on"], m["description"]) for m in items] == [("item", "Blue widget")]
+
+    customers = _matches("globex")
+    assert [(m["matched_on"], m["customer_name"]) for m in customers] == [("customer", "Globex")]
+
+
+def test_search_is_scoped_to_the_user(database):
+    save_invoice_to_db(make_invoice(), 1)
+    assert _matches("widget", user_id=2) == []
+
+
+def test_search_follows_updates(database):
+    invoice_id = save_invoice_to_db(make_invoice(customer="Acme Corp", items=[("Blue widget", 2, 5.0)]), 1)
+
+    update_invoice(invoice_id, make_invoice(customer="Initech", items=[("Red stapler", 1, 12.0)]))
+
+    assert _matches("widget") == []
+    assert _matches("acme") == []
+    assert [m["description"] for m in _matches("stapler")] == ["Red stapler"]
+    assert [m["customer_name"] for m in _matches("initech")] == ["Initech"]
+
+
+def test_search_forgets_deleted_invoices(database):
+    invoice_id = save_invoice_to_db(make_invoice(customer="Acme Corp", items=[("Blue widget", 2, 5.0)]), 1)
+    with database:
+        database.execute("DELETE FROM invoice_items WHERE invoice_id = ?", (invoice_id,))
+        database.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+
+    assert _matches("widget") == []
+    assert _matches("acme") == []
@@ -0,0 +1,100 @@
+# tests/test_zoho_auth.py
+"""Shared Zoho access token: one refresh for many callers, refresh ahead of expiry, 401 handling."""
+import threading
+import time
+
+import pytest
+import requests
+
+from backend import erp_integration, zoho_auth
+
+
+class FakeResponse:
+    def __init__(self, body=None, status_code=200):
+        self._body = body or {}
+        self.status_code = status_code
+        self.headers = {}
+
+    def json(self):
+        return self._body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+
+@pytest.fixture
+def accounts(database, monkeypatch):
+    """accounts.zoho.in's token endpoint: hands out token-1, token-2, ... valid for `expires_in`."""
+    state = {"exchanges": 0, "delay": 0.0, "expires_in": 3600, "fail": False}
+
+    def post(url, params=None, timeout=None):
+        time.sleep(state["delay"])
+        if state["fail"]:
+            return FakeResponse({"error": "invalid_client"}, status_code=400)
+        state["exchanges"] += 1
+        return FakeResponse({"access_token": f"token-{state['exchanges']}", "expires_in": state["expires_in"]})
+
+    for name in ("ZOHO_CLIENT_ID", "ZOHO_CLIENT_SECRET", "ZOHO_REFRESH_TOKEN"):
+        monkeypatch.setenv(name, "test")
+    monkeypatch.setattr(requests, "post", post)
+    monkeypatch.setattr(zoho_auth, "_cached", {"token": None, "expires_at": 0.0})
+    return state
+
+
+def test_concurrent_callers_share_one_exchange(accounts):
+    accounts["delay"] = 0.2
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(zoho_auth.get_zoho_access_token())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert tokens == ["token-1"] * 8
+    assert accounts["exchanges"] == 1
+
+
+def test_token_is_reused_from_memory_and_from_the_db(accounts, monkeypatch):
+    assert zoho_auth.get_zoho_access_token() == "token-1"
+    assert zoho_auth.get_zoho_access_token() == "token-1"
+
+    # Another process: empty memory cache, same table
+    monkeypatch.setattr(zoho_auth, "_cached", {"token": None, "expires_at": 0.0})
+    assert zoho_auth.get_zoho_access_token() == "token-1"
+    assert accounts["exchanges"] == 1
+
+
+def test_token_close_to_expiry_is_refreshed_ahead_of_time(accounts):
+    accounts["expires_in"] = zoho_auth.ZOHO_TOKEN_REFRESH_MARGIN / 2 - 10   # inside the in-memory margin too
+    assert zoho_auth.get_zoho_access_token() == "token-1"
+
+    accounts["expires_in"] = 3600
+    assert zoho_auth.get_zoho_access_token() == "token-2"
+
+
+def test_failed_refresh_releases_the_lease(accounts):
+    accounts["fail"] = True
+    assert zoho_auth.get_zoho_access_token() is None
+
+    accounts["fail"] = False
+    assert zoho_auth.get_zoho_access_token() == "token-1"   # not blocked by a stale refresh lease
+
+
+def test_rejected_token_is_replaced_and_the_call_retried(accounts, monkeypatch):
+    seen = []
+
+    def request(method, endpoint, url, headers=None, **kwargs):
+        seen.append(headers["Authorization"])
+        return FakeResponse(status_code=401 if len(seen) == 1 else 200)
+
+    monkeypatch.setattr(erp_integration, "_governed_request", request)
+    resp = erp_integration.zoho_request("GET", "contacts.list", "https://zoho.test/contacts")
+
+    assert resp.status_code == 200
+    assert seen == ["Zoho-oauthtoken token-1", "Zoho-oauthtoken token-2"]
+
+    # A late 401 for the replaced token does not throw the new one away
+    zoho_auth.invalidate_access_token("token-1")
+    assert zoho_auth.get_zoho_access_token() == "token-2"
+    assert accounts["exchanges"] == 2
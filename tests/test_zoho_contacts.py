@@ -0,0 +1,150 @@
+# tests/test_zoho_contacts.py
+"""Local Zoho contact index: syncs, local creates and the one-syncer-at-a-time lease."""
+import threading
+import time
+
+import pytest
+
+from backend import erp_integration, zoho_contacts
+
+
+def _contact(contact_id, name, modified="2024-05-01T10:00:00+0000"):
+    return {"contact_id": contact_id, "contact_name": name, "last_modified_time": modified}
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    text = ""
+
+    def __init__(self, body):
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def index(database, monkeypatch):
+    """A fresh in-memory index over the test database."""
+    monkeypatch.setattr(zoho_contacts, "_index",
+                        {"version": None, "checked_at": 0.0, "exact": {}, "trigrams": {}, "sizes": {}})
+    return zoho_contacts
+
+
+@pytest.fixture
+def zoho(monkeypatch):
+    """Zoho's contacts.list over a mutable list of contacts (one page)."""
+    state = {"contacts": [], "calls": 0, "delay": 0.0}
+
+    def request(method, endpoint, url, params=None, **kwargs):
+        state["calls"] += 1
+        time.sleep(state["delay"])
+        contacts = list(state["contacts"])
+        if params.get("sort_column") == "last_modified_time":
+            contacts.sort(key=lambda c: c["last_modified_time"], reverse=True)
+        return FakeResponse({"contacts": contacts, "page_context": {"has_more_page": False}})
+
+    monkeypatch.setattr(erp_integration, "zoho_request", request)
+    return state
+
+
+def test_find_contact_exact_and_fuzzy(index):
+    index.upsert_contacts([_contact("1", "Consolidated Industrial Supplies Pvt Ltd"), _contact("2", "Globex")], full=True)
+
+    assert index.find_contact("CONSOLIDATED INDUSTRIAL SUPPLIES") == "1"   # legal suffixes dropped
+    assert index.find_contact("Consolidated Industrlal Supplies") == "1"   # OCR typo, fuzzy match
+    assert index.find_contact("Initech") is None
+
+
+def test_add_contact_leaves_sync_time_and_watermark_alone(index):
+    index.upsert_contacts([_contact("1", "Acme", "2024-05-01T10:00:00+0000")], full=True)
+    before = index.sync_state()
+
+    index.add_contact(_contact("2", "Globex", "2024-06-01T10:00:00+0000"))
+
+    assert index.sync_state() == before
+    assert index.find_contact("Globex") == "2"
+
+
+def test_add_contact_reaches_other_processes_indexes(index, monkeypatch):
+    index.upsert_contacts([_contact("1", "Acme")], full=True)
+    index.find_contact("Acme")
+    # Another process: holds the index as loaded before the create below
+    other = {
+        **index._index, "checked_at": 0.0, "exact": dict(index._index["exact"]), "sizes": dict(index._index["sizes"]),
+        "trigrams": {gram: set(ids) for gram, ids in index._index["trigrams"].items()},
+    }
+
+    index.add_contact(_contact("2", "Globex"))
+
+    monkeypatch.setattr(index, "_index", other)
+    assert "globex" not in other["exact"]
+    assert index.find_contact("Globex") == "2"
+
+
+def test_full_sync_keeps_contacts_created_while_it_ran(index):
+    index.upsert_contacts([_contact("1", "Acme"), _contact("2", "Deleted In Zoho")], full=True)
+    started = time.time()
+    index.add_contact(_contact("3", "Globex"))              # created after the sync listed Zoho
+
+    index.upsert_contacts([_contact("1", "Acme")], full=True, started=started)
+
+    assert index.find_contact("Globex") == "3"
+    assert index.find_contact("Deleted In Zoho") is None
+    assert index.contact_count() == 2
+
+
+def test_incremental_sync_is_not_cut_short_by_local_creates(index, zoho):
+    zoho["contacts"] = [_contact("1", "Acme", "2024-05-01T10:00:00+0000")]
+    erp_integration.sync_contacts()                          # first sync is full
+
+    # Changed in Zoho after that sync, then a newer local create
+    zoho["contacts"].append(_contact("2", "Globex", "2024-05-02T10:00:00+0000"))
+    index.add_contact(_contact("3", "Initech", "2024-05-03T10:00:00+0000"))
+    zoho["contacts"].append(_contact("3", "Initech", "2024-05-03T10:00:00+0000"))
+
+    erp_integration.sync_contacts()
+
+    assert index.find_contact("Globex") == "2"
+
+
+def test_concurrent_callers_sync_once(index, zoho):
+    zoho["contacts"] = [_contact("1", "Acme")]
+    zoho["delay"] = 0.2
+    results = []
+
+    def lookup():
+        results.append(erp_integration.get_customer_id("Acme"))
+
+    threads = [threading.Thread(target=lookup) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ["1"] * 4
+    assert zoho["calls"] == 1
+
+
+def test_sync_lease_is_exclusive_and_renewable(index):
+    holder = index.claim_sync()
+    assert holder
+    assert index.claim_sync() is None                        # someone else is syncing
+    assert index.claim_sync(holder) == holder                # the holder renews
+
+    index.release_sync(holder)
+    assert index.claim_sync() is not None
+
+
+def test_sync_waits_for_another_process_then_gives_up(index, zoho, monkeypatch):
+    index.claim_sync()                                       # held by "another process"
+    monkeypatch.setattr(index, "ZOHO_CONTACT_SYNC_WAIT", 0.6)
+
+    with pytest.raises(TimeoutError):
+        erp_integration.sync_contacts()
+    assert zoho["calls"] == 0
+
+    # A miss is not trusted while the index could not be refreshed
+    with pytest.raises(TimeoutError):
+        erp_integration.get_customer_id("Acme")